@@ -1,9 +1,13 @@
-import os
-import sys
+"""
+Adds the ZYNC shelf at Maya startup. The plugin itself, its config and the
+ZYNC API are only loaded when the shelf button is first used, unless
+ZYNC_PREWARM is set, in which case they are loaded in the background once
+Maya is up, or submissions waiting in the queue of zync_queue.py can be sent
+again with $ZYNC_USERNAME and $ZYNC_PASSWORD.
+"""
 
-import zync_maya
+import os
 
-import maya.cmds as cmds
 import maya.mel
 import maya.utils
 
@@ -12,6 +16,22 @@ def create_zync_shelf():
     shelfTab = maya.mel.eval('global string $gShelfTopLevel;')
     maya.mel.eval('global string $scriptsShelf;')
     maya.mel.eval('$scriptsShelf = `shelfLayout -p $gShelfTopLevel ZYNC`;')
-    maya.mel.eval('shelfButton -parent $scriptsShelf -annotation "Render on ZYNC" -label "Render on ZYNC" -image "zync.png" -sourceType "python" -command ("zync_maya.submit_dialog()") -width 34 -height 34 -style "iconOnly";')
+    maya.mel.eval('shelfButton -parent $scriptsShelf -annotation "Render on ZYNC" -label "Render on ZYNC" -image "zync.png" -sourceType "python" -command ("import zync_maya; zync_maya.submit_dialog()") -width 34 -height 34 -style "iconOnly";')
+
+def prewarm_zync():
+    import zync_maya
+    zync_maya.prewarm()
+
+def resume_zync_queue():
+    import zync_queue
+    if zync_queue.SubmissionQueue().pending_count():
+        import zync_maya
+        try:
+            zync_maya.resume_submissions()
+        except Exception, e:
+            print 'Could not resume queued ZYNC submissions: %s' % e
 
 maya.utils.executeDeferred( create_zync_shelf )
+maya.utils.executeDeferred( resume_zync_queue )
+if os.environ.get('ZYNC_PREWARM'):
+    maya.utils.executeDeferred( prewarm_zync )
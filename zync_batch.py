@@ -0,0 +1,262 @@
+"""
+ZYNC Batch Submit
+
+Submits Maya scenes to ZYNC without the submit dialog. Each scene is opened
+and submitted by its own mayapy process, with up to --workers processes
+running at once. The params start out as the submit dialog would fill them in
+for each scene, and are then updated with the given overrides. With
+QUEUE_SUBMISSIONS set in config_maya.py, a scene that can't reach ZYNC is
+queued rather than failed, and sent by the next run; see zync_queue.py.
+
+Usage:
+    python zync_batch.py -u user shot010.ma shot020.ma
+    python zync_batch.py -u user --jobs jobs.json --set chunk_size=5 -j 4
+
+jobs.json holds a list of {"scene": path, "overrides": {...}} entries. The
+password is read from ZYNC_PASSWORD, or prompted for.
+
+From Python:
+    import zync_batch
+    results = zync_batch.submit_scenes(['shot010.ma'], username='user', password='...')
+
+"""
+
+import getpass
+import json
+import optparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import Queue
+
+RESULT_MARKER = 'ZYNC_BATCH_RESULT '
+
+DEFAULT_WORKERS = 4
+
+def default_executable():
+    """Returns the mayapy used for the worker processes"""
+    if os.environ.get('MAYAPY'):
+        return os.environ['MAYAPY']
+    if os.environ.get('MAYA_LOCATION'):
+        return os.path.join(os.environ['MAYA_LOCATION'], 'bin', 'mayapy')
+    return 'mayapy'
+
+def parse_value(value):
+    """Returns value decoded as JSON if possible, otherwise as a plain string"""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def load_overrides(value):
+    """Returns the overrides dict from a JSON file path or a JSON string"""
+    if os.path.isfile(value):
+        f = open(value)
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    return json.loads(value)
+
+def run_worker(scene, overrides=None, path_mappings=(), username=None, password=None):
+    """
+    Opens and submits a single scene in this process, returning a result dict
+    with 'scene', 'status' ('ok', 'queued' or 'failed'), 'seconds' and either
+    the submitted 'layers' and 'frange' or the 'error'. A submission that
+    couldn't reach ZYNC and was queued to retry has the job's id as
+    'queued'. Maya is initialised in
+    standalone mode if it is available; otherwise whichever maya.cmds is on
+    the path is used, which allows running against a stub.
+    """
+    start = time.time()
+    result = {'scene': scene}
+    try:
+        try:
+            import maya.standalone
+        except ImportError:
+            pass
+        else:
+            maya.standalone.initialize(name='python')
+        import zync_maya
+        username = username or os.environ.get('ZYNC_USERNAME')
+        password = password or os.environ.get('ZYNC_PASSWORD')
+        # submissions queued by earlier runs are sent first, if they are due
+        zync_maya.resume_submissions(username, password, background=False)
+        params = zync_maya.submit_scene(scene, overrides, username, password,
+                                        [tuple(m) for m in path_mappings])
+        result['status'] = params.get('queued') and 'queued' or 'ok'
+        result['queued'] = params.get('queued')
+        result['layers'] = params.get('selected_layers')
+        result['frange'] = params.get('frange')
+    except Exception, e:
+        result['status'] = 'failed'
+        result['error'] = str(e) or e.__class__.__name__
+    result['seconds'] = time.time() - start
+    return result
+
+def _run_process(executable, job, path_mappings, env):
+    """Submits one job in a worker process, returning its result dict"""
+    start = time.time()
+    args = [executable, os.path.abspath(__file__), '--worker',
+            '--overrides', json.dumps(job.get('overrides') or {}),
+            '--mappings', json.dumps(list(path_mappings)),
+            job['scene']]
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+    except OSError, e:
+        return {'scene': job['scene'], 'status': 'failed', 'seconds': 0.0,
+                'error': 'Could not start %s: %s' % (executable, e)}
+    output = process.communicate()[0]
+
+    result = None
+    for line in output.splitlines():
+        if line.startswith(RESULT_MARKER):
+            result = json.loads(line[len(RESULT_MARKER):])
+    if result is None:
+        result = {'scene': job['scene'], 'status': 'failed',
+                  'error': 'Worker exited with code %s without a result' % process.returncode}
+    result['seconds'] = time.time() - start
+    result['log'] = output
+    return result
+
+def submit_scenes(jobs, overrides=None, path_mappings=(), username=None, password=None,
+                  workers=DEFAULT_WORKERS, executable=None, callback=None):
+    """
+    Submits each job in its own worker process, at most workers at a time.
+    jobs is a list of scene paths or {'scene': path, 'overrides': {...}} dicts;
+    overrides are applied to every job, below the job's own overrides.
+    callback(result) is called as each job finishes. Returns the list of
+    result dicts, in the order of jobs.
+    """
+    executable = executable or default_executable()
+    env = dict(os.environ)
+    if username:
+        env['ZYNC_USERNAME'] = username
+    if password:
+        env['ZYNC_PASSWORD'] = password
+    # workers import zync_maya from this folder
+    plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join([p for p in (plugin_dir, env.get('PYTHONPATH')) if p])
+
+    tasks = Queue.Queue()
+    for i, job in enumerate(jobs):
+        if isinstance(job, basestring):
+            job = {'scene': job}
+        merged = dict(overrides or {})
+        merged.update(job.get('overrides') or {})
+        tasks.put((i, {'scene': job['scene'], 'overrides': merged}))
+
+    results = [None] * len(jobs)
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            try:
+                i, job = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            result = _run_process(executable, job, path_mappings, env)
+            lock.acquire()
+            try:
+                results[i] = result
+                if callback is not None:
+                    callback(result)
+            finally:
+                lock.release()
+
+    threads = []
+    for _ in range(max(1, min(workers, len(jobs)))):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+def summarize(results):
+    """Returns a one line summary of the results"""
+    failed = len([r for r in results if r['status'] == 'failed'])
+    queued = len([r for r in results if r['status'] == 'queued'])
+    seconds = sum([r.get('seconds', 0.0) for r in results])
+    summary = '%d submitted, %d failed' % (len(results) - failed - queued, failed)
+    if queued:
+        summary += ', %d queued to retry' % queued
+    return '%s, %.1fs of worker time' % (summary, seconds)
+
+def _print_result(result):
+    if result['status'] == 'ok':
+        print 'OK      %s (%s, frames %s) %.1fs' % (result['scene'], ','.join(result.get('layers') or []) or 'upload only',
+                                                   result.get('frange'), result['seconds'])
+    elif result['status'] == 'queued':
+        print 'QUEUED  %s as %s, ZYNC could not be reached' % (result['scene'], result.get('queued'))
+    else:
+        print 'FAILED  %s: %s' % (result['scene'], result.get('error'))
+    sys.stdout.flush()
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] SCENE...')
+    parser.add_option('-u', '--username', default=os.environ.get('ZYNC_USERNAME'),
+                      help='ZYNC username, defaults to $ZYNC_USERNAME')
+    parser.add_option('--jobs', help='JSON file with a list of {"scene": ..., "overrides": {...}} jobs')
+    parser.add_option('--overrides', help='JSON file or string of params applied to every scene')
+    parser.add_option('--set', action='append', default=[], metavar='KEY=VALUE',
+                      help='override a single param for every scene, may be repeated')
+    parser.add_option('--map', action='append', default=[], metavar='FROM=TO',
+                      help='add a path mapping, may be repeated')
+    parser.add_option('-j', '--workers', type='int', default=DEFAULT_WORKERS,
+                      help='number of scenes submitted at once')
+    parser.add_option('--mayapy', default=None,
+                      help='interpreter for the worker processes, defaults to %s' % default_executable())
+    parser.add_option('--log-dir', help='write the output of each worker to this folder')
+    parser.add_option('--worker', action='store_true', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--mappings', default='[]', help=optparse.SUPPRESS_HELP)
+    options, scenes = parser.parse_args(argv)
+
+    overrides = {}
+    if options.overrides:
+        overrides.update(load_overrides(options.overrides))
+    for item in options.set:
+        key, _, value = item.partition('=')
+        overrides[key] = parse_value(value)
+
+    if options.worker:
+        result = run_worker(scenes[0], overrides, json.loads(options.mappings))
+        print RESULT_MARKER + json.dumps(result)
+        return 0 if result['status'] != 'failed' else 1
+
+    jobs = list(scenes)
+    if options.jobs:
+        jobs.extend(load_overrides(options.jobs))
+    if not jobs:
+        parser.error('no scenes to submit')
+    if not options.username:
+        parser.error('a ZYNC username is required')
+    password = os.environ.get('ZYNC_PASSWORD') or getpass.getpass('ZYNC password: ')
+
+    path_mappings = []
+    for item in options.map:
+        source, _, dest = item.partition('=')
+        path_mappings.append((source, dest))
+
+    results = submit_scenes(jobs, overrides, path_mappings, options.username, password,
+                            options.workers, options.mayapy, _print_result)
+
+    if options.log_dir:
+        if not os.path.exists(options.log_dir):
+            os.makedirs(options.log_dir)
+        for i, result in enumerate(results):
+            name = '%03d_%s.log' % (i, os.path.splitext(os.path.basename(result['scene']))[0])
+            f = open(os.path.join(options.log_dir, name), 'w')
+            try:
+                f.write(result.get('log', ''))
+            finally:
+                f.close()
+
+    print summarize(results)
+    return 0 if all([r['status'] != 'failed' for r in results]) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,501 @@
+"""
+ZYNC Benchmarks
+
+Times the plugin's scene queries against generated scenes of increasing
+size, using the fake Maya in zync_fake, so regressions show up without a
+licensed Maya. Each case is run at every size; the report gives the median
+time per size and a scaling exponent, the slope of log(time) over log(size),
+which is about 1 for work that grows linearly with the scene.
+
+Results can be stored as a baseline and later runs compared against it;
+the comparison fails if any case got slower by more than the tolerance.
+
+--startup instead measures what userSetup.py adds to Maya's startup, in a
+fresh interpreter with a zync module that takes --import-latency seconds
+to import, and fails if startup imports zync or takes over --max-startup.
+
+--planner instead runs zync_planner on synthetic workloads of layers and
+frames. It checks the planner's schedules against placing every chunk one
+at a time, and fails if they differ or a plan takes over --max-plan.
+
+Usage:
+    python zync_bench.py
+    python zync_bench.py --sizes 1,4,16 --switch-latency 0.05
+    python zync_bench.py --save            # store a baseline
+    python zync_bench.py --compare         # compare against it
+    python zync_bench.py --startup --import-latency 2 --prewarm
+    python zync_bench.py --planner
+
+"""
+
+import heapq
+import json
+import math
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import random
+import tempfile
+import time
+
+import zync_fake
+import zync_planner
+import zync_refgraph
+
+CASES = ('get_scene_files', 'get_scene_info', 'init_layers', 'init_camera',
+         'expandFileTokens', 'create_local_paths', 'get_reference_graph')
+
+# the scene at size 1; every count is multiplied by the size
+BASE_SCENE = {'file_nodes': 100,
+              'caches': 10,
+              'layers': 4,
+              'vray_elements': 5,
+              'mr_passes': 5,
+              'cameras': 2,
+              'references': 2,
+              'shared_refs': 10}
+
+# the same at every size
+FIXED_SCENE = {'ref_nodes': 5,
+               'nested_refs': 1}
+
+DEFAULT_SIZES = (1, 2, 4, 8)
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25
+
+# differences below this many seconds are noise, not regressions
+MIN_REGRESSION = 0.002
+
+DEFAULT_IMPORT_LATENCY = 1.0
+DEFAULT_MAX_STARTUP = 0.1
+DEFAULT_IDLE = 5.0
+
+# (layers, frames) of the synthetic planner workloads
+PLANNER_WORKLOADS = ((1, 1), (1, 100), (4, 240), (12, 500), (40, 240), (40, 1000))
+PLANNER_INSTANCE_TYPES = {'ZYNC8': {'description': '8 core, 30GB'},
+                          'ZYNC16': {'description': '16 core, 60GB'},
+                          'ZYNC32': {'description': '32 core, 120GB'}}
+DEFAULT_PLANNER_CHECKS = 500
+DEFAULT_MAX_PLAN = 0.25
+
+# run in a fresh interpreter, so nothing is imported yet
+_STARTUP_SCRIPT = """
+import json, os, sys, time
+sys.path.insert(0, %(plugin_dir)r)
+import zync_fake
+zync_fake.install(import_latency=%(import_latency)r)
+
+start = time.time()
+execfile(os.path.join(%(plugin_dir)r, 'userSetup.py'), {'__name__': '__main__'})
+startup = time.time() - start
+imported = 'zync' in sys.modules
+
+# the artist gets to the shelf button a little later
+time.sleep(%(idle)r)
+start = time.time()
+import zync_maya
+zync_maya.load()
+first_use = time.time() - start
+print json.dumps({'startup': startup, 'zync_imported_at_startup': imported, 'first_use': first_use})
+"""
+
+def default_baseline_path():
+    return os.path.join(os.path.expanduser('~'), '.zync', 'bench_baseline.json')
+
+class _NullWriter(object):
+    """Swallows the plugin's progress output while timing"""
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+def _window(zync_maya):
+    # the init_ methods only need the attributes they set
+    return zync_maya.SubmitWindow.__new__(zync_maya.SubmitWindow)
+
+def _case_get_scene_files(zync_maya, context):
+    return len(list(zync_maya.get_scene_files()))
+
+def _case_get_scene_info(zync_maya, context):
+    return len(zync_maya.get_scene_info(context['renderer'])['files'])
+
+def _case_init_layers(zync_maya, context):
+    window = _window(zync_maya)
+    window.init_layers()
+    return len(window.layers)
+
+def _case_init_camera(zync_maya, context):
+    context['cmds'].deleteUI('camera')
+    _window(zync_maya).init_camera()
+    return len(context['cmds'].controls['camera']['items'])
+
+def _case_expandFileTokens(zync_maya, context):
+    count = 0
+    for prefix, tokens in context['token_jobs']:
+        zync_maya.expandFileTokens(prefix, tokens, leaveUnmatchedTokens=True)
+        count += 1
+    return count
+
+def _case_create_local_paths(zync_maya, context):
+    out_path = context['params']['out_path']
+    if os.path.exists(out_path):
+        shutil.rmtree(out_path)
+    zync_maya.create_local_paths(context['params'])
+    return len(context['params']['selected_layers'])
+
+def _case_get_reference_graph(zync_maya, context):
+    # a cold scan, with nothing cached
+    graph = zync_maya.get_reference_graph(zync_refgraph.DependencyCache(False))
+    return len(graph.files())
+
+def _prepare(zync_maya, cmds, scene, renderer, out_dir):
+    """Returns the inputs shared by the cases, gathered outside of the timing"""
+    context = {'renderer': renderer, 'cmds': cmds}
+    scene_info = zync_maya.get_scene_info(renderer)
+    layers = zync_maya.get_renderable_layers()
+    start = int(scene.attrs['defaultRenderGlobals.startFrame'])
+    end = int(scene.attrs['defaultRenderGlobals.endFrame'])
+    context['params'] = {'out_path': out_dir,
+                         'renderer': renderer,
+                         'selected_layers': layers,
+                         'frange': '%d-%d' % (start, end),
+                         'step': 1,
+                         'camera': zync_maya.get_renderable_cameras()[0],
+                         'scene_info': scene_info}
+
+    # one output path per layer, pass and frame, as a job names its frames
+    prefixes = [scene_info['file_prefix'][0]] + list(scene_info['file_prefix'][1].values())
+    jobs = []
+    for layer in layers:
+        for pass_name in scene_info['layer_passes'].get(layer) or ['']:
+            for prefix in prefixes[:2]:
+                for frame in range(start, end + 1):
+                    jobs.append(('%s[_<RenderPass>].<Frame>' % prefix,
+                                 {'Layer': layer, 'RenderLayer': layer, 'RenderPass': pass_name,
+                                  'Scene': 'shot', 'Frame': '%04d' % frame}))
+    context['token_jobs'] = jobs
+    return context
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def scaling_exponent(points):
+    """
+    Returns the least squares slope of log(seconds) over log(size) for a list
+    of (size, seconds) points, or None if it can't be fitted
+    """
+    points = [(math.log(size), math.log(seconds)) for size, seconds in points if size > 0 and seconds > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum([x for x, y in points]) / len(points)
+    mean_y = sum([y for x, y in points]) / len(points)
+    var_x = sum([(x - mean_x) ** 2 for x, y in points])
+    if not var_x:
+        return None
+    return sum([(x - mean_x) * (y - mean_y) for x, y in points]) / var_x
+
+def scene_for_size(size, root=None, switch_latency=0.0, renderer='vray'):
+    """Returns the generated scene for a size, a multiple of BASE_SCENE"""
+    counts = dict([(key, value * size) for key, value in BASE_SCENE.items()])
+    counts.update(FIXED_SCENE)
+    return zync_fake.generate_scene(root=root, switch_latency=switch_latency, renderer=renderer, **counts)
+
+def run(sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT, renderer='vray', switch_latency=0.0,
+        cases=CASES, callback=None):
+    """
+    Runs each case against a scene of each size, repeat times, and returns
+    {case: {size: {'median', 'best', 'calls', 'switches'}}}. sizes are
+    multiples of BASE_SCENE; callback(case, size, result) is called after
+    each. The scenes' files are created in a temporary folder, which is
+    removed afterwards.
+    """
+    cmds = zync_fake.install()
+    import zync_maya
+
+    results = {}
+    for case in cases:
+        results[case] = {}
+    for size in sizes:
+        root = tempfile.mkdtemp(prefix='zync_bench_')
+        try:
+            scene = scene_for_size(size, root, switch_latency, renderer)
+            cmds.load(scene)
+            stdout = sys.stdout
+            sys.stdout = _NullWriter()
+            try:
+                context = _prepare(zync_maya, cmds, scene, renderer, os.path.join(root, 'images'))
+                timings = {}
+                for case in cases:
+                    fn = globals()['_case_%s' % case]
+                    times = []
+                    for i in range(repeat):
+                        cmds.reset_calls()
+                        start = time.time()
+                        fn(zync_maya, context)
+                        times.append(time.time() - start)
+                    timings[case] = (times, sum(cmds.calls.values()), scene.switches)
+            finally:
+                sys.stdout = stdout
+            for case in cases:
+                times, calls, switches = timings[case]
+                result = {'median': _median(times), 'best': min(times), 'calls': calls, 'switches': switches}
+                results[case][size] = result
+                if callback is not None:
+                    callback(case, size, result)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+def measure_startup(import_latency=DEFAULT_IMPORT_LATENCY, prewarm=False, idle=None, environ=None):
+    """
+    Runs userSetup.py against the fake Maya in a new interpreter and returns
+    {'startup', 'zync_imported_at_startup', 'first_use'}: the seconds startup
+    took, whether it imported zync, and the seconds the first use of the
+    plugin then waits for the plugin and zync to load. idle is the time
+    between the two, which defaults to DEFAULT_IDLE when pre-warming.
+    environ holds extra environment variables for the interpreter.
+    """
+    if idle is None:
+        idle = DEFAULT_IDLE if prewarm else 0.0
+    plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    script = _STARTUP_SCRIPT % {'plugin_dir': plugin_dir, 'import_latency': float(import_latency),
+                                'idle': float(idle)}
+    env = dict(os.environ)
+    env.pop('ZYNC_PREWARM', None)
+    env.update(environ or {})
+    if prewarm:
+        env['ZYNC_PREWARM'] = '1'
+    process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=env)
+    output, errors = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError('Startup check failed:\n%s' % errors)
+    return json.loads(output.strip().splitlines()[-1])
+
+def _schedule_one_at_a_time(durations, num_instances):
+    # the plain longest first schedule, for checking zync_planner's
+    loads = [0.0] * num_instances
+    tasks = []
+    for duration, count in durations.items():
+        tasks.extend([duration] * count)
+    for duration in sorted(tasks, reverse=True):
+        heapq.heapreplace(loads, loads[0] + duration)
+    billed = sum([zync_planner._billed(zync_planner.INSTANCE_STARTUP + load) for load in loads if load])
+    return zync_planner.INSTANCE_STARTUP + max(loads), billed
+
+def check_planner(checks=DEFAULT_PLANNER_CHECKS, seed=0):
+    """
+    Schedules random workloads with zync_planner and one chunk at a time,
+    and returns a list of (layer_frames, layer_seconds, chunk_size,
+    num_instances, planner, expected) for each that differs
+    """
+    rng = random.Random(seed)
+    instance_types = zync_planner.instance_types_from_zync(PLANNER_INSTANCE_TYPES)
+    mismatches = []
+    for i in range(checks):
+        layer_frames = {}
+        layer_seconds = {}
+        for layer in range(rng.randint(1, 8)):
+            layer_frames[layer] = rng.randint(1, 400)
+            layer_seconds[layer] = rng.choice((20.0, 90.0, 300.0, 1200.0, rng.uniform(10.0, 2000.0)))
+        instance_type = rng.choice(instance_types)
+        chunk_size = rng.randint(1, 60)
+        num_instances = rng.randint(1, 120)
+        durations = zync_planner._chunk_durations(layer_frames, layer_seconds, instance_type, chunk_size)
+        got = zync_planner._schedule(durations, num_instances)
+        expected = _schedule_one_at_a_time(durations, num_instances)
+        if abs(got[0] - expected[0]) > 1e-6 or abs(got[1] - expected[1]) > 1e-6:
+            mismatches.append((layer_frames, layer_seconds, chunk_size, num_instances, got, expected))
+    return mismatches
+
+def run_planner(workloads=PLANNER_WORKLOADS, repeat=DEFAULT_REPEAT, renderer='vray', callback=None):
+    """
+    Plans each (layers, frames) workload repeat times and returns a list of
+    {'layers', 'frames', 'median', 'best', 'plan'}. callback(result) is
+    called after each.
+    """
+    results = []
+    for num_layers, frames in workloads:
+        layers = ['layer%d' % i for i in range(num_layers)]
+        times = []
+        for i in range(repeat):
+            start = time.time()
+            plan = zync_planner.plan_job('1001-%d' % (1000 + frames), layers, 1920, 1080,
+                                         PLANNER_INSTANCE_TYPES, renderer=renderer)
+            times.append(time.time() - start)
+        result = {'layers': num_layers, 'frames': frames, 'median': _median(times), 'best': min(times),
+                  'plan': plan}
+        results.append(result)
+        if callback is not None:
+            callback(result)
+    return results
+
+def format_report(results, sizes=None):
+    """Returns a table of the median milliseconds per case and size, with the scaling exponent"""
+    if sizes is None:
+        sizes = sorted(set([size for case in results.values() for size in case]))
+    header = '%-20s' % 'case' + ''.join(['%12s' % ('x%s (ms)' % size) for size in sizes]) + '%10s' % 'scaling'
+    lines = [header]
+    for case in CASES:
+        if case not in results:
+            continue
+        row = '%-20s' % case
+        points = []
+        for size in sizes:
+            result = results[case].get(size)
+            if result is None:
+                row += '%12s' % '-'
+                continue
+            row += '%12.2f' % (result['median'] * 1000.0)
+            points.append((size, result['median']))
+        exponent = scaling_exponent(points)
+        row += '%10s' % ('n^%.2f' % exponent if exponent is not None else '-')
+        lines.append(row)
+    return '\n'.join(lines)
+
+def save_baseline(results, path=None, info=None):
+    """Stores the results as the baseline, returning its path"""
+    path = path or default_baseline_path()
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    data = {'created': time.time(), 'info': info or {}, 'results': {}}
+    for case, by_size in results.items():
+        data['results'][case] = dict([(str(size), result) for size, result in by_size.items()])
+    f = open(path, 'w')
+    try:
+        json.dump(data, f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+    return path
+
+def load_baseline(path=None):
+    """Returns the stored baseline results, in the form returned by run()"""
+    f = open(path or default_baseline_path())
+    try:
+        data = json.load(f)
+    finally:
+        f.close()
+    results = {}
+    for case, by_size in data['results'].items():
+        results[case] = dict([(int(size), result) for size, result in by_size.items()])
+    return results
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns a list of (case, size, baseline_seconds, seconds) for each case
+    whose median is more than tolerance slower than the baseline
+    """
+    regressions = []
+    for case in sorted(results):
+        for size in sorted(results[case]):
+            old = baseline.get(case, {}).get(size)
+            if old is None:
+                continue
+            new = results[case][size]['median']
+            if new > old['median'] * (1.0 + tolerance) and new - old['median'] > MIN_REGRESSION:
+                regressions.append((case, size, old['median'], new))
+    return regressions
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', default=','.join([str(s) for s in DEFAULT_SIZES]),
+                      help='comma separated scene sizes, as multiples of the base scene')
+    parser.add_option('--repeat', type='int', default=DEFAULT_REPEAT, help='runs per case and size')
+    parser.add_option('--renderer', default='vray', help='vray, mr or sw')
+    parser.add_option('--switch-latency', type='float', default=0.0,
+                      help='seconds each render layer switch takes')
+    parser.add_option('--cases', default=','.join(CASES), help='comma separated cases to run')
+    parser.add_option('--baseline', default=default_baseline_path(), help='baseline file')
+    parser.add_option('--save', action='store_true', help='store the results as the baseline')
+    parser.add_option('--compare', action='store_true', help='compare the results against the baseline')
+    parser.add_option('--tolerance', type='float', default=DEFAULT_TOLERANCE,
+                      help='fraction a case may slow down before it is a regression')
+    parser.add_option('--json', help='write the results to this file')
+    parser.add_option('--startup', action='store_true', help="measure userSetup.py's startup cost instead")
+    parser.add_option('--import-latency', type='float', default=DEFAULT_IMPORT_LATENCY,
+                      help='seconds the zync module takes to import, for --startup')
+    parser.add_option('--prewarm', action='store_true', help='set ZYNC_PREWARM, for --startup')
+    parser.add_option('--idle', type='float', default=None,
+                      help='seconds between startup and first use, for --startup')
+    parser.add_option('--max-startup', type='float', default=DEFAULT_MAX_STARTUP,
+                      help='seconds startup may take, for --startup')
+    parser.add_option('--planner', action='store_true', help='run the planner on synthetic workloads instead')
+    parser.add_option('--checks', type='int', default=DEFAULT_PLANNER_CHECKS,
+                      help='random schedules to check, for --planner')
+    parser.add_option('--max-plan', type='float', default=DEFAULT_MAX_PLAN,
+                      help='seconds a plan may take, for --planner')
+    options, args = parser.parse_args(argv)
+
+    if options.startup:
+        result = measure_startup(options.import_latency, options.prewarm, options.idle)
+        print 'startup:    %8.1f ms%s' % (result['startup'] * 1000.0,
+                                          ' (imported zync)' if result['zync_imported_at_startup'] else '')
+        print 'first use:  %8.1f ms' % (result['first_use'] * 1000.0)
+        if result['zync_imported_at_startup'] or result['startup'] > options.max_startup:
+            print 'FAILED: startup must not import zync or take over %.0f ms' % (options.max_startup * 1000.0)
+            return 1
+        return 0
+
+    if options.planner:
+        status = 0
+        mismatches = check_planner(options.checks)
+        for layer_frames, layer_seconds, chunk_size, num_instances, got, expected in mismatches[:10]:
+            print 'MISMATCH chunk_size=%d x%d %r: %r, expected %r' % (chunk_size, num_instances,
+                                                                     layer_frames, got, expected)
+        if mismatches:
+            status = 1
+        else:
+            print 'Schedules match for %d random workloads' % options.checks
+        for result in run_planner(repeat=options.repeat, renderer=options.renderer):
+            slow = result['median'] > options.max_plan
+            print '%3d layers x %5d frames %9.2f ms  %r%s' % (result['layers'], result['frames'],
+                                                             result['median'] * 1000.0, result['plan'],
+                                                             '  SLOW' if slow else '')
+            if slow:
+                status = 1
+        return status
+
+    sizes = [int(s) for s in options.sizes.split(',') if s.strip()]
+    cases = [c.strip() for c in options.cases.split(',') if c.strip()]
+    for case in cases:
+        if case not in CASES:
+            parser.error('unknown case %r, expected one of %s' % (case, ', '.join(CASES)))
+
+    def progress(case, size, result):
+        sys.stderr.write('%-20s x%-4d %9.2f ms, %d calls, %d layer switches\n' % (
+            case, size, result['median'] * 1000.0, result['calls'], result['switches']))
+
+    results = run(sizes, options.repeat, options.renderer, options.switch_latency, cases, progress)
+    print format_report(results, sizes)
+
+    if options.json:
+        save_baseline(results, options.json)
+    status = 0
+    if options.compare:
+        if not os.path.exists(options.baseline):
+            print 'No baseline at %s, run with --save first.' % options.baseline
+            status = 1
+        else:
+            regressions = compare(results, load_baseline(options.baseline), options.tolerance)
+            for case, size, old, new in regressions:
+                print 'REGRESSION %s x%d: %.2f ms -> %.2f ms' % (case, size, old * 1000.0, new * 1000.0)
+            if regressions:
+                status = 1
+            else:
+                print 'No regressions against %s' % options.baseline
+    if options.save:
+        print 'Baseline written to %s' % save_baseline(results, options.baseline,
+                                                       {'renderer': options.renderer,
+                                                        'switch_latency': options.switch_latency})
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
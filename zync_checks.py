@@ -0,0 +1,395 @@
+"""
+ZYNC Checks
+
+Checks the plugin's logic against the fake Maya in zync_fake and stand-ins
+for ZYNC, so mistakes show up without a licensed Maya or a ZYNC site. Each
+check fails with an AssertionError; every check is run, and the script
+exits with a non-zero status if any of them failed.
+
+Usage:
+    python zync_checks.py                  # every check
+    python zync_checks.py planner          # the checks of a group
+    python zync_checks.py --list
+
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import zync_bench
+import zync_fake
+import zync_planner
+import zync_queue
+
+# (group, name, fn) in the order they run
+CHECKS = []
+
+def check(group):
+    """Decorator registering fn as a check of the group"""
+    def decorator(fn):
+        CHECKS.append((group, fn.__name__, fn))
+        return fn
+    return decorator
+
+def _close(a, b):
+    return abs(a - b) < 1e-6
+
+def _settle():
+    # waits for the submit dialog's background work
+    for thread in threading.enumerate():
+        if thread.name.startswith('ZyncDialog'):
+            thread.join()
+
+class _Null(object):
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+class _FakeSession(object):
+    """The fake Maya with a generated scene loaded and zync_maya imported, printing nothing"""
+    def __init__(self, **scene_args):
+        self.root = tempfile.mkdtemp()
+        self.cmds = zync_fake.install()
+        self.scene = zync_fake.generate_scene(root=self.root, **scene_args)
+        self.scene.write_ascii(self.scene.path)
+        self.cmds.load(self.scene)
+        self.environ = dict(os.environ)
+        os.environ['ZYNC_HEADER_CACHE'] = os.path.join(self.root, 'image_headers.json')
+        os.environ['ZYNC_TRACE_DIR'] = self.root
+        import zync_maya
+        self.zync_maya = zync_maya
+        zync_maya.load()
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = _Null()
+        return self
+
+    def __exit__(self, *exc):
+        _settle()
+        sys.stdout = self.stdout
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.root, ignore_errors=True)
+        return False
+
+@check('planner')
+def schedules_match_one_at_a_time():
+    mismatches = zync_bench.check_planner(200)
+    assert not mismatches, '%d schedules differ, the first: %r' % (len(mismatches), mismatches[0])
+
+@check('planner')
+def known_schedules():
+    startup = zync_planner.INSTANCE_STARTUP
+    billed = zync_planner._billed
+    cases = (
+        # equal tasks, shared evenly
+        (({100.0: 4}, 2), (startup + 200.0, 2 * billed(startup + 200.0))),
+        # the long task alone, the short ones on the other instance
+        (({300.0: 1, 100.0: 3}, 2), (startup + 300.0, 2 * billed(startup + 300.0))),
+        # idle instances are not billed
+        (({100.0: 3}, 5), (startup + 100.0, 3 * billed(startup + 100.0))),
+        # longest first, then each to the least loaded instance
+        (({250.0: 2, 100.0: 3}, 2), (startup + 450.0, billed(startup + 450.0) + billed(startup + 350.0))),
+    )
+    for (durations, num_instances), expected in cases:
+        got = zync_planner._schedule(durations, num_instances)
+        assert _close(got[0], expected[0]) and _close(got[1], expected[1]), (
+            '%r on %d instances: %r, expected %r' % (durations, num_instances, got, expected))
+
+@check('planner')
+def chunk_durations():
+    instance_type = zync_planner.InstanceType('ZYNC8', cores=zync_planner.REFERENCE_CORES)
+    durations = zync_planner._chunk_durations({'a': 10}, {'a': 60.0}, instance_type, 4)
+    chunk = zync_planner.CHUNK_STARTUP
+    assert durations == {chunk + 240.0: 2, chunk + 120.0: 1}, durations
+
+@check('planner')
+def plans_cover_the_layers():
+    for layers in (['a'], ['a', 'b', 'c', 'd']):
+        plan = zync_planner.plan_job('1-100', layers, 1920, 1080, zync_bench.PLANNER_INSTANCE_TYPES)
+        chunks = -(-100 // plan.chunk_size)
+        assert plan.tasks == chunks * len(layers), '%d layers: %r' % (len(layers), plan)
+        assert 1 <= plan.num_instances <= plan.tasks, '%d layers: %r' % (len(layers), plan)
+
+@check('planner')
+def passes_take_longer():
+    types = zync_bench.PLANNER_INSTANCE_TYPES
+    plain = zync_planner.plan_job('1-100', ['a'], 1920, 1080, types)
+    passes = zync_planner.plan_job('1-100', ['a'], 1920, 1080, types,
+                                   layer_passes={'a': ['pass%d' % i for i in range(10)]})
+    assert passes.cost > plain.cost, 'with passes %r, without %r' % (passes, plain)
+
+@check('planner')
+def dialog_plans_selected_layers():
+    with _FakeSession(file_nodes=10, references=0, layers=4, frames=(1001, 1100)) as session:
+        cmds = session.cmds
+        window = session.zync_maya.SubmitWindow(background=False)
+        _settle()
+        everything = window.plan
+        cmds.textScrollList('layers', e=True, selectItem=['layer1'])
+        window.change_layers()
+        _settle()
+        plan = window.plan
+        assert plan.tasks == -(-100 // plan.chunk_size), 'one layer selected: %r' % plan
+        assert plan.tasks < everything.tasks, 'one layer %r, every layer %r' % (plan, everything)
+        field = cmds.textField('num_instances', q=True, tx=True)
+        assert field == str(plan.num_instances), 'num_instances shows %s for %r' % (field, plan)
+
+def _startup(queued_for=None):
+    # userSetup.py in a new interpreter, with a zync that is slow to import
+    queue_dir = tempfile.mkdtemp()
+    try:
+        if queued_for is not None:
+            zync_queue.SubmissionQueue(queue_dir).enqueue('/scenes/shot.ma', ['layer1'], {}, username=queued_for)
+        return zync_bench.measure_startup(import_latency=1.0, environ={'ZYNC_QUEUE_DIR': queue_dir,
+                                                                       'ZYNC_USERNAME': '',
+                                                                       'ZYNC_PASSWORD': ''})
+    finally:
+        shutil.rmtree(queue_dir, ignore_errors=True)
+
+@check('startup')
+def startup_leaves_zync_unloaded():
+    result = _startup()
+    assert not result['zync_imported_at_startup'], 'startup imported zync'
+    assert result['startup'] < zync_bench.DEFAULT_MAX_STARTUP, 'startup took %.3fs' % result['startup']
+
+@check('startup')
+def startup_with_queued_jobs_it_cannot_send():
+    # without the password the jobs wait, so there is nothing to load zync for
+    result = _startup(queued_for='artist')
+    assert not result['zync_imported_at_startup'], 'startup imported zync for jobs it cannot send'
+    assert result['startup'] < zync_bench.DEFAULT_MAX_STARTUP, 'startup took %.3fs' % result['startup']
+
+@check('deps')
+def deps_read_a_type_at_a_time():
+    with _FakeSession(file_nodes=200, caches=20, references=2, ref_nodes=5) as session:
+        zync_maya = session.zync_maya
+        fake = zync_fake.installed()
+        nodes_by_type = zync_maya._typed_nodes()
+        nodes = sum([len(n) for n in nodes_by_type.values()])
+        fake.reset_calls()
+        batched = zync_maya._file_refs(nodes_by_type, expand=False)
+        reads = fake.calls.get('getAttr', 0)
+        saved, zync_maya.om = zync_maya.om, None
+        try:
+            one_at_a_time = zync_maya._file_refs(nodes_by_type, expand=False)
+        finally:
+            zync_maya.om = saved
+        assert sorted(batched) == sorted(one_at_a_time), 'batched reads found other files'
+        attributes = sum([len(zync_maya.zync_deps.registry.get(t).read_attributes()) for t in nodes_by_type])
+        assert reads <= attributes, '%d getAttr calls for %d nodes' % (reads, nodes)
+
+@check('deps')
+def deps_short_names_in_ma_files():
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'shot.ma')
+        f = open(path, 'w')
+        try:
+            f.write('//Maya ASCII 2016 scene\n'
+                    'requires maya "2016";\n'
+                    'createNode mentalrayOptions -s -n "miDefaultOptions";\n'
+                    '\tsetAttr ".fgfn" -type "string" "shot_fg";\n')
+        finally:
+            f.close()
+        import zync_ma
+        refs = zync_ma.get_scene_file_refs(path, workspace=root, references=False)
+        expected = os.path.join(root, 'renderData', 'mentalray', 'finalgMap', 'shot_fg.fgmap')
+        assert [(p, a) for p, n, a in refs] == [(expected, 'finalGatherFilename')], refs
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+class _Clock(object):
+    """A clock for SubmissionQueue that only moves when told to"""
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class _Submit(object):
+    """A stand-in for ZYNC's submit_job, answering with each of the results in turn"""
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self, job):
+        self.calls += 1
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+class _PermanentError(Exception):
+    pass
+
+def _queue(clock=None):
+    directory = tempfile.mkdtemp()
+    queue = zync_queue.SubmissionQueue(directory, clock or _Clock())
+    job = queue.enqueue('/scenes/shot.ma', ['layer1'], {'frange': '1-10'}, username='artist')
+    return directory, queue, job
+
+@check('queue')
+def queue_retries_with_backoff():
+    directory, queue, job = _queue()
+    try:
+        submit = _Submit(IOError('timed out'), IOError('timed out'), {'code': 0})
+        worker = zync_queue.QueueWorker(queue, submit, base_delay=10.0, max_delay=100.0)
+        assert worker.run_once() == 1
+        job = queue.get(job.id)
+        assert job.status == zync_queue.RETRYING and job.attempts == 1, job.format()
+        assert job.next_attempt > queue.clock(), 'retried without a delay'
+        assert worker.run_once() == 0, 'retried before its delay'
+        for attempts in (2, 3):
+            queue.clock.advance(100.0)
+            assert worker.run_once() == 1
+        job = queue.get(job.id)
+        assert job.status == zync_queue.DONE and job.attempts == 3, job.format()
+        assert submit.calls == 3 and worker.sent == 1, (submit.calls, worker.sent)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@check('queue')
+def queue_fails_jobs():
+    for submit, max_attempts, attempts in ((_Submit(IOError('timed out')), 3, 3),
+                                           (_Submit(_PermanentError('bad scene')), 3, 1),
+                                           (_Submit({'code': 1, 'response': 'no such project'}), 3, 1)):
+        directory, queue, job = _queue()
+        try:
+            results = []
+            worker = zync_queue.QueueWorker(queue, submit, max_attempts=max_attempts, base_delay=1.0,
+                                            max_delay=1.0, permanent_errors=(_PermanentError,),
+                                            on_result=results.append)
+            for i in range(max_attempts + 1):
+                worker.run_once()
+                queue.clock.advance(10.0)
+            job = queue.get(job.id)
+            assert job.status == zync_queue.FAILED and job.attempts == attempts, job.format()
+            assert [r.id for r in results] == [job.id], 'on_result called for %r' % results
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+@check('queue')
+def queue_claims_are_exclusive():
+    directory, queue, job = _queue()
+    try:
+        other = zync_queue.SubmissionQueue(directory, queue.clock)
+        assert queue.claim(job), 'could not claim a free job'
+        assert not other.claim(job), 'claimed by two sessions'
+        submit = _Submit({'code': 0})
+        assert zync_queue.QueueWorker(other, submit).run_once() == 1
+        assert submit.calls == 0, 'sent a job claimed by another session'
+        queue.release(job)
+        assert other.claim(job), 'could not claim a released job'
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@check('queue')
+def queue_recovers_interrupted_jobs():
+    directory, queue, job = _queue()
+    try:
+        job.status = zync_queue.SUBMITTING
+        queue.save(job)
+        other = zync_queue.SubmissionQueue(directory, queue.clock)
+        # still being sent by a live session
+        assert queue.claim(job)
+        assert other.recover() == 0, 'recovered a job another session is sending'
+        # left behind by a session that died
+        queue.clock.advance(zync_queue.CLAIM_TIMEOUT + 1.0)
+        assert other.recover() == 1, 'did not recover a stale claim'
+        job = other.get(job.id)
+        assert job.status == zync_queue.RETRYING and job.due(other.clock()), job.format()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@check('queue')
+def queue_renews_claims_while_submitting():
+    directory, queue, job = _queue(time.time)
+    try:
+        started = threading.Event()
+        def slow_submit(job):
+            started.set()
+            time.sleep(0.6)
+            return {'code': 0}
+        # another session, whose clock says the claim has nearly timed out
+        other = zync_queue.SubmissionQueue(directory, lambda: time.time() + zync_queue.CLAIM_TIMEOUT - 0.3)
+        worker = zync_queue.QueueWorker(queue, slow_submit, claim_renewal=0.05)
+        thread = threading.Thread(target=worker.run_once)
+        thread.start()
+        started.wait()
+        time.sleep(0.4)
+        recovered = other.recover()
+        thread.join()
+        assert recovered == 0, 'recovered a job while it was being sent'
+        assert queue.get(job.id).status == zync_queue.DONE, queue.get(job.id).format()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@check('queue')
+def resume_recovers_before_sending():
+    with _FakeSession(file_nodes=1, references=0) as session:
+        zync_maya = session.zync_maya
+        directory, queue, job = _queue(time.time)
+        saved = zync_maya.submission_queue, zync_maya._submit_queued
+        try:
+            job.status = zync_queue.SUBMITTING
+            queue.save(job)
+            submit = _Submit({'code': 0})
+            zync_maya.submission_queue = queue
+            zync_maya._submit_queued = submit
+            zync_maya.resume_submissions('artist', 'secret', background=False)
+            assert submit.calls == 1, 'an interrupted job was not sent'
+            assert queue.get(job.id).status == zync_queue.DONE, queue.get(job.id).format()
+        finally:
+            zync_maya.submission_queue, zync_maya._submit_queued = saved
+            zync_maya._queue_passwords.pop('artist', None)
+            shutil.rmtree(directory, ignore_errors=True)
+
+def run(groups=None, out=sys.stdout):
+    """Runs the checks of the groups, by default all of them, and returns the names of those that failed"""
+    failed = []
+    for group, name, fn in CHECKS:
+        if groups and group not in groups:
+            continue
+        try:
+            fn()
+        except Exception:
+            failed.append('%s.%s' % (group, name))
+            out.write('FAIL %s.%s\n%s\n' % (group, name, traceback.format_exc()))
+        else:
+            out.write('ok   %s.%s\n' % (group, name))
+    return failed
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] [group ...]')
+    parser.add_option('--list', action='store_true', help='list the checks')
+    options, groups = parser.parse_args(argv)
+    known = set([group for group, name, fn in CHECKS])
+    for group in groups:
+        if group not in known:
+            parser.error('unknown group %r, expected one of %s' % (group, ', '.join(sorted(known))))
+    if options.list:
+        for group, name, fn in CHECKS:
+            print '%s.%s' % (group, name)
+        return 0
+    failed = run(groups)
+    if failed:
+        print '%d of the checks failed: %s' % (len(failed), ', '.join(failed))
+        return 1
+    print 'All checks passed'
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+ZYNC Dependency Types
+
+The node types whose attributes hold the files a scene depends on, declared
+as data: the attributes holding paths, and how their values become files.
+A value can be an image sequence or UDIM tiles when a flag attribute is set,
+relative to the project or the scene's folder, or given an extension. Node
+types needing more supply a resolve function.
+
+Nodes are handled a type at a time: each attribute is read for all of a
+type's nodes in one pass, through a read(nodes, attribute, default) function
+that returns their values in order. zync_maya reads them from Maya and
+zync_ma from .ma files. The time spent on each node type is kept in
+registry.timings and recorded as a phase of any active zync_trace.Tracer,
+so slow ones show up.
+
+Other tools can register their own node types:
+    import zync_deps
+    zync_deps.register(zync_deps.DependencyType('myCacheNode', ['cachePath'],
+                                                sequence='useFrames'))
+
+"""
+
+import os
+import threading
+import time
+
+import zync_sequences
+import zync_trace
+
+# ends the path of a Maya cache in a scan, until expand() finds its files
+CACHE_TOKEN = '<cache>'
+
+class DependencyContext(object):
+    """Where relative paths are found: the project folder and the scene's folder"""
+    def __init__(self, workspace=None, scene_dir=None):
+        self.workspace = workspace
+        self.scene_dir = scene_dir
+
+class DependencyType(object):
+    """
+    A node type's file dependencies. attributes are the attributes holding
+    paths. A path is an image sequence when the sequence attribute is on, and
+    UDIM tiles when the udim attribute equals udim_value. relative_to,
+    'workspace' or 'scene', finds paths within folder of the project or the
+    scene's folder, and extension is added to paths without it. aliases maps
+    short attribute names to long ones, for .ma files. resolve, if given,
+    replaces all of that: it is called with the node, a dict of the values of
+    attributes and extra_attributes and the DependencyContext, and yields
+    (attribute, path) pairs.
+    """
+    def __init__(self, node_type, attributes, sequence=None, udim=None, udim_value=3,
+                 relative_to=None, folder=None, extension=None, extra_attributes=(),
+                 aliases=None, resolve=None):
+        self.node_type = node_type
+        self.attributes = list(attributes)
+        self.sequence = sequence
+        self.udim = udim
+        self.udim_value = udim_value
+        self.relative_to = relative_to
+        self.folder = folder
+        self.extension = extension
+        self.aliases = dict(aliases or {})
+        self.resolve = resolve
+        flags = [a for a in (sequence, udim) if a] + list(extra_attributes)
+        self.flag_attributes = [a for a in flags if a not in self.attributes]
+
+    def read_attributes(self):
+        return self.attributes + self.flag_attributes
+
+    def _path(self, value, context):
+        path = value.strip()
+        if not path:
+            return None
+        if self.relative_to:
+            root = context.workspace if self.relative_to == 'workspace' else context.scene_dir
+            if not root:
+                return None
+            path = os.path.join(root, self.folder or '', path)
+        if self.extension and not path.endswith(self.extension):
+            path += self.extension
+        return path
+
+    def node_paths(self, node, values, context):
+        """Yields the (attribute, path) pairs of a node, from the values of its attributes"""
+        if self.resolve is not None:
+            for pair in self.resolve(node, values, context):
+                yield pair
+            return
+        for attribute in self.attributes:
+            value = values.get(attribute)
+            if not value or not isinstance(value, basestring):
+                continue
+            path = self._path(value, context)
+            if path is None:
+                continue
+            if self.sequence and values.get(self.sequence):
+                path = zync_sequences.frame_pattern(path.replace('\\', '/'))
+            elif self.udim and values.get(self.udim) == self.udim_value:
+                path = zync_sequences.udim_pattern(path.replace('\\', '/'))
+            yield (attribute, path)
+
+    def __repr__(self):
+        return 'DependencyType(%r, %r)' % (self.node_type, self.attributes)
+
+class DependencyRegistry(object):
+    """The registered DependencyTypes, by node type"""
+    def __init__(self, types=()):
+        self._types = {}
+        self._order = []
+        self._lock = threading.Lock()
+        # node type to [nodes, seconds] for the scans since reset_timings()
+        self.timings = {}
+        for dep_type in types:
+            self.register(dep_type)
+
+    def register(self, dep_type, replace=True):
+        """Registers a DependencyType, replacing any registered for its node type unless replace is False"""
+        self._lock.acquire()
+        try:
+            if dep_type.node_type in self._types:
+                if not replace:
+                    raise ValueError('A dependency type is already registered for %s' % dep_type.node_type)
+            else:
+                self._order.append(dep_type.node_type)
+            self._types[dep_type.node_type] = dep_type
+        finally:
+            self._lock.release()
+        return dep_type
+
+    def unregister(self, node_type):
+        self._lock.acquire()
+        try:
+            if node_type in self._types:
+                del self._types[node_type]
+                self._order.remove(node_type)
+        finally:
+            self._lock.release()
+
+    def get(self, node_type):
+        return self._types.get(node_type)
+
+    def node_types(self):
+        return list(self._order)
+
+    def attributes(self):
+        """Returns the set of attributes every registered type reads"""
+        attributes = set()
+        for dep_type in self._types.values():
+            attributes.update(dep_type.read_attributes())
+        return attributes
+
+    def aliases(self, node_type):
+        dep_type = self._types.get(node_type)
+        return dep_type.aliases if dep_type is not None else {}
+
+    def reset_timings(self):
+        self.timings = {}
+
+    def format_timings(self, limit=10):
+        """Returns the node types that took longest, with their node counts"""
+        lines = []
+        ranked = sorted(self.timings.items(), key=lambda item: -item[1][1])
+        for node_type, (nodes, seconds) in ranked[:limit]:
+            lines.append('%-24s %6d nodes %8.3fs' % (node_type, nodes, seconds))
+        return '\n'.join(lines)
+
+    def scan(self, nodes_by_type, read, context=None):
+        """
+        Returns a (path, node, attribute) tuple for each file of the nodes,
+        given as a dict of node type to nodes. Paths are unexpanded strings,
+        holding a token for sequences, tiles and caches; expand_refs() finds
+        their files. read(nodes, attribute, default) returns the attribute's
+        value for each node.
+        """
+        if context is None:
+            context = DependencyContext()
+        refs = []
+        for node_type in self.node_types():
+            nodes = nodes_by_type.get(node_type)
+            dep_type = self._types.get(node_type)
+            if not nodes or dep_type is None:
+                continue
+            start = time.time()
+            with zync_trace.phase('dependencies:%s' % node_type, nodes=len(nodes)):
+                columns = [(a, read(nodes, a, None)) for a in dep_type.read_attributes()]
+                for i, node in enumerate(nodes):
+                    values = dict([(a, column[i]) for a, column in columns])
+                    for attribute, path in dep_type.node_paths(node, values, context):
+                        if path is not None:
+                            refs.append((path, node, attribute))
+            timing = self.timings.setdefault(node_type, [0, 0.0])
+            timing[0] += len(nodes)
+            timing[1] += time.time() - start
+        return refs
+
+def _cache_file_paths(node, values, context):
+    """
+    Resolves cacheFile nodes to their .xml description and a CACHE_TOKEN
+    pattern, which expand() turns into the .mc or .mcx file, or one per frame
+    """
+    path = values.get('cachePath')
+    cache_name = values.get('cacheName')
+    if not path or not cache_name:
+        return
+    yield ('cachePath', os.path.join(path, cache_name) + CACHE_TOKEN)
+    yield ('cachePath', os.path.join(path, '%s.xml' % cache_name))
+
+def _cache_files(base, dirs):
+    cache_dir, cache_name = os.path.split(base)
+    names = dirs.listdir(cache_dir)
+    if '%s.mc' % cache_name not in names and '%s.mcx' % cache_name not in names:
+        # one file per frame, stored as nameFrame1.mc, nameFrame2.mc...
+        frames = zync_sequences.find_cache_frames(cache_dir, cache_name, dirs)
+        if frames:
+            return frames
+    if '%s.mcx' % cache_name in names:
+        return [base + '.mcx']
+    return [base + '.mc']
+
+def expand(path, dirs=None):
+    """
+    Returns the files on disk a scanned path stands for: a
+    zync_sequences.FileSequence for a sequence or tiles, the files of a Maya
+    cache, or the path itself
+    """
+    if dirs is None:
+        dirs = zync_sequences.listings
+    path = path.replace('\\', '/')
+    if path.endswith(CACHE_TOKEN):
+        return _cache_files(path[:-len(CACHE_TOKEN)], dirs)
+    return [zync_sequences.expand(path, dirs)]
+
+def expand_refs(refs, dirs=None):
+    """
+    Returns the (path, node, attribute) references from a scan with their
+    paths expanded from disk. Scans only depend on the scene, so they can be
+    kept and expanded again later to pick up files added since.
+    """
+    expanded = []
+    for path, node, attribute in refs:
+        if isinstance(path, zync_sequences.FileSequence):
+            expanded.append((path, node, attribute))
+            continue
+        for item in expand(path, dirs):
+            expanded.append((item, node, attribute))
+    return expanded
+
+BUILTIN_TYPES = [
+    # Maya
+    DependencyType('file', ['fileTextureName'], sequence='useFrameExtension', udim='uvTilingMode',
+                   aliases={'ftn': 'fileTextureName', 'ufe': 'useFrameExtension', 'uvt': 'uvTilingMode'}),
+    DependencyType('cacheFile', [], extra_attributes=['cachePath', 'cacheName'], resolve=_cache_file_paths,
+                   aliases={'cp': 'cachePath', 'cn': 'cacheName'}),
+    DependencyType('diskCache', ['cacheName'], aliases={'cn': 'cacheName'}),
+    DependencyType('gpuCache', ['cacheFileName'], aliases={'cfn': 'cacheFileName'}),
+    DependencyType('AlembicNode', ['abc_File'], aliases={'fn': 'abc_File'}),
+    DependencyType('imagePlane', ['imageName'], sequence='useFrameExtension',
+                   aliases={'imn': 'imageName', 'ufe': 'useFrameExtension'}),
+    # mental ray
+    DependencyType('mentalrayTexture', ['fileTextureName'], aliases={'ftn': 'fileTextureName'}),
+    DependencyType('mentalrayOptions', ['finalGatherFilename'], relative_to='workspace',
+                   folder='renderData/mentalray/finalgMap', extension='.fgmap',
+                   aliases={'fgfn': 'finalGatherFilename'}),
+    DependencyType('mentalrayIblShape', ['texture'], aliases={'tx': 'texture'}),
+    # V-Ray
+    DependencyType('VRayMesh', ['fileName']),
+    DependencyType('VRaySettingsNode', ['ifile']),
+    DependencyType('VRayVolumeGrid', ['inFile']),
+    DependencyType('VRayLightIESShape', ['iesFile']),
+    # Arnold
+    DependencyType('aiImage', ['filename']),
+    DependencyType('aiStandIn', ['dso'], sequence='useFrameExtension'),
+    DependencyType('aiVolume', ['filename']),
+    DependencyType('aiPhotometricLight', ['aiFilename']),
+    # Redshift
+    DependencyType('RedshiftProxyMesh', ['fileName'], sequence='useFrameExtension'),
+    DependencyType('RedshiftVolumeShape', ['fileName']),
+    DependencyType('RedshiftNormalMap', ['tex0']),
+    DependencyType('RedshiftDomeLight', ['tex0', 'tex1']),
+    DependencyType('RedshiftIESLight', ['profile']),
+    DependencyType('RedshiftSprite', ['tex0']),
+    # RenderMan
+    DependencyType('PxrTexture', ['filename']),
+    DependencyType('PxrPtexture', ['filename']),
+    DependencyType('PxrNormalMap', ['filename']),
+    DependencyType('PxrBump', ['filename']),
+    DependencyType('PxrMultiTexture', ['filename%d' % i for i in range(10)]),
+    DependencyType('PxrDomeLight', ['lightColorMap']),
+    DependencyType('PxrRectLight', ['lightColorMap']),
+    # XGen, whose .xgen files live next to the scene, and Yeti
+    DependencyType('xgmPalette', ['xgFileName'], relative_to='scene'),
+    DependencyType('xgmSplineCache', ['fileName']),
+    DependencyType('pgYetiMaya', ['cacheFileName']),
+]
+
+registry = DependencyRegistry(BUILTIN_TYPES)
+
+def register(dep_type, replace=True):
+    """Registers a DependencyType with the default registry"""
+    return registry.register(dep_type, replace)
@@ -0,0 +1,931 @@
+"""
+ZYNC Fake Maya
+
+An in-memory stand-in for maya.cmds, maya.utils, maya.mel, the plugs of
+maya.api.OpenMaya, the zync API and config_maya, so the plugin can be imported and exercised without Maya or a
+ZYNC account. Scenes are FakeScene objects holding nodes, attributes, render
+layers with overrides, and references; generate_scene() builds one of any
+size, optionally with its textures, sequences and caches created on disk.
+
+Layer switches sleep for the scene's switch_latency, to make code that
+switches layers as slow here as it is in a heavy scene, and are counted in
+FakeScene.switches. Every command call is counted in FakeCmds.calls, and
+plugs added to and read from an MSelectionList under 'MSelectionList.add'
+and 'MSelectionList.getPlug'.
+
+The fake zync module's Zync class is driven by FakeZyncService, which can
+add latency to and fail authentication or job submission on demand.
+
+Usage:
+    import zync_fake
+    cmds = zync_fake.install(zync_fake.generate_scene(file_nodes=500, layers=8))
+    import zync_maya
+    zync_maya.get_scene_info('vray')
+    cmds.calls['editRenderLayerGlobals']
+
+"""
+
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+import xml.etree.ElementTree as ElementTree
+
+import zync_ma
+
+_ADJUSTMENT_REGEX = re.compile(r'^(.+)\.adjustments\[(\d+)\]\.(plug|value)$')
+_CALLBACK_REGEX = re.compile(r"submit_callb\('(\w+)'\)")
+
+# widget classes in the .ui file, and the commands that edit them
+_UI_COMMANDS = {'QLineEdit': 'textField',
+                'QCheckBox': 'checkBox',
+                'QComboBox': 'optionMenu',
+                'QListWidget': 'textScrollList'}
+
+# short and long names of the flags the plugin queries
+_UI_FLAGS = {'tx': 'text', 'v': 'value', 'ai': 'allItems', 'si': 'selectItem',
+             'en': 'enable', 'ex': 'exists', 'l': 'label', 'pr': 'progress'}
+
+class FakeScene(object):
+    """
+    A Maya scene held in memory. attrs holds the master layer value of each
+    plug; overrides maps each render layer to an ordered list of
+    [plug, value] adjustments, as legacy render layers store them.
+    """
+    def __init__(self, path='/tmp/zync_fake/scenes/shot.ma', project='/tmp/zync_fake/'):
+        self.path = path
+        self.project = project
+        self.nodes = {}
+        self.attrs = {}
+        self.overrides = {}
+        self.layers = []
+        self.namespaces = {}
+        self.render_passes = {}
+        self.cameras = {}
+        self.references = []
+        self.reference_info = {}
+        self.node_references = {}
+        self.plugins = []
+        self.current_layer = 'defaultRenderLayer'
+        self.switch_latency = 0.0
+        self.switches = 0
+        self.modified = False
+        self.add_layer('defaultRenderLayer', renderable=False)
+
+    def write_ascii(self, path):
+        """
+        Writes the scene as Maya writes a Maya ASCII file: references, shared
+        nodes selected and other nodes created, attributes set by their short
+        names, and the adjustments and passes of each render layer connected.
+        Referenced nodes are left out, as they live in the referenced files.
+        """
+        short_names = {}
+        for node_type in set(self.nodes.values()):
+            aliases = zync_ma.attribute_aliases(node_type)
+            short_names[node_type] = dict([(l, s) for s, l in aliases.items()])
+
+        def value(v):
+            if isinstance(v, bool):
+                return 'yes' if v else 'no'
+            if isinstance(v, basestring):
+                return '-type "string" "%s"' % v.replace('\\', '\\\\').replace('"', '\\"')
+            return repr(v)
+
+        def set_attrs(f, node, attrs=None):
+            prefix = node + '.'
+            shorts = short_names.get(self.nodes[node], {})
+            for plug in sorted(self.attrs):
+                if plug.startswith(prefix):
+                    attribute = plug[len(prefix):]
+                    v = self.attrs[plug] if attrs is None else attrs[plug]
+                    f.write('\tsetAttr ".%s" %s;\n' % (shorts.get(attribute, attribute), value(v)))
+
+        def plug_name(plug):
+            node, _, attribute = plug.partition('.')
+            shorts = short_names.get(self.nodes.get(node), {})
+            return '%s.%s' % (node, shorts.get(attribute, attribute))
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # the values of the current layer, the master values being kept as adjustments
+        current = dict(self.attrs)
+        for plug, v in self.overrides.get(self.current_layer, ()):
+            current[plug] = v
+        shared = {'renderGlobals': 'defaultRenderGlobals', 'resolution': 'defaultResolution'}
+        names = sorted([n for n in self.nodes if n not in self.node_references and
+                        self.namespaces.get(n, ':') == ':' and self.nodes[n] != 'reference'])
+        f = open(path, 'w')
+        try:
+            f.write('//Maya ASCII 2014 scene\n')
+            f.write('//Name: %s\n' % os.path.basename(path))
+            f.write('//Last modified: %s\n' % time.strftime('%a, %b %d, %Y %I:%M:%S %p'))
+            f.write('//Codeset: UTF-8\n')
+            for reference, info in sorted(self.reference_info.items()):
+                depth = 1
+                parent = info['parent']
+                while parent is not None:
+                    depth += 1
+                    parent = self.reference_info[parent]['parent']
+                f.write('file -rdi %d -ns "%s" -rfn "%s" "%s";\n' % (
+                    depth, info['namespace'].split(':')[-1], info['node'], info['file']))
+            for reference in self.references:
+                info = self.reference_info[reference]
+                f.write('file -r -ns "%s"%s -rfn "%s" "%s";\n' % (
+                    info['namespace'], '' if info['loaded'] else ' -dr 1', info['node'], info['file']))
+            f.write('requires maya "2014";\n')
+            for i in range(0, len(self.plugins) - 1, 2):
+                f.write('requires "%s" "%s";\n' % (self.plugins[i], self.plugins[i + 1]))
+            for name in names:
+                node_type = self.nodes[name]
+                if name in shared.values() or node_type == 'camera':
+                    continue
+                f.write('createNode %s -n "%s";\n' % (node_type, name))
+                if node_type == 'transform':
+                    shape = name + 'Shape'
+                    if shape in self.cameras:
+                        f.write('createNode camera -n "%s" -p "%s";\n' % (shape, name))
+                        f.write('\tsetAttr ".rnd" %s;\n' % value(current['%s.renderable' % name]))
+                    continue
+                set_attrs(f, name, current)
+            f.write('createNode renderLayerManager -n "renderLayerManager";\n')
+            layers = [layer for layer in self.layers if self.namespaces[layer] == ':']
+            f.write('\tsetAttr ".crl" %d;\n' % layers.index(self.current_layer))
+            for name in names:
+                if name in shared.values():
+                    f.write('select -ne :%s;\n' % name)
+                    set_attrs(f, name, current)
+            for layer in layers:
+                adjustments = self.adjustments(layer)
+                if adjustments:
+                    f.write('select -ne %s;\n' % layer)
+                    for i, (plug, v) in enumerate(adjustments):
+                        f.write('\tsetAttr ".adjs[%d].val" %s;\n' % (i, value(v)))
+            for i, layer in enumerate(layers):
+                f.write('connectAttr "renderLayerManager.rlmi[%d]" "%s.rlid";\n' % (i, layer))
+                for j, (plug, v) in enumerate(self.adjustments(layer)):
+                    f.write('connectAttr "%s" "%s.adjs[%d].plg";\n' % (plug_name(plug), layer, j))
+                for render_pass in self.render_passes.get(layer, ()):
+                    f.write('connectAttr "%s.msg" "%s.rp" -na;\n' % (render_pass, layer))
+            f.write('// End of %s\n' % os.path.basename(path))
+        finally:
+            f.close()
+
+    def add_node(self, name, node_type, **attrs):
+        self.nodes[name] = node_type
+        for attribute, value in attrs.items():
+            self.attrs['%s.%s' % (name, attribute)] = value
+        return name
+
+    def add_reference(self, path, namespace, parent=None):
+        """
+        References the file at path under namespace, nested in the parent
+        reference if given, and returns the reference's path, with a copy
+        number like {1} if the file is referenced already
+        """
+        count = len([info for info in self.reference_info.values() if info['file'] == path])
+        reference = path if not count else '%s{%d}' % (path, count)
+        node = self.add_node('%sRN' % namespace.replace(':', '_'), 'reference')
+        self.reference_info[reference] = {'file': path, 'node': node, 'namespace': namespace,
+                                          'parent': parent, 'loaded': True, 'edits': []}
+        if parent is None:
+            self.references.append(reference)
+        return reference
+
+    def reference_children(self, reference):
+        return [r for r, info in sorted(self.reference_info.items()) if info['parent'] == reference]
+
+    def reference_nodes(self, reference):
+        """Returns the nodes of the reference, including those of its nested references"""
+        references = set([reference])
+        for r in self.reference_children(reference):
+            references.update([r] + self.reference_children(r))
+        return sorted([n for n, r in self.node_references.items() if r in references])
+
+    def add_layer(self, name, renderable=True, namespace=':'):
+        self.add_node(name, 'renderLayer', renderable=renderable)
+        self.layers.append(name)
+        self.namespaces[name] = namespace
+        self.overrides[name] = []
+        return name
+
+    def add_camera(self, transform, renderable=True):
+        shape = transform + 'Shape'
+        self.add_node(shape, 'camera')
+        self.add_node(transform, 'transform', renderable=renderable)
+        self.cameras[shape] = transform
+        return transform
+
+    def set_override(self, layer, plug, value):
+        """Overrides plug on layer, which must not be the current layer"""
+        for adjustment in self.overrides[layer]:
+            if adjustment[0] == plug:
+                adjustment[1] = value
+                return
+        self.overrides[layer].append([plug, value])
+
+    def _override(self, layer, plug):
+        for adjustment in self.overrides.get(layer, ()):
+            if adjustment[0] == plug:
+                return adjustment
+        return None
+
+    def get_attr(self, plug):
+        match = _ADJUSTMENT_REGEX.match(plug)
+        if match is not None:
+            return self._get_adjustment(match.group(1), int(match.group(2)), match.group(3))
+        adjustment = self._override(self.current_layer, plug)
+        if adjustment is not None:
+            return adjustment[1]
+        try:
+            return self.attrs[plug]
+        except KeyError:
+            raise ValueError('No object matches name: %s' % plug)
+
+    def set_attr(self, plug, value):
+        adjustment = self._override(self.current_layer, plug)
+        if adjustment is not None:
+            adjustment[1] = value
+        else:
+            self.attrs[plug] = value
+        self.modified = True
+
+    def adjustments(self, layer):
+        """
+        Returns the [plug, value] adjustments stored on layer. While another
+        layer is current, defaultRenderLayer holds the master values of the
+        plugs that layer overrides.
+        """
+        if layer == 'defaultRenderLayer':
+            if self.current_layer == 'defaultRenderLayer':
+                return []
+            return [[plug, self.attrs.get(plug)] for plug, value in self.overrides[self.current_layer]]
+        return self.overrides.get(layer, [])
+
+    def _get_adjustment(self, layer, index, field):
+        try:
+            plug, value = self.adjustments(layer)[index]
+        except IndexError:
+            raise ValueError('No object matches name: %s.adjustments[%d]' % (layer, index))
+        if field == 'plug':
+            return plug
+        return value
+
+    def switch_layer(self, layer):
+        if layer not in self.overrides:
+            raise RuntimeError('Render layer not found: %s' % layer)
+        if self.switch_latency:
+            time.sleep(self.switch_latency)
+        self.switches += 1
+        self.current_layer = layer
+
+    def ls(self, node_type):
+        return sorted([name for name, t in self.nodes.items() if t == node_type])
+
+def _touch(path):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    open(path, 'a').close()
+
+def generate_scene(file_nodes=100, sequences=0.1, udims=0.1, caches=10, cache_frames=0,
+                   layers=4, vray_elements=5, mr_passes=5, cameras=2, references=2,
+                   ref_nodes=0, shared_refs=0, nested_refs=0,
+                   frames=(1001, 1100), resolution=(1920, 1080), renderer='vray',
+                   switch_latency=0.0, root=None, seed=0):
+    """
+    Returns a FakeScene with the given numbers of file nodes, cache nodes,
+    render layers, VRay render elements, mental ray render passes, renderable
+    cameras and references. sequences and udims are the fractions of file
+    nodes using image sequences and UDIM tiles. With cache_frames, caches are
+    stored one file per frame.
+
+    Each referenced asset brings ref_nodes file nodes of its own, and
+    nested_refs nested references to parts shared by every asset. A rig
+    shared by shared_refs further references is referenced the same way.
+
+    Every other layer overrides the output prefix, and every third layer
+    disables a render element and a pass. With root, the scene lives under
+    root and all of its textures, sequence frames, tiles and caches are
+    created there as empty files.
+    """
+    rng = random.Random(seed)
+    base = (root or '/tmp/zync_fake').rstrip('/')
+    scene = FakeScene('%s/scenes/shot.ma' % base, '%s/' % base)
+    scene.switch_latency = switch_latency
+    scene.plugins = ['vrayformaya', '2.40.01', 'Mayatomr', '2013.0']
+    start, end = frames
+    created = []
+
+    scene.add_node('defaultRenderGlobals', 'renderGlobals', startFrame=float(start), endFrame=float(end),
+                   byFrameStep=1.0, imageFilePrefix='<RenderLayer>/<Scene>', extensionPadding=4,
+                   currentRenderer=renderer)
+    scene.add_node('defaultResolution', 'resolution', width=resolution[0], height=resolution[1])
+    scene.add_node('vraySettings', 'VRaySettingsNode', fileNamePrefix='<Layer>/<Layer>',
+                   imageFormatStr='exr', fileNamePadding=4, ifile='')
+
+    for i in range(file_nodes):
+        attrs = {'useFrameExtension': False, 'uvTilingMode': 0}
+        roll = rng.random()
+        if roll < sequences:
+            attrs['useFrameExtension'] = True
+            path = '%s/sourceimages/seq%d/seq%d.%04d.exr' % (base, i, i, start)
+            created.extend(['%s/sourceimages/seq%d/seq%d.%04d.exr' % (base, i, i, f)
+                            for f in range(start, end + 1)])
+        elif roll < sequences + udims:
+            attrs['uvTilingMode'] = 3
+            path = '%s/sourceimages/udim/tex%d.1001.tif' % (base, i)
+            created.extend(['%s/sourceimages/udim/tex%d.%d.tif' % (base, i, 1001 + t) for t in range(4)])
+        else:
+            path = '%s/sourceimages/tex/tex%d.tif' % (base, i)
+            created.append(path)
+        attrs['fileTextureName'] = path
+        scene.add_node('file%d' % (i + 1), 'file', **attrs)
+
+    for i in range(caches):
+        cache_dir = '%s/data/cache%d' % (base, i)
+        name = 'geoShape%d' % i
+        scene.add_node('cacheFile%d' % (i + 1), 'cacheFile', cachePath=cache_dir, cacheName=name)
+        created.append('%s/%s.xml' % (cache_dir, name))
+        if cache_frames:
+            created.extend(['%s/%sFrame%d.mc' % (cache_dir, name, f) for f in range(start, start + cache_frames)])
+        else:
+            created.append('%s/%s.mc' % (cache_dir, name))
+
+    for i in range(vray_elements):
+        element = 'vrayRE_%d' % i
+        scene.add_node(element, 'VRayRenderElement', enabled=True)
+        scene.attrs['%s.vray_name_element%d' % (element, i)] = 'element%d' % i
+
+    passes = []
+    for i in range(mr_passes):
+        passes.append(scene.add_node('pass%d' % i, 'renderPass', renderable=True))
+
+    for i in range(layers):
+        layer = scene.add_layer('layer%d' % (i + 1))
+        scene.render_passes[layer] = list(passes)
+        if i % 2:
+            scene.set_override(layer, 'vraySettings.fileNamePrefix', '<Layer>/%s_<Layer>' % layer)
+            scene.set_override(layer, 'defaultRenderGlobals.imageFilePrefix', '%s/<Scene>' % layer)
+        if i % 3 == 2:
+            if vray_elements:
+                scene.set_override(layer, 'vrayRE_0.enabled', False)
+            if passes:
+                scene.set_override(layer, 'pass0.renderable', False)
+
+    scene.add_camera('persp', renderable=False)
+    for i in range(cameras):
+        scene.add_camera('cam%d' % (i + 1))
+
+    def add_asset(path, namespace, parent=None):
+        reference = scene.add_reference(path, namespace, parent)
+        created.append(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        for j in range(ref_nodes):
+            texture = '%s/assets/%s/tex%d.tif' % (base, name, j)
+            node = scene.add_node('%s:file%d' % (namespace, j + 1), 'file', fileTextureName=texture,
+                                  useFrameExtension=False, uvTilingMode=0)
+            scene.node_references[node] = reference
+            created.append(texture)
+        if parent is None:
+            for j in range(nested_refs):
+                add_asset('%s/assets/part%d.ma' % (base, j), '%s:part%d' % (namespace, j), reference)
+        return reference
+
+    for i in range(references):
+        namespace = 'asset%d' % (i + 1)
+        add_asset('%s/assets/%s.ma' % (base, namespace), namespace)
+        # referenced scenes bring their own layers, which the plugin skips
+        scene.add_layer('%s:defaultRenderLayer' % namespace, renderable=False, namespace=namespace)
+    for i in range(shared_refs):
+        add_asset('%s/assets/rig.ma' % base, 'rig%d' % (i + 1))
+
+    if root is not None:
+        for path in created:
+            _touch(path)
+    return scene
+
+class FakeCmds(object):
+    """
+    Implements the maya.cmds commands the plugin uses against a FakeScene.
+    UI commands keep their state in controls, a dict of control name to a
+    dict of flag values, with menu items and list items under 'items'.
+    """
+    def __init__(self, scene=None):
+        self.scene = scene or FakeScene()
+        self.module = None
+        self.calls = {}
+        self.controls = {}
+        self.dialogs = []
+        self.warnings = []
+
+    def load(self, scene):
+        self.scene = scene
+        self.controls.clear()
+        self.reset_calls()
+
+    def reset_calls(self):
+        self.calls.clear()
+        self.scene.switches = 0
+
+    # scene commands
+
+    def getAttr(self, plug, **kwargs):
+        value = self.scene.get_attr(plug)
+        if kwargs.get('type') or kwargs.get('typ'):
+            return _attribute_type(value)
+        return value
+
+    def setAttr(self, plug, value, **kwargs):
+        self.scene.set_attr(plug, value)
+
+    def ls(self, *args, **kwargs):
+        scene = self.scene
+        if kwargs.get('cameras'):
+            return sorted(scene.cameras)
+        node_type = kwargs.get('type')
+        if node_type == 'renderLayer':
+            if kwargs.get('showNamespace'):
+                result = []
+                for layer in scene.layers:
+                    result.extend([layer, scene.namespaces[layer]])
+                return result
+            return list(scene.layers)
+        if kwargs.get('rn') or kwargs.get('referencedNodes'):
+            nodes = sorted(scene.node_references)
+        else:
+            nodes = sorted(scene.nodes)
+        if node_type is not None:
+            types = [node_type] if isinstance(node_type, basestring) else node_type
+            nodes = [n for n in nodes if scene.nodes[n] in types]
+        if kwargs.get('showType') or kwargs.get('st'):
+            result = []
+            for node in nodes:
+                result.extend([node, scene.nodes[node]])
+            return result
+        return nodes
+
+    def nodeType(self, node, **kwargs):
+        try:
+            node_type = self.scene.nodes[node]
+        except KeyError:
+            raise RuntimeError('No object matches name: %s' % node)
+        if kwargs.get('inherited') or kwargs.get('i'):
+            return [node_type]
+        return node_type
+
+    def attributeQuery(self, attribute, **kwargs):
+        node = kwargs.get('node') or kwargs.get('n')
+        if kwargs.get('exists') or kwargs.get('ex'):
+            return '%s.%s' % (node, attribute) in self.scene.attrs
+        raise NotImplementedError('attributeQuery only answers exists')
+
+    def referenceQuery(self, target, **kwargs):
+        scene = self.scene
+        if kwargs.get('isNodeReferenced') or kwargs.get('inr'):
+            return target in scene.node_references
+        reference = scene.node_references.get(target, target)
+        info = scene.reference_info.get(reference)
+        if info is None:
+            # a reference node
+            for reference, info in scene.reference_info.items():
+                if info['node'] == target:
+                    break
+            else:
+                info = None
+        if info is None:
+            raise RuntimeError('%s is not a reference or referenced node' % target)
+        if kwargs.get('filename') or kwargs.get('f'):
+            if kwargs.get('withoutCopyNumber') or kwargs.get('wcn'):
+                return info['file']
+            return reference
+        if kwargs.get('referenceNode') or kwargs.get('rfn'):
+            return info['node']
+        if kwargs.get('isLoaded') or kwargs.get('il'):
+            return info['loaded']
+        if kwargs.get('nodes') or kwargs.get('n'):
+            return scene.reference_nodes(reference)
+        if kwargs.get('editStrings') or kwargs.get('es'):
+            return list(info['edits'])
+        raise TypeError('referenceQuery flags not supported: %r' % kwargs)
+
+    def listRelatives(self, node, **kwargs):
+        transform = self.scene.cameras.get(node)
+        return [transform] if transform else None
+
+    def listAttr(self, node, **kwargs):
+        prefix = node + '.'
+        return sorted([plug[len(prefix):] for plug in self.scene.attrs if plug.startswith(prefix)])
+
+    def listConnections(self, plug, **kwargs):
+        scene = self.scene
+        node, _, attribute = plug.partition('.')
+        if attribute == 'adjustments':
+            result = []
+            for i, (adjusted, value) in enumerate(scene.adjustments(node)):
+                result.extend(['%s.adjustments[%d].plug' % (node, i), adjusted])
+            return result or None
+        if attribute == 'renderPass':
+            return list(scene.render_passes.get(node, [])) or None
+        return None
+
+    def editRenderLayerGlobals(self, **kwargs):
+        if kwargs.get('q') or kwargs.get('query'):
+            return self.scene.current_layer
+        if kwargs.get('currentRenderLayer'):
+            self.scene.switch_layer(kwargs['currentRenderLayer'])
+
+    def file(self, *args, **kwargs):
+        scene = self.scene
+        if kwargs.get('q') or kwargs.get('query'):
+            if kwargs.get('loc') or kwargs.get('location'):
+                return scene.path
+            if kwargs.get('r') or kwargs.get('reference'):
+                if args:
+                    return scene.reference_children(args[0])
+                return list(scene.references)
+            if kwargs.get('modified'):
+                return scene.modified
+            return scene.path
+        if kwargs.get('open') or kwargs.get('o'):
+            scene.path = args[0]
+            scene.modified = False
+        elif 'rename' in kwargs:
+            scene.path = kwargs['rename']
+        elif 'modified' in kwargs:
+            scene.modified = bool(kwargs['modified'])
+        elif kwargs.get('save'):
+            scene.write_ascii(scene.path)
+            scene.modified = False
+        return scene.path
+
+    def workspace(self, *args, **kwargs):
+        return self.scene.project
+
+    def pluginInfo(self, *args, **kwargs):
+        return list(self.scene.plugins)
+
+    def mayaHasRenderSetup(self):
+        return False
+
+    def optionMenuGrp(self, name, **kwargs):
+        return 'OpenEXR (exr)'
+
+    def warning(self, msg):
+        self.warnings.append(msg)
+
+    def error(self, msg):
+        raise RuntimeError(msg)
+
+    def confirmDialog(self, **kwargs):
+        self.dialogs.append(kwargs.get('message'))
+        return kwargs.get('defaultButton') or kwargs.get('button')
+
+    # UI commands
+
+    def _control(self, name=None, *args, **kwargs):
+        if name is None:
+            name = 'control%d' % (len(self.controls) + 1)
+        query = kwargs.pop('q', False) or kwargs.pop('query', False)
+        edit = kwargs.pop('e', False) or kwargs.pop('edit', False)
+        if query:
+            if kwargs.get('ex') or kwargs.get('exists'):
+                return name in self.controls
+            control = self.controls.get(name)
+            if control is None:
+                raise RuntimeError('Object not found: %s' % name)
+            if kwargs.get('si') or kwargs.get('selectItem'):
+                return list(control.get('selectItem', [])) or None
+            if kwargs.get('ai') or kwargs.get('allItems'):
+                return list(control.get('items', [])) or None
+            if kwargs.get('ill') or kwargs.get('itemListLong'):
+                return ['%s|menuItem%d' % (name, i + 1) for i in range(len(control.get('items', [])))] or None
+            for flag in kwargs:
+                flag = _UI_FLAGS.get(flag, flag)
+                if flag == 'value' and 'value' not in control and control.get('items'):
+                    return control['items'][0]
+                return control.get(flag)
+            return None
+        control = self.controls.setdefault(name, {})
+        for flag, value in kwargs.items():
+            flag = _UI_FLAGS.get(flag, flag)
+            if flag in ('ra', 'removeAll'):
+                control['items'] = []
+            elif flag in ('append', 'allItems'):
+                control.setdefault('items', []).extend(value if isinstance(value, (list, tuple)) else [value])
+            elif flag == 'selectItem':
+                control['selectItem'] = value if isinstance(value, (list, tuple)) else [value]
+            else:
+                control[flag] = value
+        return name
+
+    textField = checkBox = optionMenu = textScrollList = _control
+    text = button = window = progressBar = columnLayout = _control
+
+    def menuItem(self, *args, **kwargs):
+        parent = kwargs.get('parent') or kwargs.get('p')
+        self.controls.setdefault(parent, {}).setdefault('items', []).append(kwargs.get('label') or kwargs.get('l'))
+        return '%s|menuItem%d' % (parent, len(self.controls[parent]['items']))
+
+    def showWindow(self, *args, **kwargs):
+        pass
+
+    def deleteUI(self, *names, **kwargs):
+        items = {}
+        for name in names:
+            if '|menuItem' in name:
+                parent, item = name.rsplit('|menuItem', 1)
+                items.setdefault(parent, []).append(int(item) - 1)
+            else:
+                self.controls.pop(name, None)
+        # menu items are numbered by position, so remove the last ones first
+        for parent, indexes in items.items():
+            for index in sorted(indexes, reverse=True):
+                del self.controls[parent]['items'][index]
+
+    def loadUI(self, f=None, **kwargs):
+        """
+        Creates the controls of a Qt Designer file, filling in each from
+        cmds.submit_callb as Maya does when it evaluates the dynamic
+        properties holding the callbacks.
+        """
+        path = f or kwargs.get('uiFile')
+        callback = getattr(self.module, 'submit_callb', None)
+        dialog = ElementTree.parse(path).getroot().find('widget')
+        name = dialog.get('name')
+        self.controls[name] = {}
+        for widget in dialog.getiterator('widget'):
+            command = _UI_COMMANDS.get(widget.get('class'))
+            if command is None:
+                continue
+            self.controls[widget.get('name')] = {}
+            for prop in widget.findall('property'):
+                text = prop.findtext('string') or ''
+                match = _CALLBACK_REGEX.search(text)
+                if match is None or callback is None:
+                    continue
+                value = callback(match.group(1))
+                flag = _UI_FLAGS.get(prop.get('name').lstrip('-'), prop.get('name').lstrip('-'))
+                if flag == 'text':
+                    # MEL turns the python result into a string
+                    value = '' if value is None else str(value)
+                if flag != 'ann':
+                    self.controls[widget.get('name')][flag] = value
+        return name
+
+class FakeZyncService(object):
+    """
+    Settings and a record of calls for the fake zync module. latency is
+    added to every call to ZYNC. fail_auth makes authentication fail;
+    fail_submit is the number of upcoming submissions that fail, or -1 for
+    all of them. authentications counts the clients created.
+    """
+    def __init__(self):
+        self.latency = 0.0
+        self.fail_auth = False
+        self.fail_submit = 0
+        self.authentications = 0
+        self.submitted = []
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def submit(self, job_type, scene_path, layers, params):
+        self.wait()
+        self.lock.acquire()
+        try:
+            if self.fail_submit:
+                if self.fail_submit > 0:
+                    self.fail_submit -= 1
+                raise Exception('ZYNC submission failed (simulated)')
+            self.submitted.append({'type': job_type, 'scene': scene_path, 'layers': layers, 'params': params})
+            return {'code': 0, 'response': len(self.submitted)}
+        finally:
+            self.lock.release()
+
+service = FakeZyncService()
+
+def _make_zync_module():
+    module = types.ModuleType('zync')
+    module.__file__ = __file__
+    module.VRAY_RENDERER = 'vray'
+    module.MENTAL_RAY_RENDERER = 'mr'
+    module.SOFTWARE_RENDERER = 'sw'
+    module.MAYA_RENDERERS = {'vray': 'V-Ray', 'mr': 'Mental Ray', 'sw': 'Maya Software'}
+    module.MAYA_DEFAULT_RENDERER = 'vray'
+    module.INSTANCE_TYPES = {'ZYNC8': {'csp_label': 'zync8', 'description': '8 core, 30GB'},
+                             'ZYNC16': {'csp_label': 'zync16', 'description': '16 core, 60GB'},
+                             'ZYNC32': {'csp_label': 'zync32', 'description': '32 core, 120GB'}}
+    module.DEFAULT_INSTANCE_TYPE = 'ZYNC16'
+
+    class ZyncAuthenticationError(Exception):
+        pass
+
+    class Zync(object):
+        def __init__(self, script_name, script_key, username=None, password=None):
+            service.wait()
+            if service.fail_auth:
+                raise ZyncAuthenticationError('Authentication failed (simulated)')
+            service.authentications += 1
+            self.username = username
+            self.path_mappings = []
+
+        def add_path_mappings(self, path_mappings):
+            self.path_mappings.extend(path_mappings)
+
+        def submit_job(self, job_type, scene_path, layers, params=None):
+            return service.submit(job_type, scene_path, layers, params)
+
+    def get_project_name(path):
+        service.wait()
+        return {'code': 0, 'response': os.path.splitext(os.path.basename(path))[0].split('_')[0]}
+
+    def get_maya_output_path(path):
+        service.wait()
+        return {'code': 0, 'response': os.path.join(os.path.dirname(os.path.dirname(path)), 'images')}
+
+    module.ZyncAuthenticationError = ZyncAuthenticationError
+    module.Zync = Zync
+    module.get_project_name = get_project_name
+    module.get_maya_output_path = get_maya_output_path
+    return module
+
+def _counted(fake, name, fn):
+    def wrapper(*args, **kwargs):
+        fake.calls[name] = fake.calls.get(name, 0) + 1
+        return fn(*args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+def _make_cmds_module(fake):
+    module = types.ModuleType('maya.cmds')
+    for name in dir(fake):
+        if name.startswith('_') or name in ('load', 'reset_calls', 'scene', 'module', 'calls',
+                                            'controls', 'dialogs', 'warnings'):
+            continue
+        setattr(module, name, _counted(fake, name, getattr(fake, name)))
+    fake.module = module
+    return module
+
+def _attribute_type(value):
+    # the getAttr -type of a value
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, long)):
+        return 'long'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, basestring):
+        return 'string'
+    return 'TdataCompound'
+
+def _make_openmaya_module(fake):
+    module = types.ModuleType('maya.api.OpenMaya')
+
+    class MPlug(object):
+        def __init__(self, plug):
+            self._plug = plug
+
+        def name(self):
+            return self._plug
+
+        def _value(self):
+            try:
+                return fake.scene.get_attr(self._plug)
+            except ValueError, e:
+                raise RuntimeError(str(e))
+
+        def asString(self):
+            # as the fake getAttr returns it, so the two compare equal
+            value = self._value()
+            return value if isinstance(value, basestring) else unicode(value)
+
+        def asBool(self):
+            return bool(self._value())
+
+        def asInt(self):
+            return int(self._value())
+
+        def asDouble(self):
+            return float(self._value())
+
+    class MSelectionList(object):
+        def __init__(self):
+            self._plugs = []
+
+        def add(self, plug):
+            fake.calls['MSelectionList.add'] = fake.calls.get('MSelectionList.add', 0) + 1
+            if plug not in fake.scene.attrs:
+                raise RuntimeError('(kInvalidParameter): Object does not exist')
+            if plug not in self._plugs:
+                self._plugs.append(plug)
+            return self
+
+        def length(self):
+            return len(self._plugs)
+
+        def getPlug(self, index):
+            fake.calls['MSelectionList.getPlug'] = fake.calls.get('MSelectionList.getPlug', 0) + 1
+            return MPlug(self._plugs[index])
+
+    module.MPlug = MPlug
+    module.MSelectionList = MSelectionList
+    return module
+
+def _make_utils_module():
+    module = types.ModuleType('maya.utils')
+    # there is no event loop, so calls run at once, one at a time
+    lock = threading.RLock()
+
+    def executeDeferred(fn, *args, **kwargs):
+        lock.acquire()
+        try:
+            fn(*args, **kwargs)
+        finally:
+            lock.release()
+
+    def executeInMainThreadWithResult(fn, *args, **kwargs):
+        lock.acquire()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            lock.release()
+
+    module.executeDeferred = executeDeferred
+    module.executeInMainThreadWithResult = executeInMainThreadWithResult
+    return module
+
+class _SlowImporter(object):
+    """
+    Import hook providing the fake zync and config_maya modules when they
+    are first imported, after sleeping for latency seconds, the way a zync
+    module on a slow network share imports
+    """
+    def __init__(self, modules, latency=0.0):
+        self.modules = modules
+        self.latency = latency
+
+    def find_module(self, name, path=None):
+        if name in self.modules:
+            return self
+        return None
+
+    def load_module(self, name):
+        if name not in sys.modules:
+            if self.latency:
+                time.sleep(self.latency)
+            sys.modules[name] = self.modules[name]
+        return sys.modules[name]
+
+def installed():
+    """Returns the installed FakeCmds, or None"""
+    cmds = sys.modules.get('maya.cmds')
+    return getattr(cmds, '_fake', None)
+
+def install(scene=None, import_latency=0.0):
+    """
+    Installs the fake maya, zync and config_maya modules, loading scene into
+    them, and returns the FakeCmds. Must be called before zync_maya is first
+    imported. Raises RuntimeError inside a real Maya.
+
+    zync and config_maya are only provided when they are imported, each
+    taking import_latency seconds to do so.
+    """
+    fake = installed()
+    if fake is not None:
+        if scene is not None:
+            fake.load(scene)
+        return fake
+    if 'maya.cmds' in sys.modules:
+        raise RuntimeError('maya.cmds is already imported; the fake can only be installed outside of Maya')
+
+    fake = FakeCmds(scene)
+    maya = types.ModuleType('maya')
+    maya.__path__ = []
+    maya.cmds = _make_cmds_module(fake)
+    maya.cmds._fake = fake
+    maya.utils = _make_utils_module()
+    maya.mel = types.ModuleType('maya.mel')
+    maya.mel.eval = lambda command: ''
+    maya.api = types.ModuleType('maya.api')
+    maya.api.__path__ = []
+    maya.api.OpenMaya = _make_openmaya_module(fake)
+
+    config = types.ModuleType('config_maya')
+    config.API_DIR = ''
+    config.API_KEY = 'fake-api-key'
+
+    sys.modules['maya'] = maya
+    sys.modules['maya.cmds'] = maya.cmds
+    sys.modules['maya.utils'] = maya.utils
+    sys.modules['maya.mel'] = maya.mel
+    sys.modules['maya.api'] = maya.api
+    sys.modules['maya.api.OpenMaya'] = maya.api.OpenMaya
+    sys.meta_path.insert(0, _SlowImporter({'zync': _make_zync_module(), 'config_maya': config},
+                                          import_latency))
+    return fake
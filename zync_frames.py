@@ -0,0 +1,301 @@
+"""
+ZYNC Frame Sets
+
+A compact set of frame numbers, stored as sorted runs of (start, end, step)
+rather than as a list of frames, so even a 100,000 frame set is a handful of
+tuples. Frame sets are parsed from and serialised to specs like:
+
+    1001-1100x2,1150,1200-1210
+
+where each comma separated item is a single frame, a range, or a range with
+a step. Ranges may be given as start-end or start:end, and negative frames
+are allowed, e.g. -10--1.
+
+This module has no dependency on Maya.
+
+Usage:
+    import zync_frames
+    frames = zync_frames.FrameSet.parse('1001-1100x2,1150')
+    failed = zync_frames.FrameSet.parse('1003,1005')
+    for chunk in (frames - failed).chunks(10):
+        print chunk
+
+"""
+
+import bisect
+import heapq
+import re
+
+_ITEM_REGEX = re.compile(r'^(-?\d+)(?:\s*[-:]\s*(-?\d+)(?:\s*[xX]\s*(\d+))?)?$')
+
+class FrameSetError(ValueError):
+    """Raised for a frame spec that can't be parsed"""
+    pass
+
+def _compress(frames):
+    """
+    Returns a list of (start, end, step) runs for an iterable of sorted,
+    unique frames. A run of only two frames is split in two singles, so
+    1,3,4,5 becomes 1 and 3-5 rather than 1-3x2 and 4-5.
+    """
+    runs = []
+    start = prev = step = None
+    count = 0
+    for frame in frames:
+        if start is None:
+            start = prev = frame
+            count = 1
+        elif count == 1:
+            step = frame - prev
+            prev = frame
+            count = 2
+        elif frame - prev == step:
+            prev = frame
+            count += 1
+        elif count == 2:
+            runs.append((start, start, 1))
+            start, step, prev = prev, frame - prev, frame
+        else:
+            runs.append((start, prev, step))
+            start = prev = frame
+            count = 1
+    if start is not None:
+        if count == 1:
+            runs.append((start, start, 1))
+        elif count == 2 and step != 1:
+            runs.append((start, start, 1))
+            runs.append((prev, prev, 1))
+        else:
+            runs.append((start, prev, step))
+    return runs
+
+def _merge_frames(iterables):
+    """Yields the sorted, unique frames of several sorted frame iterators"""
+    last = None
+    for frame in heapq.merge(*iterables):
+        if frame != last:
+            yield frame
+            last = frame
+
+class FrameSet(object):
+    """
+    An immutable set of frames. Supports len(), iteration in ascending order,
+    membership tests, comparison, and the set operators |, & and -.
+    """
+    __slots__ = ('runs', '_starts', '_len')
+
+    def __init__(self, runs=()):
+        self.runs = tuple(runs)
+        self._starts = [run[0] for run in self.runs]
+        self._len = sum([(end - start) // step + 1 for start, end, step in self.runs])
+
+    @classmethod
+    def parse(cls, spec, step=1):
+        """
+        Returns the FrameSet for a spec like '1001-1100x2,1150'. step applies
+        to ranges that don't give their own. Raises FrameSetError for an
+        invalid spec.
+        """
+        try:
+            step = int(step)
+        except (TypeError, ValueError):
+            raise FrameSetError('Invalid frame step: %r' % (step,))
+        if step < 1:
+            raise FrameSetError('Frame step must be at least 1, not %d' % step)
+        if spec is None or not str(spec).strip():
+            raise FrameSetError('No frames given')
+
+        ranges = []
+        for item in str(spec).split(','):
+            item = item.strip()
+            if not item:
+                continue
+            match = _ITEM_REGEX.match(item)
+            if match is None:
+                raise FrameSetError('Invalid frame range: %r' % item)
+            start = int(match.group(1))
+            if match.group(2) is None:
+                ranges.append((start, start, 1))
+                continue
+            end = int(match.group(2))
+            item_step = int(match.group(3) or step)
+            if end < start:
+                raise FrameSetError('Frame range ends before it starts: %r' % item)
+            if item_step < 1:
+                raise FrameSetError('Frame step must be at least 1: %r' % item)
+            ranges.append((start, start + (end - start) // item_step * item_step, item_step))
+        if not ranges:
+            raise FrameSetError('No frames given')
+        return cls._from_ranges(ranges)
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Returns the FrameSet of an iterable of frames, in any order"""
+        return cls(_compress(sorted(set([int(f) for f in frames]))))
+
+    @classmethod
+    def from_range(cls, start, end, step=1):
+        """Returns the FrameSet of start to end inclusive, every step frames"""
+        return cls._from_ranges([(int(start), int(start) + (int(end) - int(start)) // step * step, int(step))])
+
+    @classmethod
+    def _from_ranges(cls, ranges):
+        ranges = sorted(ranges)
+        if all([step == 1 for start, end, step in ranges]):
+            # plain intervals merge without touching individual frames
+            merged = []
+            for start, end, step in ranges:
+                if merged and start <= merged[-1][1] + 1:
+                    if end > merged[-1][1]:
+                        merged[-1][1] = end
+                else:
+                    merged.append([start, end])
+            return cls([(start, end, 1) for start, end in merged])
+        disjoint = True
+        for i in range(1, len(ranges)):
+            if ranges[i][0] <= ranges[i-1][1]:
+                disjoint = False
+                break
+        if disjoint:
+            return cls(ranges)
+        return cls(_compress(_merge_frames([_iter_run(r) for r in ranges])))
+
+    def __iter__(self):
+        for run in self.runs:
+            for frame in _iter_run(run):
+                yield frame
+
+    def __len__(self):
+        return self._len
+
+    def __nonzero__(self):
+        return bool(self.runs)
+
+    def __contains__(self, frame):
+        i = bisect.bisect_right(self._starts, frame) - 1
+        if i < 0:
+            return False
+        start, end, step = self.runs[i]
+        return frame <= end and (frame - start) % step == 0
+
+    def __eq__(self, other):
+        if not isinstance(other, FrameSet):
+            return NotImplemented
+        if self.runs == other.runs:
+            return True
+        return len(self) == len(other) and list(self) == list(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        # equal sets may be stored as different runs, but share these
+        return hash((len(self), self.start(), self.end()))
+
+    def start(self):
+        """Returns the first frame, or None for an empty set"""
+        return self.runs[0][0] if self.runs else None
+
+    def end(self):
+        """Returns the last frame, or None for an empty set"""
+        return self.runs[-1][1] if self.runs else None
+
+    def _is_intervals(self):
+        return all([step == 1 for start, end, step in self.runs])
+
+    def union(self, other):
+        return FrameSet._from_ranges(list(self.runs) + list(other.runs))
+
+    def difference(self, other):
+        if self._is_intervals() and other._is_intervals():
+            result = []
+            others = list(other.runs)
+            j = 0
+            for start, end, step in self.runs:
+                while j < len(others) and others[j][1] < start:
+                    j += 1
+                k = j
+                while start <= end and k < len(others) and others[k][0] <= end:
+                    o_start, o_end = others[k][0], others[k][1]
+                    if o_start > start:
+                        result.append((start, o_start - 1, 1))
+                    start = max(start, o_end + 1)
+                    k += 1
+                if start <= end:
+                    result.append((start, end, 1))
+            return FrameSet(result)
+        return FrameSet(_compress([f for f in self if f not in other]))
+
+    def intersection(self, other):
+        if len(other) < len(self):
+            self, other = other, self
+        return FrameSet(_compress([f for f in self if f in other]))
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+
+    def chunks(self, size):
+        """
+        Splits the set into consecutive FrameSets of up to size frames each,
+        in frame order, the way frames are handed out to render tasks.
+        """
+        size = int(size)
+        if size < 1:
+            raise FrameSetError('Chunk size must be at least 1, not %d' % size)
+        chunks = []
+        current = []
+        remaining = size
+        for start, end, step in self.runs:
+            while start <= end:
+                count = min(remaining, (end - start) // step + 1)
+                last = start + (count - 1) * step
+                current.append((start, last, step if count > 1 else 1))
+                remaining -= count
+                start = last + step
+                if remaining == 0:
+                    chunks.append(FrameSet(current))
+                    current = []
+                    remaining = size
+        if current:
+            chunks.append(FrameSet(current))
+        return chunks
+
+    def num_chunks(self, size):
+        """Returns the number of chunks of up to size frames"""
+        return (len(self) + size - 1) // size
+
+    def to_string(self, step=1):
+        """
+        Returns the canonical spec of the set. Runs whose step equals step are
+        written without an xN suffix, so the spec can be sent together with
+        a separate frame step.
+        """
+        parts = []
+        for start, end, run_step in self.runs:
+            if start == end:
+                parts.append(str(start))
+            elif run_step == step:
+                parts.append('%d-%d' % (start, end))
+            elif end == start + run_step:
+                parts.append('%d,%d' % (start, end))
+            else:
+                parts.append('%d-%dx%d' % (start, end, run_step))
+        return ','.join(parts)
+
+    def __str__(self):
+        return self.to_string()
+
+    def __repr__(self):
+        return 'FrameSet(%r)' % self.to_string()
+
+def _iter_run(run):
+    start, end, step = run
+    return iter(xrange(start, end + 1, step))
+
+def parse(spec, step=1):
+    """Shortcut for FrameSet.parse"""
+    return FrameSet.parse(spec, step)
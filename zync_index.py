@@ -0,0 +1,326 @@
+"""
+ZYNC File Index
+
+A persistent, on-disk index of file fingerprints for scene dependencies.
+Entries are keyed by path and remembered together with the size and mtime
+the file had when it was hashed, so a file is only hashed again once it has
+changed. The index is a single SQLite file, shared safely between several
+Maya sessions: writes are made in short transactions, and a session that
+finds the database locked waits for the other one rather than failing.
+
+The index lives in ~/.zync/file_index.db unless ZYNC_INDEX_PATH is set.
+
+Usage:
+    import zync_index
+    index = zync_index.FileIndex()
+    hashes = index.fingerprint_records(zync_maya.scan_scene_files())
+
+Warm the index for a whole project ahead of time:
+    python zync_index.py warm /path/to/project
+
+"""
+
+import hashlib
+import json
+import optparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+import Queue
+
+import zync_scan
+
+DEFAULT_WORKERS = 8
+HASH_CHUNK_SIZE = 1024 * 1024
+LOCK_TIMEOUT = 60.0
+
+# entries not seen for this long are dropped by evict()
+DEFAULT_MAX_AGE = 90 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1000000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL,
+    seen REAL NOT NULL,
+    meta TEXT
+)
+"""
+
+def default_index_path():
+    """Returns the location of the index, from ZYNC_INDEX_PATH or the user's home"""
+    path = os.environ.get('ZYNC_INDEX_PATH')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.zync', 'file_index.db')
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """Returns the md5 hex digest of the file, read in chunks"""
+    digest = hashlib.md5()
+    f = open(path, 'rb')
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+class IndexEntry(object):
+    """A fingerprinted file"""
+    __slots__ = ('path', 'size', 'mtime', 'hash', 'meta')
+
+    def __init__(self, path, size, mtime, hash, meta=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.hash = hash
+        self.meta = meta
+
+    def __repr__(self):
+        return 'IndexEntry(%r, %r, %r, %r)' % (self.path, self.size, self.mtime, self.hash)
+
+class FileIndex(object):
+    """
+    The fingerprint index. A FileIndex may be used from one thread at a time;
+    fingerprinting hashes files on a pool of worker threads and writes the
+    results back from the calling thread.
+    """
+    def __init__(self, path=None, timeout=LOCK_TIMEOUT):
+        self.path = path or default_index_path()
+        index_dir = os.path.dirname(self.path)
+        if index_dir and not os.path.exists(index_dir):
+            try:
+                os.makedirs(index_dir)
+            except OSError:
+                # another session created it first
+                if not os.path.isdir(index_dir):
+                    raise
+        self.timeout = timeout
+        # transactions are managed by _write, so the connection runs in autocommit mode
+        self.conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        try:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            # older SQLite builds can't use WAL, the default journal is still safe
+            pass
+        self._write(lambda c: c.execute(_SCHEMA))
+        self.hashed = 0
+        self.reused = 0
+
+    def close(self):
+        self.conn.close()
+
+    def _write(self, fn, *args):
+        """Runs fn(conn, *args) in a transaction, retrying while another session holds the lock"""
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                self.conn.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError, e:
+                if 'locked' in str(e) and time.time() < deadline:
+                    time.sleep(0.1)
+                    continue
+                raise
+            try:
+                result = fn(self.conn, *args)
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+            return result
+
+    def get(self, path):
+        """Returns the IndexEntry for path, or None if it isn't indexed"""
+        row = self.conn.execute('SELECT path, size, mtime, hash, meta FROM files WHERE path = ?',
+                                (zync_scan.normalize_path(path),)).fetchone()
+        if row is None:
+            return None
+        meta = row[4] and json.loads(row[4])
+        return IndexEntry(row[0], row[1], row[2], row[3], meta)
+
+    def lookup(self, path, size, mtime):
+        """Returns the cached hash if path is indexed with the same size and mtime"""
+        entry = self.get(path)
+        if entry is not None and entry.size == size and entry.mtime == mtime:
+            return entry.hash
+        return None
+
+    def _store(self, conn, entries, now):
+        conn.executemany('INSERT OR REPLACE INTO files (path, size, mtime, hash, seen, meta) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         [(e.path, e.size, e.mtime, e.hash, now, e.meta and json.dumps(e.meta))
+                          for e in entries])
+
+    def _touch(self, conn, paths, now):
+        conn.executemany('UPDATE files SET seen = ? WHERE path = ?', [(now, p) for p in paths])
+
+    def fingerprint_records(self, records, workers=DEFAULT_WORKERS, batch_size=500):
+        """
+        Returns a dict mapping path to content hash for the given
+        zync_scan.FileRecords. Only files that are new to the index, or whose
+        size or mtime changed, are hashed. Missing files are skipped.
+        """
+        hashes = {}
+        to_hash = []
+        seen = []
+        for record in records:
+            if not record.exists:
+                continue
+            cached = self.lookup(record.path, record.size, record.mtime)
+            if cached is None:
+                to_hash.append(record)
+            else:
+                hashes[record.path] = cached
+                seen.append(record.path)
+        self.reused += len(seen)
+        now = time.time()
+        if seen:
+            self._write(self._touch, seen, now)
+
+        batch = []
+        for entry in _hash_records(to_hash, workers):
+            hashes[entry.path] = entry.hash
+            self.hashed += 1
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                self._write(self._store, batch, now)
+                batch = []
+        if batch:
+            self._write(self._store, batch, now)
+        return hashes
+
+    def fingerprint(self, path):
+        """Returns the content hash for a single path, or None if it doesn't exist"""
+        record = zync_scan.stat_ref((zync_scan.normalize_path(path), None, None))
+        return self.fingerprint_records([record], workers=1).get(record.path)
+
+    def warm(self, directory, workers=DEFAULT_WORKERS):
+        """
+        Fingerprints every file below directory, so later submissions from it
+        find their dependencies already indexed. Returns the number of files.
+        """
+        def walk():
+            for root, dirs, files in os.walk(directory):
+                for name in files:
+                    yield os.path.join(root, name)
+        records = zync_scan.iter_scan(walk(), workers)
+        return len(self.fingerprint_records(records, workers))
+
+    def invalidate(self, paths=None):
+        """Removes the given paths from the index, or every entry if paths is None"""
+        if paths is None:
+            self._write(lambda c: c.execute('DELETE FROM files'))
+        else:
+            paths = [(zync_scan.normalize_path(p),) for p in paths]
+            self._write(lambda c: c.executemany('DELETE FROM files WHERE path = ?', paths))
+
+    def evict(self, max_age=DEFAULT_MAX_AGE, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Drops entries that haven't been seen for max_age seconds, then the
+        least recently seen entries beyond max_entries. Returns the number of
+        entries removed.
+        """
+        def evict(conn):
+            removed = conn.execute('DELETE FROM files WHERE seen < ?', (time.time() - max_age,)).rowcount
+            count = conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            if count > max_entries:
+                removed += conn.execute('DELETE FROM files WHERE path IN '
+                                        '(SELECT path FROM files ORDER BY seen LIMIT ?)',
+                                        (count - max_entries,)).rowcount
+            return removed
+        return self._write(evict)
+
+    def compact(self):
+        """Reclaims the space left by removed entries"""
+        self.conn.execute('VACUUM')
+
+    def stats(self):
+        """Returns a dict with the entry count and total size of the indexed files"""
+        count, size = self.conn.execute('SELECT COUNT(*), SUM(size) FROM files').fetchone()
+        return {'entries': count,
+                'bytes': size or 0,
+                'hashed': self.hashed,
+                'reused': self.reused}
+
+def _hash_records(records, workers):
+    """Hashes FileRecords on a pool of threads, yielding IndexEntries as they complete"""
+    if not records:
+        return
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+    for record in records:
+        tasks.put(record)
+
+    def work():
+        while True:
+            try:
+                record = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                entry = IndexEntry(record.path, record.size, record.mtime, hash_file(record.path),
+                                   {'node': record.node, 'attribute': record.attribute})
+            except (IOError, OSError):
+                entry = None
+            results.put(entry)
+
+    threads = []
+    for _ in range(min(workers, len(records))):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for _ in range(len(records)):
+        entry = results.get()
+        if entry is not None:
+            yield entry
+    for thread in threads:
+        thread.join()
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] warm DIR... | evict | compact | stats')
+    parser.add_option('--index', help='index file, defaults to %s' % default_index_path())
+    parser.add_option('-j', '--workers', type='int', default=DEFAULT_WORKERS,
+                      help='number of files hashed at once')
+    parser.add_option('--max-age-days', type='float', default=DEFAULT_MAX_AGE / 86400.0,
+                      help='evict entries not seen for this many days')
+    parser.add_option('--max-entries', type='int', default=DEFAULT_MAX_ENTRIES,
+                      help='evict the oldest entries beyond this count')
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error('a command is required')
+
+    index = FileIndex(options.index)
+    try:
+        command = args[0]
+        if command == 'warm':
+            if len(args) < 2:
+                parser.error('warm needs at least one directory')
+            for directory in args[1:]:
+                count = index.warm(directory, options.workers)
+                print 'Indexed %d files in %s (%d hashed)' % (count, directory, index.hashed)
+        elif command == 'evict':
+            removed = index.evict(options.max_age_days * 86400, options.max_entries)
+            index.compact()
+            print 'Evicted %d entries' % removed
+        elif command == 'compact':
+            index.compact()
+        elif command == 'stats':
+            stats = index.stats()
+            print '%d entries, %d bytes' % (stats['entries'], stats['bytes'])
+        else:
+            parser.error('unknown command: %s' % command)
+    finally:
+        index.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
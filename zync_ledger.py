@@ -0,0 +1,479 @@
+"""
+ZYNC Upload Ledger
+
+A local record of the files uploaded for each project: their path, size,
+mtime and content hash, and where they went. When a shot is submitted again,
+the ledger splits its files into those that are new or changed since they
+were last uploaded, which need sending, and those already uploaded, which
+can be reused. Content hashes come from a zync_index.FileIndex, so only
+files that changed on disk are read again.
+
+The plugin only lists a job's files; the ZYNC client uploads them later.
+So a submission's files are recorded as pending, and only reused once
+confirmed: when frames of the job written after it was submitted arrive in
+its output folders, found from its zync_outputs manifest, or by hand with
+the confirm command. Pending files are planned for upload again.
+
+Like the file index, the ledger is a SQLite file shared between Maya
+sessions, at ~/.zync/upload_ledger.db unless ZYNC_LEDGER_PATH is set. Each
+submission's upload and reuse counts and bytes are kept as well, for stats.
+
+Usage:
+    import zync_ledger
+    ledger = zync_ledger.UploadLedger()
+    plan = ledger.plan_files('shot010', zync_maya.get_scene_files())
+    plan.upload, plan.reuse
+    ledger.record(plan, manifest_path)
+
+From the command line:
+    python zync_ledger.py stats
+    python zync_ledger.py verify --project shot010 --repair
+    python zync_ledger.py invalidate --project shot010
+    python zync_ledger.py confirm --project shot010
+
+"""
+
+import optparse
+import os
+import sqlite3
+import sys
+import time
+
+import zync_index
+import zync_outputs
+import zync_scan
+
+LOCK_TIMEOUT = 60.0
+
+_SCHEMA = ["""
+CREATE TABLE IF NOT EXISTS uploads (
+    project TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL,
+    remote TEXT NOT NULL,
+    uploaded REAL NOT NULL,
+    confirmed INTEGER NOT NULL DEFAULT 0,
+    manifest TEXT,
+    PRIMARY KEY (project, path)
+)
+""", """
+CREATE TABLE IF NOT EXISTS submissions (
+    project TEXT NOT NULL,
+    submitted REAL NOT NULL,
+    uploaded_files INTEGER NOT NULL,
+    uploaded_bytes INTEGER NOT NULL,
+    reused_files INTEGER NOT NULL,
+    reused_bytes INTEGER NOT NULL
+)
+"""]
+
+# columns added since the first ledgers were written; their entries are
+# pending, so files recorded before uploads were confirmed are sent again
+_ADDED_COLUMNS = [('uploads', 'confirmed', 'INTEGER NOT NULL DEFAULT 0'),
+                  ('uploads', 'manifest', 'TEXT')]
+
+_ENTRY_COLUMNS = 'project, path, size, mtime, hash, remote, uploaded, confirmed, manifest'
+
+def default_ledger_path():
+    """Returns the location of the ledger, from ZYNC_LEDGER_PATH or the user's home"""
+    path = os.environ.get('ZYNC_LEDGER_PATH')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.zync', 'upload_ledger.db')
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '%.1f %s' % (size, unit) if unit != 'B' else '%d B' % size
+        size /= 1024.0
+
+def frames_arrived(manifest_path, since):
+    """
+    Returns whether any frame of the job whose zync_outputs manifest is at
+    manifest_path was written at or after since. Only output folders
+    modified since then are listed.
+    """
+    try:
+        manifest = zync_outputs.OutputManifest.load(manifest_path)
+    except (IOError, OSError, ValueError, KeyError):
+        return False
+    for directory, sequences in manifest.by_directory().items():
+        directory = directory or '.'
+        try:
+            if os.stat(directory).st_mtime < since:
+                continue
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for sequence in sequences:
+            prefix = os.path.basename(sequence.head)
+            for name in names:
+                if not name.startswith(prefix) or not name.endswith(sequence.tail):
+                    continue
+                number = name[len(prefix):len(name) - len(sequence.tail)]
+                if not number.lstrip('-').isdigit():
+                    continue
+                try:
+                    if os.stat(os.path.join(directory, name)).st_mtime >= since:
+                        return True
+                except OSError:
+                    pass
+    return False
+
+class LedgerEntry(object):
+    """
+    A file listed for upload. confirmed is whether it is known to have been
+    uploaded; manifest is the output manifest of the job it was listed with.
+    """
+    __slots__ = ('project', 'path', 'size', 'mtime', 'hash', 'remote', 'uploaded', 'confirmed', 'manifest')
+
+    def __init__(self, project, path, size, mtime, hash, remote, uploaded, confirmed=True, manifest=None):
+        self.project = project
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.hash = hash
+        self.remote = remote
+        self.uploaded = uploaded
+        self.confirmed = bool(confirmed)
+        self.manifest = manifest
+
+    def __repr__(self):
+        return 'LedgerEntry(%r, %r, %r)' % (self.project, self.path, self.hash)
+
+class UploadPlan(object):
+    """
+    A project's files split into those to upload, as (FileRecord, hash,
+    remote) tuples, and those to reuse, as LedgerEntries. missing are the
+    FileRecords of files that don't exist.
+    """
+    def __init__(self, project):
+        self.project = project
+        self.upload = []
+        self.reuse = []
+        self.missing = []
+
+    @property
+    def upload_bytes(self):
+        return sum([record.size for record, hash, remote in self.upload])
+
+    @property
+    def reused_bytes(self):
+        return sum([entry.size for entry in self.reuse])
+
+    def upload_paths(self):
+        return [record.path for record, hash, remote in self.upload]
+
+    def reuse_list(self):
+        """Returns a [path, remote, hash] list for each reused file"""
+        return [[entry.path, entry.remote, entry.hash] for entry in self.reuse]
+
+    def to_dict(self):
+        return {'project': self.project,
+                'upload': self.upload_paths(),
+                'reuse': self.reuse_list(),
+                'missing': [record.path for record in self.missing],
+                'upload_bytes': self.upload_bytes,
+                'reused_bytes': self.reused_bytes}
+
+    def format(self):
+        return '%d files to upload (%s), %d unchanged since their last upload (%s saved), %d missing' % (
+            len(self.upload), _format_bytes(self.upload_bytes), len(self.reuse),
+            _format_bytes(self.reused_bytes), len(self.missing))
+
+class UploadLedger(object):
+    """
+    The ledger. Like a FileIndex, an UploadLedger may be used from one
+    thread at a time; make one per thread. index is the FileIndex hashes
+    come from, by default one on the default index file.
+    """
+    def __init__(self, path=None, index=None, timeout=LOCK_TIMEOUT):
+        self.path = path or default_ledger_path()
+        ledger_dir = os.path.dirname(self.path)
+        if ledger_dir and not os.path.exists(ledger_dir):
+            try:
+                os.makedirs(ledger_dir)
+            except OSError:
+                # another session created it first
+                if not os.path.isdir(ledger_dir):
+                    raise
+        self.timeout = timeout
+        self._index = index
+        self.conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        try:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            pass
+        for statement in _SCHEMA:
+            self._write(lambda c: c.execute(statement))
+        self._write(self._add_columns)
+
+    def _add_columns(self, conn):
+        for table, column, definition in _ADDED_COLUMNS:
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(%s)' % table)]
+            if column not in columns:
+                conn.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, column, definition))
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = zync_index.FileIndex()
+        return self._index
+
+    def close(self):
+        self.conn.close()
+
+    def _write(self, fn, *args):
+        """Runs fn(conn, *args) in a transaction, retrying while another session holds the lock"""
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                self.conn.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError, e:
+                if 'locked' in str(e) and time.time() < deadline:
+                    time.sleep(0.1)
+                    continue
+                raise
+            try:
+                result = fn(self.conn, *args)
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+            return result
+
+    def entries(self, project=None):
+        """Returns the LedgerEntries of the project, or of every project"""
+        query = 'SELECT %s FROM uploads' % _ENTRY_COLUMNS
+        if project is None:
+            rows = self.conn.execute(query + ' ORDER BY project, path')
+        else:
+            rows = self.conn.execute(query + ' WHERE project = ? ORDER BY path', (project,))
+        return [LedgerEntry(*row) for row in rows]
+
+    def get(self, project, path):
+        row = self.conn.execute('SELECT %s FROM uploads WHERE project = ? AND path = ?' % _ENTRY_COLUMNS,
+                                (project, zync_scan.normalize_path(path))).fetchone()
+        return LedgerEntry(*row) if row is not None else None
+
+    def plan(self, project, records, hashes, remote_for=None):
+        """
+        Returns the UploadPlan of zync_scan.FileRecords, given their content
+        hashes by path. A file is reused if its upload for the project was
+        confirmed, with the same content to the same remote location.
+        remote_for(path) returns a file's remote location, by default its
+        path.
+        """
+        if remote_for is None:
+            remote_for = lambda path: path
+        plan = UploadPlan(project)
+        uploaded = dict([(entry.path, entry) for entry in self.entries(project)])
+        for record in records:
+            if not record.exists or record.path not in hashes:
+                plan.missing.append(record)
+                continue
+            digest = hashes[record.path]
+            remote = remote_for(record.path) or record.path
+            entry = uploaded.get(record.path)
+            if entry is not None and entry.confirmed and entry.hash == digest and entry.remote == remote:
+                plan.reuse.append(entry)
+            else:
+                plan.upload.append((record, digest, remote))
+        return plan
+
+    def plan_files(self, project, paths, remote_for=None, workers=zync_scan.DEFAULT_WORKERS):
+        """
+        Returns the UploadPlan of files given as paths or (path, node,
+        attribute) references, after confirming the project's pending
+        uploads whose jobs have rendered
+        """
+        self.reconcile(project)
+        records = zync_scan.scan(paths, workers)
+        hashes = self.index.fingerprint_records(records, workers)
+        return self.plan(project, records, hashes, remote_for)
+
+    def record(self, plan, manifest=None):
+        """
+        Records a plan's files as pending uploads, once its job is submitted,
+        along with the submission's counts. manifest is the path of the job's
+        output manifest, which reconcile() confirms them from. The reused
+        files' entries are kept.
+        """
+        now = time.time()
+        rows = [(plan.project, record.path, record.size, record.mtime, digest, remote, now, manifest)
+                for record, digest, remote in plan.upload]
+        def record(conn):
+            conn.executemany('INSERT OR REPLACE INTO uploads (project, path, size, mtime, hash, remote, '
+                             'uploaded, confirmed, manifest) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)', rows)
+            conn.execute('INSERT INTO submissions (project, submitted, uploaded_files, uploaded_bytes, '
+                         'reused_files, reused_bytes) VALUES (?, ?, ?, ?, ?, ?)',
+                         (plan.project, now, len(plan.upload), plan.upload_bytes,
+                          len(plan.reuse), plan.reused_bytes))
+        self._write(record)
+
+    def confirm(self, project=None, paths=None, manifest=None):
+        """
+        Marks pending uploads as uploaded, so they are reused: the given
+        paths of the project, those listed with a job's manifest, every file
+        of the project, or everything. Returns the number of entries
+        confirmed.
+        """
+        where = ['confirmed = 0']
+        args = []
+        if project is not None:
+            where.append('project = ?')
+            args.append(project)
+        if manifest is not None:
+            where.append('manifest = ?')
+            args.append(manifest)
+        query = 'UPDATE uploads SET confirmed = 1 WHERE ' + ' AND '.join(where)
+        def confirm(conn):
+            if paths is None:
+                return conn.execute(query, args).rowcount
+            rows = [args + [zync_scan.normalize_path(p)] for p in paths]
+            return conn.executemany(query + ' AND path = ?', rows).rowcount
+        return self._write(confirm)
+
+    def reconcile(self, project=None):
+        """
+        Confirms the pending uploads of the project, or of every project,
+        whose jobs have had frames arrive since they were submitted, as the
+        job couldn't render without them. Returns the number confirmed.
+        """
+        query = 'SELECT manifest, MIN(uploaded) FROM uploads WHERE confirmed = 0 AND manifest IS NOT NULL'
+        args = ()
+        if project is not None:
+            query += ' AND project = ?'
+            args = (project,)
+        confirmed = 0
+        for manifest, since in self.conn.execute(query + ' GROUP BY manifest', args).fetchall():
+            if frames_arrived(manifest, since):
+                confirmed += self.confirm(project, manifest=manifest)
+        return confirmed
+
+    def invalidate(self, project=None, paths=None):
+        """
+        Forgets uploads, so the files are sent again: the given paths of the
+        project, every file of the project, or everything. Returns the number
+        of entries removed.
+        """
+        def invalidate(conn):
+            if project is None:
+                return conn.execute('DELETE FROM uploads').rowcount
+            if paths is None:
+                return conn.execute('DELETE FROM uploads WHERE project = ?', (project,)).rowcount
+            rows = [(project, zync_scan.normalize_path(p)) for p in paths]
+            return conn.executemany('DELETE FROM uploads WHERE project = ? AND path = ?', rows).rowcount
+        return self._write(invalidate)
+
+    def verify(self, project=None, repair=False, workers=zync_scan.DEFAULT_WORKERS):
+        """
+        Checks the ledger against the files on disk, returning a list of
+        (LedgerEntry, problem) pairs for files that are missing or whose
+        content changed since their upload, and for a damaged database. With
+        repair, those entries are invalidated, or a damaged ledger emptied.
+        """
+        problems = []
+        check = self.conn.execute('PRAGMA integrity_check').fetchone()[0]
+        if check != 'ok':
+            problems.append((None, 'damaged ledger: %s' % check))
+            if repair:
+                self._write(lambda c: c.execute('DELETE FROM uploads'))
+            return problems
+        entries = self.entries(project)
+        by_path = {}
+        for entry in entries:
+            by_path.setdefault(entry.path, []).append(entry)
+        records = zync_scan.scan(by_path.keys(), workers)
+        changed = [r for r in records if r.exists and
+                   [e for e in by_path[r.path] if (e.size, e.mtime) != (r.size, r.mtime)]]
+        hashes = self.index.fingerprint_records(changed, workers)
+        for record in records:
+            for entry in by_path[record.path]:
+                if not record.exists:
+                    problems.append((entry, 'missing'))
+                elif (entry.size, entry.mtime) != (record.size, record.mtime) and \
+                        hashes.get(record.path) != entry.hash:
+                    problems.append((entry, 'changed since upload'))
+        if repair:
+            stale = {}
+            for entry, problem in problems:
+                stale.setdefault(entry.project, []).append(entry.path)
+            for stale_project, paths in stale.items():
+                self.invalidate(stale_project, paths)
+        return problems
+
+    def stats(self, project=None):
+        """Returns a dict of the entries and bytes recorded, and the submissions' totals"""
+        where, args = ('WHERE project = ?', (project,)) if project is not None else ('', ())
+        entries, size, pending = self.conn.execute('SELECT COUNT(*), SUM(size), SUM(1 - confirmed) FROM uploads ' +
+                                                   where, args).fetchone()
+        row = self.conn.execute('SELECT COUNT(*), SUM(uploaded_files), SUM(uploaded_bytes), SUM(reused_files), '
+                                'SUM(reused_bytes) FROM submissions ' + where, args).fetchone()
+        return {'entries': entries,
+                'bytes': size or 0,
+                'pending': pending or 0,
+                'submissions': row[0],
+                'uploaded_files': row[1] or 0,
+                'uploaded_bytes': row[2] or 0,
+                'reused_files': row[3] or 0,
+                'reused_bytes': row[4] or 0}
+
+    def submissions(self, project=None, limit=20):
+        """Returns the latest submissions' (project, submitted, uploaded files and bytes, reused files and bytes)"""
+        where, args = ('WHERE project = ?', (project,)) if project is not None else ('', ())
+        return self.conn.execute('SELECT project, submitted, uploaded_files, uploaded_bytes, reused_files, '
+                                 'reused_bytes FROM submissions ' + where + ' ORDER BY submitted DESC LIMIT ?',
+                                 args + (limit,)).fetchall()
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] stats | verify | invalidate [PATH...] | '
+                                         'confirm [PATH...] | list')
+    parser.add_option('--ledger', help='ledger file, defaults to %s' % default_ledger_path())
+    parser.add_option('-p', '--project', help='the project, by default all of them')
+    parser.add_option('--repair', action='store_true', help='invalidate the entries verify finds stale')
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error('a command is required')
+    command = args[0]
+    ledger = UploadLedger(options.ledger)
+    try:
+        if command == 'stats':
+            stats = ledger.stats(options.project)
+            print '%d files recorded (%s), %d not confirmed as uploaded' % (
+                stats['entries'], _format_bytes(stats['bytes']), stats['pending'])
+            print '%d submissions: %d files uploaded (%s), %d reused (%s saved)' % (
+                stats['submissions'], stats['uploaded_files'], _format_bytes(stats['uploaded_bytes']),
+                stats['reused_files'], _format_bytes(stats['reused_bytes']))
+            for project, submitted, up_files, up_bytes, re_files, re_bytes in ledger.submissions(options.project):
+                print '  %s  %s: %d uploaded (%s), %d reused (%s saved)' % (
+                    time.strftime('%Y-%m-%d %H:%M', time.localtime(submitted)), project,
+                    up_files, _format_bytes(up_bytes), re_files, _format_bytes(re_bytes))
+        elif command == 'verify':
+            problems = ledger.verify(options.project, options.repair)
+            for entry, problem in problems:
+                print '%s: %s' % (entry.path if entry is not None else ledger.path, problem)
+            print '%d problems%s' % (len(problems), ', repaired' if options.repair and problems else '')
+            return 1 if problems and not options.repair else 0
+        elif command == 'invalidate':
+            if args[1:] and not options.project:
+                parser.error('invalidating paths needs a --project')
+            print '%d entries invalidated' % ledger.invalidate(options.project, args[1:] or None)
+        elif command == 'confirm':
+            if args[1:] and not options.project:
+                parser.error('confirming paths needs a --project')
+            print '%d entries confirmed' % ledger.confirm(options.project, args[1:] or None)
+        elif command == 'list':
+            for entry in ledger.entries(options.project):
+                print '%s  %s  %s -> %s%s' % (entry.project, entry.hash[:8], entry.path, entry.remote,
+                                              '' if entry.confirmed else '  (pending)')
+        else:
+            parser.error('unknown command %s' % command)
+    finally:
+        ledger.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
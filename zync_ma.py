@@ -0,0 +1,704 @@
+"""
+ZYNC Maya ASCII Parser
+
+Reads what the plugin gathers from a live scene, its render layers and
+their output prefixes, passes, padding, extension, cameras, plugins,
+references and file dependencies, straight from a .ma file, without Maya.
+This makes checks possible on the farm or in pipeline tools, and across
+thousands of scenes at once with scan_scenes().
+
+The file is read once, in chunks, and only the statements that matter are
+kept: createNode, select, setAttr and addAttr on the node types read here
+and those zync_deps reads files from, connectAttr, requires and file. Other
+statements, like the vertex data of meshes, are skipped without being split
+into tokens, so memory stays bounded however large the file is.
+
+Maya writes attributes by their short names; the ones read here are in
+ATTRIBUTES and the aliases of zync_deps' node types, and long names are
+accepted too. Legacy render layer overrides
+are resolved from the layers' adjustments, as
+zync_maya.LayerOverrideResolver does. Edits to referenced nodes are stored
+in the reference nodes and are not applied.
+
+File dependencies include those of referenced .ma files, nested ones too,
+each parsed once. Binary .mb references can't be read without Maya, so
+their files are missing from the list.
+
+Usage:
+    import zync_ma
+    scene = zync_ma.parse('/shows/a/scenes/shot010.ma')
+    scene_info = zync_ma.get_scene_info(scene)
+    files = zync_ma.get_scene_files(scene)
+
+From the command line:
+    python zync_ma.py --workers 8 --json /shows/a/scenes/*.ma
+
+"""
+
+import json
+import multiprocessing
+import optparse
+import os
+import re
+import sys
+
+import zync_deps
+import zync_outputs
+import zync_scan
+import zync_sequences
+
+CHUNK_SIZE = 1024 * 1024
+
+# tokens kept of any one statement; the values read here are in the first few
+MAX_TOKENS = 64
+
+DEFAULT_WORKERS = 4
+
+# the {1} Maya adds to the paths of repeated references
+_COPY_NUMBER_REGEX = re.compile(r'\{\d+\}$')
+
+# the attributes read from each node type, by short name, besides those of
+# the node types zync_deps reads files from
+ATTRIBUTES = {
+    'renderGlobals': {'ifp': 'imageFilePrefix', 'pad': 'extensionPadding', 'fs': 'startFrame',
+                      'ef': 'endFrame', 'bfs': 'byFrameStep', 'ren': 'currentRenderer',
+                      'if': 'imageFormat', 'imfkey': 'imfPluginKey'},
+    'resolution': {'w': 'width', 'h': 'height'},
+    'VRaySettingsNode': {'fnprx': 'fileNamePrefix', 'imgfs': 'imageFormatStr',
+                         'fnpad': 'fileNamePadding'},
+    'renderLayer': {'rndr': 'renderable'},
+    'renderLayerManager': {'crl': 'currentRenderLayer'},
+    'renderPass': {'rndr': 'renderable'},
+    'VRayRenderElement': {'enabled': 'enabled'},
+    'VRayRenderElementSet': {'enabled': 'enabled'},
+    'camera': {'rnd': 'renderable'},
+}
+
+# the types of the shared nodes Maya writes with select rather than createNode
+SHARED_NODES = {'defaultRenderGlobals': 'renderGlobals',
+                'defaultResolution': 'resolution',
+                'renderLayerManager': 'renderLayerManager'}
+
+# renderGlobals.currentRenderer values, as zync_outputs renderer names
+RENDERERS = {'vray': zync_outputs.VRAY_RENDERER,
+             'mentalRay': zync_outputs.MENTAL_RAY_RENDERER,
+             'mayaSoftware': zync_outputs.SOFTWARE_RENDERER}
+
+# renderGlobals.imageFormat values; 51 is a plugin format named by imfPluginKey
+IMAGE_FORMATS = {0: 'gif', 1: 'pic', 2: 'rla', 3: 'tif', 4: 'tif', 5: 'sgi', 6: 'als',
+                 7: 'iff', 8: 'jpg', 9: 'eps', 10: 'iff', 11: 'cin', 12: 'yuv', 13: 'sgi',
+                 19: 'tga', 20: 'bmp', 31: 'psd', 32: 'png', 35: 'dds', 36: 'psd'}
+DEFAULT_IMAGE_FORMAT = 7
+
+_TOKEN_REGEX = re.compile(r'//[^\n]*|"(?:[^"\\]|\\.)*"|;|[^\s;"]+|"', re.S)
+_STRING_REGEX = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+_SKIP_REGEX = re.compile(r'[;"/]')
+_ESCAPE_REGEX = re.compile(r'\\(.)')
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r'}
+_INDEX_REGEX = re.compile(r'^(\w+)\[(\d+)\]\.(\w+)$')
+
+def _unquote(token):
+    if len(token) > 1 and token[0] == '"' and token[-1] == '"':
+        return _ESCAPE_REGEX.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)), token[1:-1])
+    return token
+
+def _value(token):
+    """Returns the Python value of a setAttr value token"""
+    if token.startswith('"'):
+        return _unquote(token)
+    lower = token.lower()
+    if lower in ('yes', 'on', 'true'):
+        return True
+    if lower in ('no', 'off', 'false'):
+        return False
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+def iter_statements(f, wanted=None, chunk_size=CHUNK_SIZE, max_tokens=MAX_TOKENS):
+    """
+    Yields the tokens of each statement in the open Maya ASCII file f, with
+    strings still quoted. wanted(command) is asked about each statement as
+    its command is read; statements it returns False for are skipped without
+    being tokenised. Only the first max_tokens tokens of a statement are kept.
+    """
+    buf = ''
+    pos = 0
+    eof = False
+    tokens = []
+    # None before a statement's command, then True to keep it or False to skip it
+    keep = None
+    while True:
+        if keep is False:
+            match = _SKIP_REGEX.search(buf, pos)
+            if match is not None:
+                i = match.start()
+                char = buf[i]
+                if char == ';':
+                    pos = i + 1
+                    tokens = []
+                    keep = None
+                    continue
+                if char == '/':
+                    if buf.startswith('//', i):
+                        newline = buf.find('\n', i)
+                        if newline != -1:
+                            pos = newline + 1
+                            continue
+                        if eof:
+                            pos = len(buf)
+                            continue
+                    elif i + 1 < len(buf) or eof:
+                        pos = i + 1
+                        continue
+                string = _STRING_REGEX.match(buf, i)
+                if string is not None and (string.end() < len(buf) or eof):
+                    pos = string.end()
+                    continue
+                pos = i
+            else:
+                pos = len(buf)
+        else:
+            match = _TOKEN_REGEX.search(buf, pos)
+            # a token running to the end of the buffer may continue in the next
+            # chunk, as may a string whose closing quote isn't read yet
+            if match is not None and (eof or (match.end() < len(buf) and match.group(0) != '"')):
+                token = match.group(0)
+                pos = match.end()
+                if token.startswith('//'):
+                    continue
+                if token == ';':
+                    if keep and tokens:
+                        yield tokens
+                    tokens = []
+                    keep = None
+                    continue
+                if keep is None:
+                    keep = wanted is None or bool(wanted(token))
+                    if not keep:
+                        continue
+                if len(tokens) < max_tokens:
+                    tokens.append(token)
+                continue
+            if match is not None:
+                pos = match.start()
+            elif buf[pos:].strip() == '':
+                pos = len(buf)
+        if eof:
+            break
+        chunk = f.read(chunk_size)
+        buf = buf[pos:] + chunk
+        pos = 0
+        if not chunk:
+            eof = True
+    if keep and tokens:
+        yield tokens
+
+def attribute_aliases(node_type):
+    """Returns a dict of the short names of the node type's attributes read here to their long names"""
+    aliases = dict(zync_deps.registry.aliases(node_type))
+    aliases.update(ATTRIBUTES.get(node_type, {}))
+    return aliases
+
+def _is_read(node_type):
+    return node_type in ATTRIBUTES or zync_deps.registry.get(node_type) is not None
+
+class Reference(object):
+    """A file -r or file -rdi statement: a reference, or a nested one with depth over 1"""
+    __slots__ = ('path', 'namespace', 'node', 'depth', 'deferred')
+
+    def __init__(self, path, namespace=None, node=None, depth=1, deferred=False):
+        self.path = path
+        self.namespace = namespace
+        self.node = node
+        self.depth = depth
+        self.deferred = deferred
+
+    def __repr__(self):
+        return 'Reference(%r, depth=%d)' % (self.path, self.depth)
+
+class MaScene(object):
+    """
+    What was read from a Maya ASCII file: the node types and attribute values
+    of the nodes read, render layer adjustments and connections, plugins and
+    references
+    """
+    def __init__(self, path):
+        self.path = path
+        self.maya_version = None
+        self.plugins = []
+        self.references = []
+        self.nested_references = []
+        # node name to type, for the node types read
+        self.nodes = {}
+        self.order = []
+        self.attrs = {}
+        self.parents = {}
+        # (layer, index) to the overridden plug, and to its value
+        self.adjustment_plugs = {}
+        self.adjustment_values = {}
+        self.render_passes = {}
+        self.layer_ids = {}
+        self._aliases = {}
+
+    def ls(self, node_type):
+        return [node for node in self.order if self.nodes[node] == node_type]
+
+    def get_attr(self, plug, default=None):
+        return self.attrs.get(plug, default)
+
+    @property
+    def current_layer(self):
+        index = self.attrs.get('renderLayerManager.currentRenderLayer', 0)
+        return self.layer_ids.get(index, 'defaultRenderLayer')
+
+    def adjustments(self, layer):
+        """Returns a dict of each plug the layer overrides to its value for the layer"""
+        adjustments = {}
+        for (adj_layer, index), plug in self.adjustment_plugs.items():
+            if adj_layer == layer:
+                adjustments[plug] = self.adjustment_values.get((layer, index))
+        return adjustments
+
+    def get_layer_attr(self, layer, plug, default=None):
+        """Returns the value of plug as seen by the layer, without Maya"""
+        current = self.current_layer
+        if layer != current:
+            adjustments = self.adjustments(layer)
+            if plug in adjustments:
+                return adjustments[plug]
+            if current != 'defaultRenderLayer' and plug in self.adjustments(current):
+                # the master value, kept while another layer is current
+                return self.adjustments('defaultRenderLayer').get(plug, default)
+        return self.attrs.get(plug, default)
+
+    def alias(self, node, attribute):
+        """Returns the long name of an attribute of the node, from its short name"""
+        aliases = self._aliases.get(node)
+        if aliases and attribute in aliases:
+            return aliases[attribute]
+        return attribute_aliases(self.nodes.get(node)).get(attribute, attribute)
+
+    def plug(self, plug):
+        """Returns the plug with its node's leading : removed and its attribute's long name"""
+        node, _, attribute = plug.lstrip(':').partition('.')
+        return '%s.%s' % (node, self.alias(node, attribute))
+
+class _Reader(object):
+    """Builds a MaScene from the statements of a file"""
+    def __init__(self, scene):
+        self.scene = scene
+        self.current = None
+
+    def wanted(self, command):
+        if command in ('setAttr', 'addAttr'):
+            return self.current is not None
+        return command in ('createNode', 'select', 'connectAttr', 'requires', 'file')
+
+    def statement(self, tokens):
+        command = tokens[0]
+        handler = getattr(self, '_' + command, None)
+        if handler is not None:
+            handler(tokens[1:])
+
+    def _flags(self, tokens, valued):
+        """Returns a dict of the flags in tokens, those in valued taking a value, and the other tokens"""
+        flags = {}
+        args = []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token.startswith('-') and not token[1:2].isdigit():
+                if token in valued and i + 1 < len(tokens):
+                    flags[token] = _unquote(tokens[i + 1])
+                    i += 2
+                    continue
+                flags[token] = True
+            else:
+                args.append(token)
+            i += 1
+        return flags, args
+
+    def _createNode(self, tokens):
+        flags, args = self._flags(tokens, ('-n', '-name', '-p', '-parent'))
+        node_type = _unquote(args[0]) if args else None
+        name = (flags.get('-n') or flags.get('-name') or '').lstrip(':')
+        if node_type and _is_read(node_type) and name:
+            scene = self.scene
+            if name not in scene.nodes:
+                scene.order.append(name)
+            scene.nodes[name] = node_type
+            parent = flags.get('-p') or flags.get('-parent')
+            if parent:
+                scene.parents[name] = parent.lstrip(':')
+            self.current = name
+        else:
+            self.current = None
+
+    def _select(self, tokens):
+        flags, args = self._flags(tokens, ())
+        name = _unquote(args[-1]).lstrip(':') if args else ''
+        scene = self.scene
+        if name not in scene.nodes and name in SHARED_NODES:
+            scene.nodes[name] = SHARED_NODES[name]
+            scene.order.append(name)
+        self.current = name if name in scene.nodes else None
+
+    def _addAttr(self, tokens):
+        flags, args = self._flags(tokens, ('-sn', '-shortName', '-ln', '-longName', '-at', '-dt',
+                                           '-ci', '-nn', '-min', '-max', '-dv', '-p', '-uac'))
+        short = flags.get('-sn') or flags.get('-shortName')
+        long_name = flags.get('-ln') or flags.get('-longName')
+        if short and long_name:
+            self.scene._aliases.setdefault(self.current, {})[short] = long_name
+
+    def _setAttr(self, tokens):
+        attribute = None
+        values = []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if attribute is None and token.startswith('"') and '.' in token:
+                attribute = _unquote(token)
+            elif token.startswith('-') and not token[1:2].isdigit():
+                # -type, -k, -l, -s and the like take a value; -av doesn't
+                if token not in ('-av', '-alteredValue', '-ca', '-clamp'):
+                    i += 1
+            elif attribute is not None:
+                if token == '+' and values and i + 1 < len(tokens):
+                    # a long string, written in pieces
+                    values[-1] = values[-1][:-1] + tokens[i + 1][1:]
+                    i += 1
+                else:
+                    values.append(token)
+            i += 1
+        if attribute is None or not values:
+            return
+        scene = self.scene
+        node = self.current
+        if attribute.startswith('.'):
+            attribute = attribute[1:]
+        else:
+            node, _, attribute = attribute.lstrip(':').partition('.')
+            if node not in scene.nodes:
+                return
+        value = _value(values[-1]) if len(values) == 1 else [_value(v) for v in values]
+        match = _INDEX_REGEX.match(attribute)
+        if match is not None and scene.nodes.get(node) == 'renderLayer':
+            array, index, field = match.groups()
+            if array in ('adjs', 'adjustments') and field in ('val', 'value'):
+                scene.adjustment_values[(node, int(index))] = value
+            return
+        scene.attrs['%s.%s' % (node, scene.alias(node, attribute))] = value
+
+    def _connectAttr(self, tokens):
+        flags, args = self._flags(tokens, ())
+        if len(args) < 2:
+            return
+        scene = self.scene
+        source = _unquote(args[0]).lstrip(':')
+        destination = _unquote(args[1]).lstrip(':')
+        node, _, attribute = destination.partition('.')
+        if scene.nodes.get(node) != 'renderLayer':
+            return
+        match = _INDEX_REGEX.match(attribute)
+        if match is not None and match.group(1) in ('adjs', 'adjustments') and match.group(3) in ('plg', 'plug'):
+            scene.adjustment_plugs[(node, int(match.group(2)))] = scene.plug(source)
+        elif attribute.split('[')[0] in ('rp', 'renderPass'):
+            pass_node = source.partition('.')[0]
+            scene.render_passes.setdefault(node, []).append(pass_node)
+        elif attribute in ('rlid', 'renderLayerId'):
+            manager, _, plug = source.partition('.')
+            index = re.search(r'\[(\d+)\]', plug)
+            if index is not None:
+                scene.layer_ids[int(index.group(1))] = node
+
+    def _requires(self, tokens):
+        flags, args = self._flags(tokens, ('-nodeType', '-dataType'))
+        if not args:
+            return
+        name = _unquote(args[0])
+        if name == 'maya':
+            if len(args) > 1:
+                self.scene.maya_version = _unquote(args[1])
+        elif name not in self.scene.plugins:
+            self.scene.plugins.append(name)
+
+    def _file(self, tokens):
+        flags, args = self._flags(tokens, ('-rdi', '-ns', '-rfn', '-dr', '-typ', '-op', '-rpr',
+                                           '-shd', '-gl', '-lck', '-lrd'))
+        if not args:
+            return
+        path = _unquote(args[-1])
+        deferred = flags.get('-dr') == '1'
+        namespace = flags.get('-ns')
+        node = flags.get('-rfn')
+        if '-r' in flags:
+            self.scene.references.append(Reference(path, namespace, node, 1, deferred))
+        elif '-rdi' in flags:
+            depth = int(flags['-rdi'])
+            if depth > 1:
+                self.scene.nested_references.append(Reference(path, namespace, node, depth, deferred))
+
+def parse(path, chunk_size=CHUNK_SIZE):
+    """Returns the MaScene read from the Maya ASCII file at path"""
+    scene = MaScene(path)
+    reader = _Reader(scene)
+    f = open(path, 'rb')
+    try:
+        for tokens in iter_statements(f, reader.wanted, chunk_size):
+            reader.statement(tokens)
+    finally:
+        f.close()
+    return scene
+
+def _as_scene(scene):
+    if isinstance(scene, basestring):
+        return parse(scene)
+    return scene
+
+def get_renderer(scene):
+    """Returns the scene's current renderer as a zync_outputs renderer name, or None"""
+    return RENDERERS.get(_as_scene(scene).get_attr('defaultRenderGlobals.currentRenderer'))
+
+def get_render_layers(scene):
+    """Returns the scene's render layers, as zync_maya.get_render_layers() does"""
+    return [layer for layer in _as_scene(scene).ls('renderLayer') if ':' not in layer]
+
+def get_renderable_cameras(scene):
+    """Returns the transforms of the scene's renderable cameras"""
+    scene = _as_scene(scene)
+    cameras = []
+    for shape in scene.ls('camera'):
+        if scene.get_attr(shape + '.renderable', True):
+            cameras.append(scene.parents.get(shape, shape))
+    return cameras
+
+def get_pass_names(scene, renderer, layer):
+    """Returns the enabled passes of the layer, as zync_maya.get_pass_names() does"""
+    scene = _as_scene(scene)
+    pass_names = []
+    if renderer == zync_outputs.VRAY_RENDERER:
+        for element in scene.ls('VRayRenderElement') + scene.ls('VRayRenderElementSet'):
+            if scene.get_layer_attr(layer, element + '.enabled', True):
+                prefix = element + '.'
+                names = sorted([plug for plug in scene.attrs if plug.startswith(prefix) and
+                                re.match('vray_(file)?name_', plug[len(prefix):])])
+                if names:
+                    pass_names.append(scene.get_layer_attr(layer, names[0]))
+    elif renderer == zync_outputs.MENTAL_RAY_RENDERER:
+        pass_names.append('MasterBeauty')
+        for pass_node in scene.render_passes.get(layer, []):
+            if scene.get_layer_attr(layer, pass_node + '.renderable', True):
+                pass_names.append(pass_node)
+    return pass_names
+
+def get_extension(scene, renderer):
+    """Returns the image extension the scene renders to, cut to 3 letters"""
+    scene = _as_scene(scene)
+    if renderer == zync_outputs.VRAY_RENDERER:
+        extension = scene.get_attr('vraySettings.imageFormatStr') or 'png'
+    else:
+        image_format = scene.get_attr('defaultRenderGlobals.imageFormat', DEFAULT_IMAGE_FORMAT)
+        if image_format == 51:
+            extension = scene.get_attr('defaultRenderGlobals.imfPluginKey') or 'iff'
+        else:
+            extension = IMAGE_FORMATS.get(image_format, 'iff')
+    return extension[:3]
+
+def _reference_file(path, parent, workspace=None):
+    """
+    Returns where the .ma file a reference in the scene at parent points to
+    is, or None if it isn't a .ma file or can't be found. Relative paths are
+    looked for in the project, then next to parent.
+    """
+    path = os.path.expandvars(_COPY_NUMBER_REGEX.sub('', path))
+    if not path.lower().endswith('.ma'):
+        return None
+    if os.path.isabs(path):
+        candidates = [path]
+    else:
+        candidates = [os.path.join(root, path) for root in (workspace, os.path.dirname(parent)) if root]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+def referenced_scenes(scene, workspace=None):
+    """
+    Yields the MaScene of each .ma file the scene loads as a reference,
+    nested references included, parsing each unique file once. Deferred
+    references, binary .mb files and files that can't be found or read are
+    skipped.
+    """
+    scene = _as_scene(scene)
+    seen = set([zync_scan.path_key(zync_scan.normalize_path(scene.path))])
+    pending = [(scene.path, reference) for reference in scene.references]
+    while pending:
+        parent, reference = pending.pop(0)
+        if reference.deferred:
+            continue
+        path = _reference_file(reference.path, parent, workspace)
+        if path is None:
+            continue
+        key = zync_scan.path_key(zync_scan.normalize_path(path))
+        if key in seen:
+            continue
+        seen.add(key)
+        try:
+            child = parse(path)
+        except (IOError, OSError):
+            continue
+        yield child
+        pending.extend([(child.path, nested) for nested in child.references])
+
+def _scene_file_refs(scene, context):
+    nodes_by_type = {}
+    for node in scene.order:
+        nodes_by_type.setdefault(scene.nodes[node], []).append(node)
+    def read(nodes, attribute, default):
+        return [scene.get_attr('%s.%s' % (node, attribute), default) for node in nodes]
+    return zync_deps.registry.scan(nodes_by_type, read, context)
+
+def get_scene_file_refs(scene, workspace=None, references=True):
+    """
+    Returns a (path, node, attribute) tuple for each file the scene's nodes
+    use, as zync_maya.get_scene_file_refs() does, from the node types
+    registered in zync_deps, with image sequences, UDIM tiles and per-frame
+    caches found on disk as zync_sequences.FileSequences. workspace is the
+    project folder paths like final gather maps are relative to.
+
+    With references, the nodes of the .ma files the scene references are
+    read too, from referenced_scenes(). Their reference edits aren't
+    applied, and the files of .mb references aren't listed.
+    """
+    scene = _as_scene(scene)
+    zync_sequences.listings.clear()
+    # referenced nodes find relative paths from the scene, as they do in Maya
+    context = zync_deps.DependencyContext(workspace, os.path.dirname(scene.path))
+    refs = _scene_file_refs(scene, context)
+    if references:
+        for child in referenced_scenes(scene, workspace):
+            refs.extend(_scene_file_refs(child, context))
+    return zync_deps.expand_refs(refs)
+
+def get_scene_files(scene, workspace=None, references=True, refs=None):
+    """
+    Returns every file the scene's nodes use, deduplicated, as the files of
+    get_scene_info(), from refs if given or get_scene_file_refs()
+    """
+    if refs is None:
+        refs = get_scene_file_refs(scene, workspace, references)
+    return [path for path, node, attribute in zync_scan.dedupe(refs)]
+
+def _reference_paths(scene):
+    # Maya tells references to the same file apart with a copy number
+    paths = []
+    counts = {}
+    for reference in scene.references:
+        count = counts.get(reference.path, 0)
+        counts[reference.path] = count + 1
+        paths.append(reference.path if not count else '%s{%d}' % (reference.path, count))
+    return paths
+
+def get_scene_info(scene, renderer=None, render_layers=None, workspace=None, refs=None):
+    """
+    Returns the scene info zync_maya.get_scene_info() gathers, read from the
+    scene, a MaScene or the path of a .ma file. renderer is a zync_outputs
+    renderer name, by default the scene's current renderer. Its files come
+    from refs, if already gathered by get_scene_file_refs().
+    """
+    scene = _as_scene(scene)
+    if renderer is None:
+        renderer = get_renderer(scene) or zync_outputs.SOFTWARE_RENDERER
+    if render_layers is None:
+        render_layers = get_render_layers(scene)
+    layers = [x for x in scene.ls('renderLayer') if x != 'defaultRenderLayer' and ':' not in x]
+
+    if renderer == zync_outputs.VRAY_RENDERER:
+        prefix_plug = 'vraySettings.fileNamePrefix'
+        padding = scene.get_attr('vraySettings.fileNamePadding', 4)
+    else:
+        prefix_plug = 'defaultRenderGlobals.imageFilePrefix'
+        padding = scene.get_attr('defaultRenderGlobals.extensionPadding', 1)
+
+    layer_prefixes = {}
+    layer_passes = {}
+    for layer in layers:
+        layer_prefixes[layer] = scene.get_layer_attr(layer, prefix_plug)
+        if renderer in (zync_outputs.VRAY_RENDERER, zync_outputs.MENTAL_RAY_RENDERER):
+            layer_passes[layer] = get_pass_names(scene, renderer, layer)
+
+    plugins = list(scene.plugins)
+    if scene.ls('cacheFile'):
+        plugins.append('cache')
+
+    return {'files': get_scene_files(scene, workspace, refs=refs),
+            'render_layers': render_layers,
+            'references': _reference_paths(scene),
+            'file_prefix': [scene.get_layer_attr('defaultRenderLayer', prefix_plug), layer_prefixes],
+            'padding': int(padding),
+            'extension': get_extension(scene, renderer),
+            'plugins': plugins,
+            'layer_passes': layer_passes}
+
+def _scan(args):
+    path, renderer = args
+    try:
+        return {'path': path, 'scene_info': get_scene_info(path, renderer)}
+    except Exception, e:
+        return {'path': path, 'error': '%s: %s' % (e.__class__.__name__, e)}
+
+def scan_scenes(paths, renderer=None, workers=DEFAULT_WORKERS):
+    """
+    Yields {'path', 'scene_info'} for each scene, or {'path', 'error'} if it
+    can't be read, parsing in a pool of worker processes. Results come in
+    the order of paths.
+    """
+    jobs = [(path, renderer) for path in paths]
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield _scan(job)
+        return
+    pool = multiprocessing.Pool(min(workers, len(jobs)))
+    try:
+        for result in pool.imap(_scan, jobs):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] SCENE.ma [SCENE.ma...]')
+    parser.add_option('-r', '--renderer', choices=sorted(RENDERERS.values()),
+                      help="the renderer's naming rules, by default the scene's")
+    parser.add_option('-w', '--workers', type='int', default=DEFAULT_WORKERS, help='parsing processes')
+    parser.add_option('--json', action='store_true', help='print the scene info of each scene as JSON')
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error('no scenes given')
+
+    failed = 0
+    for result in scan_scenes(args, options.renderer, options.workers):
+        if 'error' in result:
+            failed += 1
+            if not options.json:
+                print '%s: %s' % (result['path'], result['error'])
+        elif not options.json:
+            info = result['scene_info']
+            unread = [r for r in info['references'] if not _COPY_NUMBER_REGEX.sub('', r).lower().endswith('.ma')]
+            print '%s: %d layers, %d files, %d references%s, plugins %s' % (
+                result['path'], len(info['file_prefix'][1]), len(info['files']), len(info['references']),
+                ' (files of %d not read)' % len(unread) if unread else '',
+                ', '.join(info['plugins']) or 'none')
+        if options.json:
+            print json.dumps(result)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
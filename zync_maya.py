@@ -19,59 +19,137 @@ import re
 import os
 import platform
 import sys
+import threading
 import time
-import shlex
 
 __author__ = 'Alex Schworer'
 __copyright__ = 'Copyright 2011, Atomic Fiction, Inc.'
 
-config_path = "%s/config_maya.py" % ( os.path.dirname(__file__), )
-if not os.path.exists( config_path ):
-    raise Exception( "Could not locate config_maya.py, please create." )
-from config_maya import *
-
 required_config = [ "API_DIR", "API_KEY" ]
 
-for key in required_config:
-    if not key in globals():
-        raise Exception( "config_maya.py must define a value for %s." % ( key, ) )
-
-sys.path.append( API_DIR )
-import zync
+# optional config_maya settings, replaced by load()
+SNAPSHOT_SCENES = False
+DELTA_UPLOADS = False
+QUEUE_SUBMISSIONS = False
 
-UI_FILE = "%s/resources/submit_dialog.ui" % ( os.path.dirname( __file__ ), )
+# resolved by ui_file() when the dialog is first opened
+UI_FILE = None
 
 import maya.cmds as cmds
-
-def even(num):
-    return bool(num % 2)
-
-def odd(num):
-    return not bool(num % 2)
-
-def _substitute(parts, tokens, allOrNothing=False, leaveUnmatchedTokens=False):
-    result = []
-    for i, tok in enumerate(parts):
-        if even(i):
-            try:
-                tokn = tokens[tok]
-                if tokn is None:
-                    result.append('<%s>' % tok)
-                else:
-                    result.append(tokn.replace(':', '_'))
-            except KeyError:
-                if allOrNothing:
-                    if leaveUnmatchedTokens:
-                        return '<%s>' % tok
-                    else:
-                        return ''
-                elif leaveUnmatchedTokens:
-                    result.append('<%s>' % tok)
-                else:
-                    result.append('')
-        else:
-            result.append(tok)
-    return ''.join(result)
+import maya.utils
+try:
+    import maya.api.OpenMaya as om
+except ImportError:
+    om = None
+
+import zync_deps
+import zync_frames
+import zync_index
+import zync_ledger
+import zync_memory
+import zync_outputs
+import zync_pathmap
+import zync_planner
+import zync_preflight
+import zync_queue
+import zync_refgraph
+import zync_scan
+import zync_sequences
+import zync_session
+import zync_snapshots
+import zync_tokens
+import zync_trace
+from zync_tokens import even, odd
+
+class _DeferredZync(object):
+    """Stands in for the zync module until it is first used, then loads it"""
+    def __getattr__(self, name):
+        return getattr(load(), name)
+
+# replaced with the zync module by load()
+zync = _DeferredZync()
+
+_load_lock = threading.Lock()
+
+def load():
+    """
+    Reads config_maya, adds its API_DIR to the path and imports the zync
+    module, returning it. This happens on first use rather than on import,
+    as API_DIR is often on a slow network share and most Maya sessions
+    never submit.
+    """
+    global zync
+    if not isinstance(zync, _DeferredZync):
+        return zync
+    _load_lock.acquire()
+    try:
+        if not isinstance(zync, _DeferredZync):
+            return zync
+        try:
+            import config_maya
+        except ImportError:
+            raise Exception( "Could not locate config_maya.py, please create." )
+        for key in required_config:
+            if not hasattr(config_maya, key):
+                raise Exception( "config_maya.py must define a value for %s." % ( key, ) )
+        for key, value in vars(config_maya).items():
+            if not key.startswith('_'):
+                globals()[key] = value
+
+        if API_DIR not in sys.path:
+            sys.path.append( API_DIR )
+        import zync as zync_module
+        sessions.reauth_errors = (zync_module.ZyncAuthenticationError,)
+        zync = zync_module
+        return zync
+    finally:
+        _load_lock.release()
+
+def prewarm():
+    """
+    Loads the config and the zync module on a background thread, so the
+    first submit doesn't wait for them. Returns the thread.
+    """
+    def run():
+        try:
+            load()
+        except Exception, e:
+            print 'ZYNC pre-warm failed: %s' % e
+    thread = threading.Thread(target=run, name='ZyncPrewarm')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def ui_file():
+    """Returns the path of the submit dialog's Qt Designer file"""
+    global UI_FILE
+    if UI_FILE is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'submit_dialog.ui')
+        if not os.path.exists(path):
+            raise Exception( "Could not locate the submit dialog at %s." % ( path, ) )
+        UI_FILE = path
+    return UI_FILE
+
+def _create_client(username, password):
+    load()
+    return zync.Zync( "maya_plugin", API_KEY, username=username, password=password )
+
+# authenticated clients and server lookups, reused by every submission from
+# this Maya; reauth_errors is filled in once load() has imported zync
+sessions = zync_session.SessionManager(_create_client)
+
+def _response_ok(response):
+    return response["code"] == 0
+
+def get_project_name(scene_path):
+    """Returns zync.get_project_name for the scene, cached for a few minutes"""
+    return sessions.lookup(('project_name', scene_path), zync.get_project_name, scene_path,
+                           valid=_response_ok)
+
+def get_maya_output_path(scene_path):
+    """Returns zync.get_maya_output_path for the scene, cached for a few minutes"""
+    return sessions.lookup(('maya_output_path', scene_path), zync.get_maya_output_path, scene_path,
+                           valid=_response_ok)
 
 def expandFileTokens(path, tokens, leaveUnmatchedTokens=False):
     """
@@ -96,20 +174,10 @@ def expandFileTokens(path, tokens, leaveUnmatchedTokens=False):
 
         >>> expandFileTokens('filename[_<RenderPass>].jpg', {})
         'filename.jpg'
-    """
-    if isinstance(tokens, basestring):
-        tokens = dict([pair.split('=') for pair in shlex.split(tokens)])
 
-    grp_reg = re.compile('\[([^\]]+)\]')
-    tok_reg = re.compile('<([a-zA-Z]+)>')
-    result = []
-    for i, grp in enumerate(grp_reg.split(path)):
-        parts = tok_reg.split(grp)
-        if even(i):
-            result.append(_substitute(parts, tokens, allOrNothing=True, leaveUnmatchedTokens=leaveUnmatchedTokens))
-        else:
-            result.append(_substitute(parts, tokens, allOrNothing=False, leaveUnmatchedTokens=leaveUnmatchedTokens))
-    return ''.join(result)
+    Templates are compiled once and cached, see zync_tokens.compile_template.
+    """
+    return zync_tokens.expand_file_tokens(path, tokens, leaveUnmatchedTokens)
 
 def generate_scene_path(extra_name=None):
     """
@@ -145,6 +213,38 @@ def generate_scene_path(extra_name=None):
 
     return '%s/%s' % ( cloud_dir, new_filename )
 
+def save_scene_snapshot():
+    """
+    Saves the scene as Maya ASCII to the zync_snapshots store in its
+    cloud_submit folder and returns the snapshot's path. A snapshot identical
+    to one stored already is reused rather than written again, and an
+    unmodified .ma scene is snapshotted from its file without saving it.
+    """
+    scene_path = cmds.file(q=True, loc=True)
+    store = zync_snapshots.SnapshotStore.for_scene(scene_path)
+    shot = zync_snapshots.shot_name(scene_path)
+    original_modified = cmds.file(q=True, modified=True)
+    if scene_path.endswith('.ma') and not original_modified and os.path.isfile(scene_path):
+        snapshot = store.add(scene_path, shot)
+    else:
+        temp_path = store.temp_path(shot)
+        cmds.file( rename=temp_path )
+        try:
+            cmds.file( save=True, type='mayaAscii' )
+        finally:
+            cmds.file( rename=scene_path )
+            cmds.file( modified=original_modified )
+        snapshot = store.add(temp_path, shot, source=scene_path, move=True)
+    if snapshot.reused:
+        print 'Reusing scene snapshot %s' % snapshot.path
+    else:
+        print 'Saved scene snapshot %s' % snapshot.path
+    try:
+        store.gc(shot)
+    except (IOError, OSError), e:
+        print 'Could not clean up old scene snapshots: %s' % e
+    return snapshot.path
+
 def label_ui(label, ui, *args, **kwargs):
     """
     Helper function that creates an UI element with a text label next to it.
@@ -184,77 +284,284 @@ def frame_range():
     end = str(int(cmds.getAttr('defaultRenderGlobals.endFrame')))
     return '%s-%s' % (start, end)
 
-def _file_handler(node):
-    """Returns the file referenced by the given node"""
-    yield (cmds.getAttr('%s.fileTextureName' % node),)
-
-def _cache_file_handler(node):
-    """Returns the files references by the given cacheFile node"""
-    path = cmds.getAttr('%s.cachePath' % node)
-    cache_name = cmds.getAttr('%s.cacheName' % node)
+def validate_frange(frange, step=1):
+    """
+    Returns the frame spec in canonical form, like 1001-1100x2,1150, raising
+    a MayaZyncException if it isn't valid. Ranges stepping by step are written
+    without their step, which is sent separately.
+    """
+    try:
+        return zync_frames.FrameSet.parse(frange, step).to_string(int(step))
+    except zync_frames.FrameSetError, e:
+        raise MayaZyncException('Invalid frame range: %s' % e)
 
-    yield (os.path.join(path, '%s.mc' % cache_name),
-           os.path.join(path, '%s.xml' % cache_name),)
+def _get_attr_default(node, attribute, default=None):
+    """Returns the attribute value, or default if the node doesn't have the attribute"""
+    try:
+        return cmds.getAttr('%s.%s' % (node, attribute))
+    except (ValueError, RuntimeError):
+        return default
+
+# how the plugs of each getAttr -type are read through the API
+_PLUG_READERS = {'string': 'asString',
+                 'bool': 'asBool',
+                 'enum': 'asInt',
+                 'byte': 'asInt',
+                 'short': 'asInt',
+                 'long': 'asInt',
+                 'float': 'asDouble',
+                 'double': 'asDouble'}
+
+def _read_attribute(nodes, attribute, default=None):
+    """
+    Returns the attribute's value for each of the nodes, all of one type, or
+    default for all of them if the type doesn't have the attribute. The
+    nodes' plugs are put in one selection list and read in a single pass
+    through the API, rather than with a getAttr per node; attributes of
+    other types are read with getAttr.
+    """
+    first = '%s.%s' % (nodes[0], attribute)
+    if not cmds.attributeQuery(attribute, node=nodes[0], exists=True):
+        return [default] * len(nodes)
+    reader = om is not None and _PLUG_READERS.get(cmds.getAttr(first, type=True))
+    if not reader:
+        return [_get_attr_default(node, attribute, default) for node in nodes]
+    selection = om.MSelectionList()
+    plugs = []
+    for node in nodes:
+        try:
+            selection.add('%s.%s' % (node, attribute))
+        except RuntimeError:
+            # a node without the attribute, which the selection list skips
+            plugs.append(None)
+        else:
+            plugs.append(selection.length() - 1)
+    values = []
+    for index in plugs:
+        if index is None:
+            values.append(default)
+            continue
+        try:
+            values.append(getattr(selection.getPlug(index), reader)())
+        except RuntimeError:
+            values.append(default)
+    return values
 
-def _diskCache_handler(node):
-    """Returns disk caches"""
-    yield (cmds.getAttr('%s.cacheName' % node),)
+def _typed_nodes(**kwargs):
+    """
+    Returns a dict of each node type registered in zync_deps to its nodes,
+    listed with one ls, which is given kwargs. Nodes of a type derived from
+    a registered type are listed under the registered type.
+    """
+    registry = zync_deps.registry
+    node_types = registry.node_types()
+    listed = cmds.ls(type=node_types, showType=True, **kwargs) or []
+    nodes_by_type = {}
+    for i in range(0, len(listed) - 1, 2):
+        node, node_type = listed[i], listed[i + 1]
+        if registry.get(node_type) is None:
+            inherited = [t for t in cmds.nodeType(node, inherited=True) or [] if registry.get(t)]
+            if not inherited:
+                continue
+            node_type = inherited[-1]
+        nodes_by_type.setdefault(node_type, []).append(node)
+    return nodes_by_type
+
+def _dependency_context():
+    return zync_deps.DependencyContext(cmds.workspace(q=True, rd=True),
+                                       os.path.dirname(cmds.file(q=True, loc=True)))
+
+def _file_refs(nodes_by_type, context=None, expand=True):
+    """
+    Returns the (path, node, attribute) references of the nodes, given as a
+    dict of node type to nodes, read a node type at a time. With expand
+    False, paths are left as the patterns zync_deps.expand_refs() expands.
+    """
+    if context is None:
+        context = _dependency_context()
+    refs = zync_deps.registry.scan(nodes_by_type, _read_attribute, context)
+    if expand:
+        refs = zync_deps.expand_refs(refs)
+    return refs
+
+@zync_trace.traced('get_scene_file_refs')
+def get_scene_file_refs():
+    """
+    Yields a (path, node, attribute) tuple for each file reference in the scene,
+    from the node types registered in zync_deps. The time each node type took
+    is in zync_deps.registry.timings.
 
-def _vrmesh_handler(node):
-    """Handles vray meshes"""
-    yield (cmds.getAttr('%s.fileName' % node),)
+    Image sequences, UDIM tiles and per-frame caches are yielded as a single
+    zync_sequences.FileSequence in place of the path.
+    """
+    # list each folder once per scan, for sequence discovery
+    zync_sequences.listings.clear()
+    zync_deps.registry.reset_timings()
 
-def _mrtex_handler(node):
-    """Handles mentalrayTexutre nodes"""
-    yield (cmds.getAttr('%s.fileTextureName' % node),)
+    for ref in _file_refs(_typed_nodes()):
+        yield ref
 
-def _gpu_handler(node):
-    """Handles gpuCache nodes"""
-    yield (cmds.getAttr('%s.cacheFileName' % node),)
+@zync_trace.traced('get_scene_files')
+def get_scene_files():
+    """Returns all of the files being used by the scene"""
+    for scene_file, node, attribute in get_scene_file_refs():
+        if isinstance(scene_file, zync_sequences.FileSequence):
+            for path in scene_file:
+                yield path
+        else:
+            yield scene_file
 
-def _mrOptions_handler(node):
-    """Handles mentalrayOptions nodes, for Final Gather"""
-    work_space = cmds.workspace(q=True, rd=True)
-    map_name = cmds.getAttr('%s.finalGatherFilename' % node).strip()
-    if map_name:        
-        path = os.path.join(workspace, "renderData/mentalray/finalgMap", map_name)
-        if not path.endswith( ".fgmap" ):
-            "{0}.fgmap".format(path)
-        yield (path,)
+def scan_scene_files(workers=zync_scan.DEFAULT_WORKERS, stream=False):
+    """
+    Returns a zync_scan.FileRecord, with size, mtime and existence, for each
+    unique file used by the scene. The references are gathered here on the
+    main thread and stat'ed concurrently. With stream=True, returns a generator
+    that yields records while the scan is still running.
+    """
+    if stream:
+        return zync_scan.iter_scan(get_scene_file_refs(), workers)
+    return zync_scan.scan(get_scene_file_refs(), workers)
 
-def _mrIbl_handler(node):
-    """Handles mentalrayIblShape nodes"""
-    yield (cmds.getAttr('%s.texture' % node),)
+def fingerprint_scene_files(index=None, workers=zync_scan.DEFAULT_WORKERS):
+    """
+    Returns a dict mapping each existing scene file to its content hash. Hashes
+    are kept in a zync_index.FileIndex, so only files that changed since they
+    were last seen are hashed again.
+    """
+    if index is None:
+        index = zync_index.FileIndex()
+        try:
+            return index.fingerprint_records(scan_scene_files(workers), workers)
+        finally:
+            index.close()
+    return index.fingerprint_records(scan_scene_files(workers), workers)
 
-def _abc_handler(node):
-    """Handles AlembicNode nodes"""
-    yield (cmds.getAttr('%s.abc_File' % node),)
+def plan_uploads(project, files=None, path_mappings=(), ledger=None):
+    """
+    Returns the zync_ledger.UploadPlan of the files, by default the scene's:
+    those new or changed since they were last uploaded for the project, and
+    those that can be reused. Remote locations are the files' mapped paths.
+    """
+    if files is None:
+        files = get_scene_file_refs()
+    remote_for = None
+    if path_mappings:
+        remote_for = zync_pathmap.PathMapper(path_mappings).map
+    if ledger is None:
+        ledger = zync_ledger.UploadLedger()
+        try:
+            return ledger.plan_files(project, files, remote_for)
+        finally:
+            ledger.close()
+    return ledger.plan_files(project, files, remote_for)
 
-def _vrSettings_handler(node):
-    """Handles VRaySettingsNode nodes, for irradiance map"""
-    yield(cmds.getAttr('%s.ifile' % node),)
+def check_path_mappings(path_mappings, refs=None):
+    """
+    Maps the scene's files with path_mappings, a list of (from, to) tuples,
+    the way ZYNC will, returning a zync_pathmap.PathMapReport with the paths
+    no mapping matched. refs defaults to get_scene_file_refs().
+    """
+    if refs is None:
+        refs = get_scene_file_refs()
+    return zync_pathmap.PathMapper(path_mappings).map_refs(refs)
+
+# the dependencies of reference files, kept across scans and Maya sessions
+reference_cache = zync_refgraph.DependencyCache()
+
+def _has_file_edits(reference):
+    """Returns whether the reference's edits set any attribute zync_deps reads files from"""
+    attributes = zync_deps.registry.attributes()
+    ref_node = cmds.referenceQuery(reference, referenceNode=True)
+    for edit in cmds.referenceQuery(ref_node, editStrings=True) or []:
+        words = edit.split()
+        if len(words) > 1 and words[0] == 'setAttr':
+            if words[1].strip('"').rsplit('.', 1)[-1] in attributes:
+                return True
+    return False
+
+def _reference_file_refs(reference, typed_nodes, context, expand=True):
+    """
+    Returns the (path, node, attribute) references of the reference's own
+    nodes, leaving out those of its nested references. typed_nodes maps each
+    referenced node of a type registered in zync_deps to its type.
+    """
+    nodes = set(cmds.referenceQuery(reference, nodes=True) or [])
+    for child in cmds.file(reference, q=True, r=True) or []:
+        if cmds.referenceQuery(child, isLoaded=True):
+            nodes.difference_update(cmds.referenceQuery(child, nodes=True) or [])
+    nodes_by_type = {}
+    for node in sorted(nodes):
+        if node in typed_nodes:
+            nodes_by_type.setdefault(typed_nodes[node], []).append(node)
+    return _file_refs(nodes_by_type, context, expand)
+
+@zync_trace.traced('get_reference_graph')
+def get_reference_graph(cache=None):
+    """
+    Returns the zync_refgraph.ReferenceGraph of the scene: its references,
+    nested ones included, each unique file walked once, with the files each
+    depends on. Reference files are scanned through one of their instances,
+    unless cache, by default reference_cache, holds them for the file as it
+    is on disk and the project and scene folder. The cache keeps the paths
+    as patterns, which are expanded from disk on every call, so frames and
+    tiles added since are found. Instances whose reference edits change their
+    files are scanned on their own.
+    """
+    if cache is None:
+        cache = reference_cache
+    graph = zync_refgraph.ReferenceGraph(cmds.file(q=True, loc=True))
+    zync_sequences.listings.clear()
+
+    # every loaded instance is walked, for its nested instances and their
+    # edits, but each file is only scanned through its first loaded instance
+    walked = {}
+    pending = [(reference, None) for reference in cmds.file(q=True, r=True) or []]
+    while pending:
+        instance, parent = pending.pop(0)
+        path = cmds.referenceQuery(instance, filename=True, withoutCopyNumber=True)
+        loaded = cmds.referenceQuery(instance, isLoaded=True)
+        reference = graph.add(path, instance, parent, loaded)
+        if loaded:
+            walked.setdefault(reference.path, instance)
+            pending.extend([(child, reference.path) for child in cmds.file(instance, q=True, r=True) or []])
+
+    zync_deps.registry.reset_timings()
+    context = _dependency_context()
+    typed_nodes = {}
+    for node_type, nodes in _typed_nodes(referencedNodes=True).items():
+        typed_nodes.update(dict.fromkeys(nodes, node_type))
+    scene_nodes = {}
+    for node_type, nodes in _typed_nodes().items():
+        scene_nodes[node_type] = [node for node in nodes if node not in typed_nodes]
+    graph.scene_files.extend(_file_refs(scene_nodes, context))
+
+    for reference in graph:
+        if reference.path not in walked:
+            continue
+        edited = set([i for i in reference.instances
+                      if i not in reference.unloaded and _has_file_edits(i)])
+        chain = [zync_refgraph.file_key(path) for path in graph.chain(reference.path)]
+        if None in chain:
+            chain = None
+        files = cache.get(chain, context) if chain else None
+        if files is not None:
+            reference.cached = True
+        else:
+            clean = [i for i in reference.instances if i not in reference.unloaded and i not in edited]
+            files = []
+            if clean:
+                files = _reference_file_refs(clean[0], typed_nodes, context, expand=False)
+                if chain:
+                    cache.set(chain, files, context)
+        reference.files = zync_deps.expand_refs(files)
+        for instance in edited:
+            reference.instance_files[instance] = _reference_file_refs(instance, typed_nodes, context)
 
-def get_scene_files():
-    """Returns all of the files being used by the scene"""
-    file_types = {'file': _file_handler,
-                  'cacheFile': _cache_file_handler,
-                  'diskCache': _diskCache_handler,
-                  'VRayMesh': _vrmesh_handler,
-                  'mentalrayTexture': _mrtex_handler,
-                  'gpuCache': _gpu_handler,
-                  'mentalrayOptions': _mrOptions_handler,
-                  'mentalrayIblShape': _mrIbl_handler,
-                  'AlembicNode': _abc_handler,
-                  'VRaySettingsNode': _vrSettings_handler }
-
-    for file_type in file_types:
-        handler = file_types.get(file_type)
-        nodes = cmds.ls(type=file_type)
-        for node in nodes:
-            for files in handler(node):
-                for scene_file in files:
-                    if scene_file != None:
-                        yield scene_file.replace('\\', '/')
+    try:
+        cache.save()
+    except (IOError, OSError), e:
+        print 'Could not save the reference dependency cache: %s' % e
+    return graph
 
 def get_default_extension(renderer):
     """Returns the filename prefix for the given renderer, either mental ray
@@ -274,8 +581,109 @@ def get_default_extension(renderer):
     else:
         return val.split()[-1][1:-1]
 
-def get_layer_override(layer, node, attribute='imageFilePrefix'):
-    """Helper method to return the layer override value for the given node and attribute"""
+class LayerOverrideError(Exception):
+    """
+    Raised when a layer override can't be resolved from the render layer
+    adjustments, and the layer needs to be switched to read it.
+    """
+    pass
+
+def _render_setup_active():
+    """Returns True if the scene uses Render Setup instead of legacy render layers"""
+    try:
+        return bool(cmds.mayaHasRenderSetup())
+    except (AttributeError, RuntimeError):
+        return False
+
+class LayerOverrideResolver(object):
+    """
+    Resolves attribute values for any render layer without switching the
+    current render layer.
+
+    Legacy render layers store each override as an entry in the layer's
+    adjustments array: adjustments[i].plug is connected from the overridden
+    attribute, and adjustments[i].value holds the value used while the layer
+    is not current. The attribute itself always holds the value of the current
+    layer, and the master value of an attribute overridden by the current
+    layer is kept in the adjustments of defaultRenderLayer.
+    """
+    def __init__(self):
+        self.current_layer = cmds.editRenderLayerGlobals(q=True, currentRenderLayer=True)
+        self._adjustments = {}
+        self._render_elements = None
+        self._element_name_attrs = {}
+
+    @classmethod
+    def create(cls):
+        """
+        Returns a resolver for the current scene, or None if overrides can only
+        be read by switching layers.
+        """
+        if _render_setup_active():
+            return None
+        return cls()
+
+    def adjustments(self, layer):
+        """Returns a dict mapping each plug overridden by the layer to the plug holding its value"""
+        try:
+            return self._adjustments[layer]
+        except KeyError:
+            pass
+        adjustments = {}
+        connections = cmds.listConnections('%s.adjustments' % layer, source=True, destination=False,
+                                           connections=True, plugs=True) or []
+        for i in range(0, len(connections), 2):
+            layer_plug, plug = connections[i], connections[i+1]
+            if layer_plug.endswith('.plug'):
+                adjustments[plug] = layer_plug[:-len('plug')] + 'value'
+        self._adjustments[layer] = adjustments
+        return adjustments
+
+    def get_base_attr(self, plug):
+        """Returns the master layer value of the given plug"""
+        if self.current_layer == 'defaultRenderLayer' or plug not in self.adjustments(self.current_layer):
+            return cmds.getAttr(plug)
+        value_plug = self.adjustments('defaultRenderLayer').get(plug)
+        if value_plug is None:
+            raise LayerOverrideError('No master value stored for %s' % plug)
+        return cmds.getAttr(value_plug)
+
+    def get_attr(self, layer, node, attribute):
+        """Returns the value of node.attribute as seen by the given layer"""
+        plug = '.'.join([node, attribute])
+        if layer == self.current_layer:
+            return cmds.getAttr(plug)
+        value_plug = self.adjustments(layer).get(plug)
+        if value_plug is not None:
+            return cmds.getAttr(value_plug)
+        return self.get_base_attr(plug)
+
+    def get_pass_names(self, renderer, layer):
+        """Returns the enabled passes for the given layer"""
+        pass_names = []
+        if renderer == zync.VRAY_RENDERER:
+            if self._render_elements is None:
+                self._render_elements = cmds.ls(type="VRayRenderElement")
+            for element in self._render_elements:
+                if self.get_attr(layer, element, 'enabled'):
+                    if element not in self._element_name_attrs:
+                        element_attrs = cmds.listAttr(element)
+                        self._element_name_attrs[element] = [ x for x in element_attrs if re.match('vray_name_.*', x) or re.match('vray_filename_.*', x) ]
+                    pass_names.append(self.get_attr(layer, element, self._element_name_attrs[element][0]))
+
+        if renderer == zync.MENTAL_RAY_RENDERER:
+            pass_names.append('MasterBeauty')
+            render_pass_nodes = cmds.listConnections(layer + '.renderPass')
+            if render_pass_nodes:
+                for pass_ in render_pass_nodes:
+                    print "  pass %s for %s" % (pass_, layer)
+                    if self.get_attr(layer, pass_, 'renderable'):
+                        pass_names.append(pass_)
+
+        return pass_names
+
+def _get_layer_override_switching(layer, node, attribute='imageFilePrefix'):
+    """Returns the layer override value by making the layer current and reading the attribute"""
     cur_layer = cmds.editRenderLayerGlobals(q=True, currentRenderLayer=True)
 
     cmds.editRenderLayerGlobals(currentRenderLayer=layer)
@@ -284,71 +692,300 @@ def get_layer_override(layer, node, attribute='imageFilePrefix'):
     cmds.editRenderLayerGlobals(currentRenderLayer=cur_layer)
     return layer_override
 
-def get_pass_names(renderer, layer):
-    """Helper method to return the passes for a given layer"""
+def _get_pass_names_switching(renderer, layer):
+    """Returns the passes for a layer by making the layer current and reading them"""
     cur_layer = cmds.editRenderLayerGlobals(q=True, currentRenderLayer=True)
     cmds.editRenderLayerGlobals(currentRenderLayer=layer)
+    try:
+        # once the layer is current, every attribute holds its value for it
+        pass_names = LayerOverrideResolver().get_pass_names(renderer, layer)
+    finally:
+        cmds.editRenderLayerGlobals(currentRenderLayer=cur_layer)
+
+    return pass_names
+
+@zync_trace.traced('get_layer_override')
+def get_layer_override(layer, node, attribute='imageFilePrefix', resolver=None):
+    """
+    Helper method to return the layer override value for the given node and attribute.
 
-    pass_names = []
+    The value is read from the render layer adjustments without switching
+    layers, falling back to switching if it can't be resolved that way. Pass a
+    LayerOverrideResolver to share its lookups between calls.
+    """
+    if resolver is None:
+        resolver = LayerOverrideResolver.create()
+    if resolver is not None:
+        try:
+            return resolver.get_attr(layer, node, attribute)
+        except (LayerOverrideError, RuntimeError):
+            pass
+    return _get_layer_override_switching(layer, node, attribute)
+
+@zync_trace.traced('get_pass_names')
+def get_pass_names(renderer, layer, resolver=None):
+    """Helper method to return the passes for a given layer"""
+    if resolver is None:
+        resolver = LayerOverrideResolver.create()
+    if resolver is not None:
+        try:
+            return resolver.get_pass_names(renderer, layer)
+        except (LayerOverrideError, RuntimeError):
+            pass
+    return _get_pass_names_switching(renderer, layer)
+
+def get_layer_passes(renderer, layers):
+    """Returns a dict of each of the layers to its passes for the renderer"""
+    resolver = LayerOverrideResolver.create()
+    return dict([(layer, get_pass_names(renderer, layer, resolver)) for layer in layers])
+
+def check_layer_override_parity(renderer, layers=None):
+    """
+    Compares the prefixes and passes resolved without switching layers against
+    the values read by switching to each layer. Returns a list of mismatches as
+    (layer, name, resolved_value, switched_value) tuples; an empty list means
+    the two agree.
+    """
     if renderer == zync.VRAY_RENDERER:
-        render_element_nodes = cmds.ls(type="VRayRenderElement")
-        for element in render_element_nodes:
-            if cmds.getAttr(element + '.enabled'):
-                element_attrs = cmds.listAttr(element)
-                vray_name_attr = [ x for x in element_attrs if re.match('vray_name_.*', x) or re.match('vray_filename_.*', x) ]
-                pass_names.append(cmds.getAttr(element + '.' +vray_name_attr[0]))
-
-    if renderer == zync.MENTAL_RAY_RENDERER:
-        pass_names.append('MasterBeauty')
-        render_pass_nodes = cmds.listConnections(layer + '.renderPass')
-        if render_pass_nodes:
-            for pass_ in render_pass_nodes:
-                print "  pass %s for %s" % (pass_, layer)
-                if cmds.getAttr(pass_ + '.renderable'):
-                    pass_names.append(pass_)
+        node, attribute = 'vraySettings', 'fileNamePrefix'
+    else:
+        node, attribute = 'defaultRenderGlobals', 'imageFilePrefix'
+    if layers is None:
+        layers = [x for x in cmds.ls(type='renderLayer') if not ':' in x]
 
-    cmds.editRenderLayerGlobals(currentRenderLayer=cur_layer)
+    resolver = LayerOverrideResolver()
+    mismatches = []
+    for layer in layers:
+        try:
+            resolved = resolver.get_attr(layer, node, attribute)
+        except (LayerOverrideError, RuntimeError), e:
+            resolved = e
+        switched = _get_layer_override_switching(layer, node, attribute)
+        if resolved != switched:
+            mismatches.append((layer, attribute, resolved, switched))
+
+        if renderer in (zync.VRAY_RENDERER, zync.MENTAL_RAY_RENDERER):
+            try:
+                resolved = resolver.get_pass_names(renderer, layer)
+            except (LayerOverrideError, RuntimeError), e:
+                resolved = e
+            switched = _get_pass_names_switching(renderer, layer)
+            if resolved != switched:
+                mismatches.append((layer, 'passes', resolved, switched))
+    return mismatches
+
+def get_render_layers():
+    """Returns the render layers of the scene, excluding referenced layers"""
+    layers = []
+    try:
+        all_layers = cmds.ls(type='renderLayer',showNamespace=True)
+        for i in range( 0, len(all_layers), 2 ):
+            if all_layers[i+1] == ':':
+                layers.append( all_layers[i] )
+    except Exception:
+        layers = cmds.ls(type='renderLayer')
+    return layers
+
+def get_renderable_cameras():
+    """Returns the transforms of the renderable cameras in the scene"""
+    cam_parents = [cmds.listRelatives(x, ap=True)[-1] for x in cmds.ls(cameras=True)]
+    return [cam for cam in cam_parents if cmds.getAttr( cam + '.renderable') == True]
+
+def get_renderable_layers(layers=None):
+    """Returns the given render layers, or all of them, that are set to render"""
+    if layers is None:
+        layers = get_render_layers()
+    return [x for x in layers if cmds.getAttr(x + '.renderable')]
+
+def plan_submission(frange, frame_step, layers, x_res, y_res, renderer=None, **kwargs):
+    """
+    Returns a zync_planner.Plan with the proposed chunk size, instance count
+    and instance type for the job, or None if the job can't be planned.
+    Extra keyword arguments are passed on to zync_planner.plan_job.
+    """
+    try:
+        return zync_planner.plan_job(frange, layers, x_res, y_res, zync.INSTANCE_TYPES,
+                                     step=frame_step, renderer=renderer, **kwargs)
+    except (ValueError, KeyError, TypeError), e:
+        print 'Could not plan job: %s' % e
+        return None
+
+@zync_trace.traced('estimate_memory')
+def estimate_memory(layers, x_res, y_res, renderer, refs=None, layer_passes=None):
+    """
+    Returns a zync_memory.MemoryEstimate of the peak memory rendering the
+    layers with renderer needs, from the headers of the scene's images, the
+    size of its caches and the most passes of any of the layers, or None if
+    it can't be estimated. layer_passes are the layers' passes from
+    get_layer_passes(), if already gathered.
+    """
+    try:
+        if layer_passes is None:
+            layer_passes = get_layer_passes(renderer, layers)
+        passes = [len(layer_passes.get(layer) or []) for layer in layers]
+        if refs is None:
+            refs = get_scene_file_refs()
+        return zync_memory.estimate(refs, x_res, y_res, max(passes or [0]), renderer)
+    except (IOError, OSError, RuntimeError, ValueError), e:
+        print 'Could not estimate memory: %s' % e
+        return None
+
+@zync_trace.traced('get_scene_info')
+def get_scene_info(renderer, render_layers=None, refs=None):
+    """
+    Returns scene info for the current scene.
+    We use this to allow ZYNC to skip the file checks.
 
-    return pass_names
+    render_layers defaults to all of the render layers in the scene, as
+    returned by get_render_layers(). The files come from refs, if the
+    scene's get_scene_file_refs() were already gathered.
+    """
+    if render_layers is None:
+        render_layers = get_render_layers()
+    layers = [x for x in cmds.ls(type='renderLayer')\
+              if x != 'defaultRenderLayer' and not ':' in x]
+    references = cmds.file(q=True, r=True)
+
+    # resolve overrides for all layers at once, without switching layers
+    resolver = LayerOverrideResolver.create()
+
+    layer_prefixes = dict()
+    layer_passes = dict()
+    for layer in layers:
+        if renderer == zync.VRAY_RENDERER:
+            node = 'vraySettings'
+            attribute = 'fileNamePrefix'
+            format_attr = 'imageFormatStr'
+        elif renderer in (zync.SOFTWARE_RENDERER, zync.MENTAL_RAY_RENDERER):
+            node = 'defaultRenderGlobals'
+            attribute = 'imageFilePrefix'
+        try:
+            layer_prefix = get_layer_override(layer, node, attribute, resolver)
+            layer_prefixes[layer] = layer_prefix
+        except Exception:
+            pass
 
-def create_local_paths(params):
-    """Creates a local file hierarchy to assist download of rendered frames with
-    a non standard file prefix."""
-
-    base_out_path = params['out_path']
-
-    # set render path for defaultRenderLayer *can't be deleted*
-    layer_paths = {}
-    default = os.path.dirname(os.path.join(base_out_path, params['scene_info']['file_prefix'][0]))
-    layer_paths['defaultRenderLayer'] = expandFileTokens(default, {'Layer':'masterLayer', 'RenderLayer':'masterLayer'}, leaveUnmatchedTokens=True)
-
-    # set render path for remaining layers
-    for path in params['scene_info']['file_prefix'][1:]:
-        for k,v in path.iteritems():
-            raw_layer_dir = os.path.dirname(os.path.join(base_out_path, v))
-            layer_paths[k] = expandFileTokens(raw_layer_dir, {'Layer': k, 'RenderLayer': k}, leaveUnmatchedTokens=True)
-
-    # next for each active layer create the directory path for the layer. This is appended to the end of the path
-    # in vray. MRay allows us to put RenderPass where ever we like.
-    for layer in params['selected_layers']:
-        # for each active pass attached to the layer, create the dir path
-        for pass_name in params['scene_info']['layer_passes'].get(layer, []):
-            if params['renderer'] == zync.VRAY_RENDERER:
-                pass_path = os.path.join(layer_paths[layer], pass_name)
-
-            elif params['renderer'] in (zync.MENTAL_RAY_RENDERER, zync.SOFTWARE_RENDERER):
-                pass_path = expandFileTokens(layer_paths[layer], {'RenderPass': pass_name})
-            else:
-                pass_path = layer_paths[layer]
+        if renderer in (zync.VRAY_RENDERER, zync.MENTAL_RAY_RENDERER):
+            passes = get_pass_names(renderer, layer, resolver)
+            layer_passes[layer] = passes
 
-            print "  " + pass_path
-            if not os.path.exists(pass_path):
-                os.makedirs(pass_path)
+    if renderer == zync.VRAY_RENDERER:
+        extension = cmds.getAttr('vraySettings.imageFormatStr')
+        if extension == None:
+            extension = 'png'
+        padding = int(cmds.getAttr('vraySettings.fileNamePadding'))
+        global_prefix = get_layer_override('defaultRenderLayer', 'vraySettings', 'fileNamePrefix', resolver)
+    elif renderer in (zync.SOFTWARE_RENDERER, zync.MENTAL_RAY_RENDERER):
+        extension = get_default_extension(renderer)
+        padding = int(cmds.getAttr('defaultRenderGlobals.extensionPadding'))
+        global_prefix = get_layer_override('defaultRenderLayer', 'defaultRenderGlobals', 'imageFilePrefix', resolver)
+
+    extension = extension[:3]
+
+    file_prefix = [global_prefix]
+    file_prefix.append(layer_prefixes)
+    if refs is None:
+        refs = get_scene_file_refs()
+    files = [path for path, node, attribute in zync_scan.dedupe(refs)]
+
+    plugins = []
+    plugin_list = cmds.pluginInfo( query=True, pluginsInUse=True )
+    for i in range( 0, len(plugin_list), 2):
+        plugins.append( str(plugin_list[i]) )
+
+    if len(cmds.ls(type='cacheFile')) > 0:
+        plugins.append( "cache" )
+
+    scene_info = {'files': files,
+                  'render_layers': render_layers,
+                  'references': references,
+                  'file_prefix': file_prefix,
+                  'padding': padding,
+                  'extension': extension,
+                  'plugins': plugins,
+                  'layer_passes': layer_passes}
+    return scene_info
+
+def _output_renderer(renderer):
+    """Returns the zync_outputs naming rules for a zync renderer name"""
+    return {zync.VRAY_RENDERER: zync_outputs.VRAY_RENDERER,
+            zync.MENTAL_RAY_RENDERER: zync_outputs.MENTAL_RAY_RENDERER,
+            zync.SOFTWARE_RENDERER: zync_outputs.SOFTWARE_RENDERER}.get(renderer, renderer)
+
+def preflight_context(params, path_mappings=(), render_layers=None, refs=None):
+    """
+    Returns a zync_preflight.PreflightContext for the current scene, to be
+    submitted with params, in the form returned by
+    SubmitWindow.get_render_params(). refs are the scene's
+    get_scene_file_refs(), gathered here unless given.
+    """
+    load()
+    scene_path = cmds.file(q=True, loc=True)
+    renderer = params.get('renderer') or zync.MAYA_DEFAULT_RENDERER
+    if refs is None:
+        refs = get_scene_file_refs()
+    refs = list(refs)
+    if params.get('upload_only'):
+        scene_info = {}
+    else:
+        scene_info = get_scene_info(renderer, render_layers, refs)
+    start = int(cmds.getAttr('defaultRenderGlobals.startFrame'))
+    end = int(cmds.getAttr('defaultRenderGlobals.endFrame'))
+    return zync_preflight.PreflightContext(
+        scene_path, refs, cmds.file(q=True, r=True) or [], scene_info, params,
+        _output_renderer(renderer), get_renderable_cameras(), (start, end), path_mappings,
+        modified=cmds.file(q=True, modified=True), snapshot=SNAPSHOT_SCENES)
+
+@zync_trace.traced('preflight')
+def run_preflight(params=None, path_mappings=(), render_layers=None, refresh=False, refs=None):
+    """
+    Runs the zync_preflight checks on the current scene and returns the
+    PreflightReport. params default to get_default_params(). A report of the
+    same scene and params from the last few minutes is reused unless refresh.
+    refs are the scene's get_scene_file_refs(), if already gathered.
+    """
+    if params is None:
+        params = get_default_params(refs=refs)
+    context = preflight_context(params, path_mappings, render_layers, refs)
+    return zync_preflight.run(context, use_cache=not refresh)
 
-    if not params['scene_info']['layer_passes'].get(layer, []):
-        print "no passes selected for layer. creating path for layer only."
-        if not os.path.exists(layer_paths[layer]):
-            os.makedirs(layer_paths[layer])
+def get_output_manifest(params, scene_path=None):
+    """
+    Returns the zync_outputs.OutputManifest of every file the job described
+    by params will render: each selected layer, pass and frame.
+    """
+    if scene_path is None:
+        scene_path = cmds.file(q=True, loc=True)
+    scene = os.path.splitext(os.path.basename(scene_path))[0]
+    frames = zync_frames.FrameSet.parse(params['frange'], params.get('step', 1))
+    return zync_outputs.plan_outputs(params['out_path'], params['scene_info'], params['selected_layers'],
+                                     frames, _output_renderer(params['renderer']), scene,
+                                     params.get('camera'))
+
+def manifest_path(out_path, scene_path):
+    """Returns where the output manifest of a scene's job is saved"""
+    scene = os.path.splitext(os.path.basename(scene_path))[0]
+    return os.path.join(out_path, 'zync_manifest_%s.json' % scene)
+
+@zync_trace.traced('create_local_paths')
+def create_local_paths(params, scene_path=None):
+    """
+    Creates a local file hierarchy to assist download of rendered frames with
+    a non standard file prefix. The folders come from the job's output
+    manifest, which is saved next to them and returned.
+    """
+    if scene_path is None:
+        scene_path = cmds.file(q=True, loc=True)
+    manifest = get_output_manifest(params, scene_path)
+    directories = manifest.directories()
+    created = zync_outputs.create_directories(directories)
+    print "%d output folders for %d layers, %d frames expected, %d folders created" % (
+        len(directories), len(manifest.layers()), len(manifest), len(created))
+    try:
+        manifest.write(manifest_path(params['out_path'], scene_path))
+    except (IOError, OSError), e:
+        print 'Could not save the output manifest: %s' % e
+    return manifest
 
 class MayaZyncException(Exception):
     """
@@ -358,11 +995,187 @@ class MayaZyncException(Exception):
         cmds.warning(msg)
         super(MayaZyncException, self).__init__(msg, *args, **kwargs)
 
+class SubmitCancelled(Exception):
+    """
+    Raised on the submit thread when a background submission is cancelled.
+    """
+    pass
+
+class SubmitProgressWindow(object):
+    """
+    A small non-modal window showing the progress of a background
+    submission, with a button to cancel it. All methods must be called on
+    the main thread.
+    """
+    window_name = 'ZyncSubmitProgress'
+
+    def __init__(self, stages, on_cancel=None):
+        if cmds.window(self.window_name, q=True, ex=True):
+            cmds.deleteUI(self.window_name)
+        self.name = cmds.window(self.window_name, title='ZYNC Submit Progress', widthHeight=(360, 90))
+        cmds.columnLayout(adjustableColumn=True, rowSpacing=6)
+        self.label = cmds.text(label='Starting...', align='left')
+        self.bar = cmds.progressBar(maxValue=len(stages))
+        self.button = cmds.button(label='Cancel', command=lambda *args: on_cancel and on_cancel())
+        cmds.showWindow(self.name)
+
+    def exists(self):
+        return cmds.window(self.name, q=True, ex=True)
+
+    def update(self, label, step=None):
+        if not self.exists():
+            return
+        cmds.text(self.label, e=True, label=label)
+        if step is not None:
+            cmds.progressBar(self.bar, e=True, progress=step)
+
+    def finish(self, label):
+        if not self.exists():
+            return
+        cmds.text(self.label, e=True, label=label)
+        cmds.button(self.button, e=True, label='Close',
+                    command=lambda *args: cmds.deleteUI(self.window_name))
+
+class BackgroundSubmit(object):
+    """
+    Runs a submission on a worker thread, so Maya stays responsive during
+    authentication, output folder creation and the upload handshake. Calls
+    into Maya are marshalled to the main thread; progress is shown in a
+    SubmitProgressWindow, and errors are raised as a MayaZyncException on the
+    main thread once the worker has stopped.
+
+    status is one of 'pending', 'running', 'done', 'failed' or 'cancelled'.
+    """
+    stages = ('Authenticating',
+              'Gathering scene info',
+              'Creating local output folders',
+              'Submitting job')
+
+    def __init__(self, scene_path, params, username, password, path_mappings=(), render_layers=None,
+                 tracer=None, refs=None):
+        self.scene_path = scene_path
+        self.params = params
+        self.username = username
+        self.password = password
+        self.path_mappings = path_mappings
+        self.render_layers = render_layers
+        self.refs = refs
+        self.tracer = tracer or zync_trace.Tracer('submit')
+        self.status = 'pending'
+        self.stage = None
+        self.error = None
+        self.result = None
+        self.window = None
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def start(self, show_window=True):
+        """Starts the submission. Must be called on the main thread."""
+        if show_window:
+            self.window = SubmitProgressWindow(self.stages, on_cancel=self.cancel)
+        self.status = 'running'
+        self._thread = threading.Thread(target=self._run, name='ZyncSubmit')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """
+        Asks the submission to stop before its next stage. A job already
+        being handed to ZYNC can't be recalled.
+        """
+        self._cancelled.set()
+        if self.window is not None and self.status == 'running':
+            self.window.update('Cancelling...')
+
+    def wait(self, timeout=None):
+        """Waits for the worker thread to finish, returning the status"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.status
+
+    def _progress(self, stage):
+        if self._cancelled.is_set():
+            raise SubmitCancelled()
+        self.stage = stage
+        if self.window is not None:
+            step = list(self.stages).index(stage) if stage in self.stages else None
+            maya.utils.executeDeferred(self.window.update, '%s...' % stage, step)
+
+    def _run(self):
+        self.tracer.activate()
+        try:
+            self._progress('Authenticating')
+            with zync_trace.phase('auth'):
+                try:
+                    z = sessions.client(self.username, self.password)
+                except zync.ZyncAuthenticationError, e:
+                    raise Exception('ZYNC Username Authentication Failed')
+            self.result = submit_render(z, self.scene_path, self.params, self.path_mappings,
+                                        self.render_layers, self._progress,
+                                        maya.utils.executeInMainThreadWithResult,
+                                        self.username, self.password, self.refs)
+        except SubmitCancelled:
+            self.status = 'cancelled'
+            maya.utils.executeDeferred(self._on_cancelled)
+        except Exception, e:
+            self.status = 'failed'
+            self.error = str(e) or e.__class__.__name__
+            maya.utils.executeDeferred(self._on_failed)
+        else:
+            self.status = 'done'
+            maya.utils.executeDeferred(self._on_done)
+        finally:
+            finish_trace(self.tracer)
+
+    def _on_done(self):
+        queued = isinstance(self.result, zync_queue.QueuedSubmission)
+        label = queued and 'Job queued, ZYNC could not be reached.' or 'Job submitted to ZYNC.'
+        if self.window is not None:
+            self.window.update(label, len(self.stages))
+            self.window.finish(label)
+        # then send anything queued earlier with these credentials
+        resume_submissions(self.username, self.password)
+        cmds.confirmDialog(title='Success',
+            message=submitted_message(self.result),
+            button='OK',
+            defaultButton='OK')
+
+    def _on_cancelled(self):
+        if self.window is not None:
+            self.window.finish('Submission cancelled during: %s' % self.stage)
+
+    def _on_failed(self):
+        if self.window is not None:
+            self.window.finish('Submission failed: %s' % self.error)
+        raise MayaZyncException(self.error)
+
+# the values the submit dialog is slow to find, kept by scene and its state
+# so the dialog reopens at once; the Refresh button reads them again
+DIALOG_CACHE_FIELDS = ('project_name', 'output_dir', 'layers', 'cameras', 'memory', 'plan')
+dialog_cache = zync_session.TTLCache(10 * 60)
+
+def dialog_cache_key(scene_path):
+    """Returns the key of the scene's cached dialog values: its path, mtime and unsaved changes"""
+    try:
+        mtime = os.path.getmtime(scene_path)
+    except OSError:
+        mtime = None
+    return (scene_path, mtime, bool(cmds.file(q=True, modified=True)))
+
+def _set_menu_items(menu, labels):
+    """Replaces the items of an optionMenu"""
+    items = cmds.optionMenu(menu, q=True, itemListLong=True) or []
+    if items:
+        cmds.deleteUI(*items)
+    for label in labels:
+        cmds.menuItem(parent=menu, label=label)
+
 class SubmitWindow(object):
     """
     A Maya UI window for submitting to ZYNC
     """
-    def __init__(self, title='ZYNC Submit', path_mappings=()):
+    def __init__(self, title='ZYNC Submit', path_mappings=(), background=True):
         """
         Constructs the window.
         You must call show() to display the window.
@@ -371,18 +1184,22 @@ class SubmitWindow(object):
                        a list of 2-tuples:
                         [ ('/From_Path', '/to_path') ]
 
+        Background: Submit on a worker thread, showing progress in a separate
+                    window, rather than blocking Maya until the job is sent.
+
         """
         self.title = title
         self.path_mappings = path_mappings
+        self.background = background
+        self.submission = None
+        # records the dialog's scene queries, and then the submission
+        self.tracer = zync_trace.Tracer('submit')
 
         scene_name = cmds.file(q=True, loc=True)
         if scene_name == 'unknown':
             cmds.error( 'Please save your script before launching a job.' )
+        self.scene_name = scene_name
 
-        project_response = zync.get_project_name( scene_name )
-        if project_response["code"] != 0:
-            cmds.error( project_response["response"] )
-        self.project_name = project_response["response"]
         self.num_instances = 1
         self.priority = 50
         self.parent_id = None
@@ -391,13 +1208,7 @@ class SubmitWindow(object):
         if self.project[-1] == "/":
             self.project = self.project[:-1]
 
-        maya_output_response = zync.get_maya_output_path( scene_name )
-        if maya_output_response["code"] != 0:
-            cmds.error( maya_output_response["response"] )
-        self.output_dir =  maya_output_response["response"]
-
-        self.frange = frame_range()
-        self.frame_step = cmds.getAttr('defaultRenderGlobals.byFrameStep')
+        self.read_render_globals()
         self.chunk_size = 10
         self.upload_only = 0
         self.start_new_slots = 0
@@ -406,17 +1217,236 @@ class SubmitWindow(object):
         self.vray_nightly = 0
         self.use_vrscene = 0
 
-        self.init_layers()
+        self.username = ''
+        self.password = ''
+        self.preflight = None
+        # the scene's files, kept to plan the job again for another renderer,
+        # and the number of the latest plan, as plans finish in the background
+        self._scene_refs = None
+        self._plan_id = 0
+
+        # the window opens with the values cached for this state of the
+        # scene; without them, the server lookups run in the background and
+        # the slow scene queries once the window is up, filling it in
+        self.lookup_error = None
+        self._loading = set()
+        self._cache_key = dialog_cache_key(scene_name)
+        cached = dialog_cache.get(self._cache_key)
+        if cached is not None:
+            self.__dict__.update(cached)
+        else:
+            self.project_name = ''
+            self.output_dir = ''
+            self.layers = []
+            self.cameras = []
+            self.memory = None
+            self.plan = None
+        if self.plan is not None:
+            self.chunk_size = self.plan.chunk_size
+            self.num_instances = self.plan.num_instances
+
+        self.name = self.loadUI(ui_file())
+
+        if cached is None:
+            self.load_values()
+        else:
+            maya.utils.executeDeferred(self._check_in_background)
 
+    def read_render_globals(self):
+        """Reads the frame range, step and resolution, which are quick to query"""
+        self.frange = frame_range()
+        self.frame_step = int(cmds.getAttr('defaultRenderGlobals.byFrameStep'))
         self.x_res = cmds.getAttr('defaultResolution.width')
         self.y_res = cmds.getAttr('defaultResolution.height')
 
-        self.username = ''
-        self.password = ''
-
-        self.name = self.loadUI(UI_FILE)
+    def load_values(self):
+        """
+        Looks up the project name and output path on a background thread,
+        and queries the layers, cameras and job plan once Maya is idle,
+        filling in the window as each arrives
+        """
+        self._loading = set(['lookups', 'scene'])
+        # plans still running were made from the values being read again
+        self._plan_id += 1
+        # a submission takes the trace; the reads after it start the next one
+        if self.tracer is None:
+            self.tracer = zync_trace.Tracer('submit')
+        thread = threading.Thread(target=self._lookup, name='ZyncDialogLookups')
+        thread.daemon = True
+        thread.start()
+        maya.utils.executeDeferred(self._query_scene)
+
+    def _lookup(self):
+        try:
+            project_response = get_project_name(self.scene_name)
+            maya_output_response = get_maya_output_path(self.scene_name)
+        except Exception, e:
+            maya.utils.executeDeferred(self._fill_lookups, None, None, str(e) or e.__class__.__name__)
+            return
+        error = None
+        for response in (project_response, maya_output_response):
+            if response["code"] != 0:
+                error = response["response"]
+        maya.utils.executeDeferred(self._fill_lookups, project_response["response"],
+                                   maya_output_response["response"], error)
+
+    def _window_exists(self):
+        return cmds.window(self.name, q=True, ex=True)
+
+    def _fill_lookups(self, project_name, output_dir, error):
+        if error is not None:
+            self.lookup_error = error
+            cmds.warning('ZYNC: %s' % error)
+            return
+        self.lookup_error = None
+        self.project_name = project_name
+        self.output_dir = output_dir
+        if self._window_exists():
+            # keep anything typed in while the lookups ran
+            for field, value in (('project_name', project_name), ('output_dir', output_dir)):
+                if not eval_ui(field, text=True):
+                    cmds.textField(field, e=True, tx=value)
+        self._loaded('lookups')
+
+    def _query_scene(self):
+        self.tracer.activate()
+        try:
+            self.init_layers()
+            self.cameras = get_renderable_cameras()
+            # one scan of the scene's files, for the memory estimate and the preflight checks
+            self._scene_refs = list(get_scene_file_refs())
+        finally:
+            self.tracer.deactivate()
+
+        if self._window_exists():
+            cmds.textScrollList('layers', e=True, removeAll=True)
+            cmds.textScrollList('layers', e=True, append=self.layers)
+            _set_menu_items('camera', self.cameras)
+        self._plan_job()
+        self._check_in_background()
+
+    def _plan_job(self):
+        """
+        Queries the selected layers, or the renderable ones until layers are
+        selected, and their passes with the selected renderer, then
+        estimates the memory they need from the scene's files and plans the
+        job on a background thread
+        """
+        if self._scene_refs is None:
+            self._scene_refs = list(get_scene_file_refs())
+        layers = None
+        if self._window_exists():
+            layers = eval_ui('layers', 'textScrollList', si=True)
+        if not layers:
+            layers = get_renderable_layers(self.layers)
+        layer_passes = get_layer_passes(self.renderer, layers)
+        self._plan_id += 1
+        thread = threading.Thread(target=self._plan, name='ZyncDialogPlanner',
+                                  args=(self._plan_id, self.tracer, self.frange, self.frame_step, layers,
+                                        self.x_res, self.y_res, self.renderer, layer_passes, self._scene_refs))
+        thread.daemon = True
+        thread.start()
+
+    def _plan(self, plan_id, tracer, frange, frame_step, layers, x_res, y_res, renderer, layer_passes, refs):
+        if tracer is not None:
+            tracer.activate()
+        try:
+            memory = estimate_memory(layers, x_res, y_res, renderer, refs, layer_passes)
+            plan = plan_submission(frange, frame_step, layers, x_res, y_res, renderer,
+                                   layer_passes=layer_passes, min_memory_gb=memory and memory.peak_gb)
+        finally:
+            if tracer is not None:
+                tracer.deactivate()
+        maya.utils.executeDeferred(self._fill_plan, plan_id, memory, plan)
+
+    def _fill_plan(self, plan_id, memory, plan):
+        """
+        Pre-fills the chunk size, slot count and instance type from the
+        plan, ruling out instance types without the memory the scene needs.
+        Fields changed since they were last pre-filled are kept. Plans
+        overtaken by a change of renderer or layers are dropped.
+        """
+        if plan_id != self._plan_id:
+            return
+        edited = {}
+        if self._window_exists():
+            prefilled = (('chunk_size', str(self.chunk_size), eval_ui('chunk_size', text=True)),
+                         ('num_instances', str(self.num_instances), eval_ui('num_instances', text=True)),
+                         ('instance_type', self.instance_type_labels()[0],
+                          eval_ui('instance_type', 'optionMenu', v=True)))
+            for field, value, current in prefilled:
+                if current != value:
+                    edited[field] = current
+        self.memory = memory
+        self.plan = plan
+        if memory is not None:
+            print memory.format(zync.INSTANCE_TYPES)
+        if plan is not None:
+            self.chunk_size = plan.chunk_size
+            self.num_instances = plan.num_instances
+        if self._window_exists():
+            labels = self.instance_type_labels()
+            _set_menu_items('instance_type', labels)
+            if edited.get('instance_type') in labels:
+                cmds.optionMenu('instance_type', e=True, v=edited['instance_type'])
+            for field in ('chunk_size', 'num_instances'):
+                if field not in edited:
+                    cmds.textField(field, e=True, tx=str(getattr(self, field)))
+        if 'scene' in self._loading:
+            self._loaded('scene')
+
+    def _check_in_background(self):
+        """
+        Gathers the preflight context from the scene and the UI, and runs
+        the checks, which stat the scene's files, on a background thread,
+        printing any problems found once they finish
+        """
+        try:
+            params = self.get_render_params()
+        except (MayaZyncException, ValueError), e:
+            print 'Preflight checks skipped: %s' % e
+            return
+        context = preflight_context(params, self.path_mappings, self.layers, self._scene_refs)
+        thread = threading.Thread(target=self._check, args=(context, self.tracer), name='ZyncDialogPreflight')
+        thread.daemon = True
+        thread.start()
+
+    def _check(self, context, tracer):
+        tracer = tracer or zync_trace.Tracer('preflight')
+        tracer.activate()
+        try:
+            with zync_trace.phase('preflight'):
+                report = zync_preflight.run(context)
+        finally:
+            tracer.deactivate()
+        maya.utils.executeDeferred(self._report_preflight, report)
+
+    def _loaded(self, part):
+        self._loading.discard(part)
+        if not self._loading:
+            dialog_cache.set(self._cache_key, dict([(field, getattr(self, field))
+                                                    for field in DIALOG_CACHE_FIELDS]))
 
-        self.check_references()
+    @staticmethod
+    def refresh(window):
+        """
+        Forgets the cached values for the scene and the server lookups, and
+        reads them all again
+        """
+        dialog_cache.invalidate(window._cache_key)
+        sessions.lookups.invalidate(('project_name', window.scene_name))
+        sessions.lookups.invalidate(('maya_output_path', window.scene_name))
+        zync_preflight.cache.invalidate()
+        window._cache_key = dialog_cache_key(window.scene_name)
+        window.read_render_globals()
+        for field in ('frange', 'frame_step', 'x_res', 'y_res'):
+            cmds.textField(field, e=True, tx=str(getattr(window, field)))
+        # the lookups only fill in empty fields, so clear the old values for them
+        for field in ('project_name', 'output_dir'):
+            setattr(window, field, '')
+            cmds.textField(field, e=True, tx='')
+        window._scene_refs = None
+        window.load_values()
 
     def loadUI(self, ui_file):
         """
@@ -426,6 +1456,7 @@ class SubmitWindow(object):
         # monkey patch the cmds module for use when the UI gets loaded
         cmds.submit_callb = partial(self.get_initial_value, self)
         cmds.do_submit_callb = partial(self.submit, self)
+        cmds.refresh_submit_callb = partial(self.refresh, self)
 
         if cmds.window('SubmitDialog', q=True, ex=True):
             cmds.deleteUI('SubmitDialog')
@@ -436,6 +1467,7 @@ class SubmitWindow(object):
         # callbacks
         cmds.checkBox('upload_only', e=True, changeCommand=self.upload_only_toggle)
         cmds.optionMenu('renderer', e=True, changeCommand=self.change_renderer)
+        cmds.textScrollList('layers', e=True, selectCommand=self.change_layers)
         self.change_renderer( self.renderer )
 
         return name
@@ -482,19 +1514,55 @@ class SubmitWindow(object):
             cmds.checkBox('vray_nightly', e=True, en=False)
             cmds.checkBox('use_vrscene', e=True, en=False)
 
-    def check_references(self):
+        # the passes, and so the memory and the plan, depend on the renderer
+        for key, label in zync.MAYA_RENDERERS.items():
+            if renderer == label:
+                renderer = key
+                break
+        if renderer != self.renderer:
+            self.renderer = renderer
+            # until the scene is queried, its plan is made with this renderer
+            if self._scene_refs is not None or 'scene' not in self._loading:
+                maya.utils.executeDeferred(self._plan_job)
+
+    def change_layers(self):
+        # the job is planned for the selected layers
+        if self._scene_refs is not None or 'scene' not in self._loading:
+            maya.utils.executeDeferred(self._plan_job)
+
+    def check_references(self, params=None, refresh=False, refs=None):
         """
-        Run any checks to ensure all reference files are accurate. If not,
-        raise an Exception to halt the submit process.
-
-        This function currently does nothing. Before Maya Binary was supported
-        it checked to ensure no .mb files were being used.
+        Runs the preflight checks on the scene, with params or those set on
+        the UI, printing any problems found, and returns the PreflightReport.
+        The report is cached, so running them again for the same scene and
+        params is free; with refresh, the files are stat'ed again, as files
+        may have been fixed or removed since the report was made. refs are
+        the scene's get_scene_file_refs(), if already gathered.
         """
-
-        #for ref in cmds.file(q=True, r=True):
-        #    if check_failed:
-        #        raise Exception(msg)
-        pass
+        if params is None:
+            try:
+                params = self.get_render_params()
+            except (MayaZyncException, ValueError), e:
+                print 'Preflight checks skipped: %s' % e
+                return None
+        # recorded with the dialog's setup, until the first submission takes the trace
+        tracer = self.tracer or zync_trace.Tracer('preflight')
+        tracer.activate()
+        try:
+            report = run_preflight(params, self.path_mappings, self.layers, refresh, refs)
+        finally:
+            tracer.deactivate()
+        self._report_preflight(report)
+        return report
+
+    def _report_preflight(self, report):
+        self.preflight = report
+        if report.results:
+            print report.format()
+        counts = report.counts()
+        if counts[zync_preflight.ERROR] or counts[zync_preflight.WARNING]:
+            cmds.warning('ZYNC preflight found %d errors and %d warnings, see the Script Editor.' % (
+                counts[zync_preflight.ERROR], counts[zync_preflight.WARNING]))
 
     def get_render_params(self):
         """
@@ -533,6 +1601,7 @@ class SubmitWindow(object):
 
         params['frange'] = eval_ui('frange', text=True)
         params['step'] = int(eval_ui('frame_step', text=True))
+        params['frange'] = validate_frange(params['frange'], params['step'])
         params['chunk_size'] = int(eval_ui('chunk_size', text=True))
         params['camera'] = eval_ui('camera', 'optionMenu', v=True)
         params['xres'] = int(eval_ui('x_res', text=True))
@@ -554,14 +1623,26 @@ class SubmitWindow(object):
         cmds.showWindow(self.name)
 
     def init_instance_type(self):
-        non_default = []
+        for label in self.instance_type_labels():
+            cmds.menuItem( parent='instance_type', label=label )
+
+    def instance_type_labels(self):
+        # the first item is selected, so put the planned type first
+        recommended = self.memory and self.memory.recommend(zync.INSTANCE_TYPES)
+        if self.plan is not None:
+            first_type = self.plan.instance_type.name
+        elif recommended is not None:
+            first_type = recommended.name
+        else:
+            first_type = zync.DEFAULT_INSTANCE_TYPE
+        labels = []
         for inst_type in zync.INSTANCE_TYPES:
-            if inst_type == zync.DEFAULT_INSTANCE_TYPE:
-                cmds.menuItem( parent='instance_type', label='%s (%s)' % ( inst_type, zync.INSTANCE_TYPES[inst_type]["description"] ) )
+            label = '%s (%s)' % ( inst_type, zync.INSTANCE_TYPES[inst_type]["description"] )
+            if inst_type == first_type:
+                labels.insert(0, label)
             else:
-                non_default.append( '%s (%s)' % ( inst_type, zync.INSTANCE_TYPES[inst_type]["description"] ) )
-        for label in non_default:
-            cmds.menuItem( parent='instance_type', label=label )
+                labels.append(label)
+        return labels
 
     def init_renderer(self):
         # put default renderer first
@@ -576,20 +1657,14 @@ class SubmitWindow(object):
         self.renderer = zync.MAYA_DEFAULT_RENDERER
 
     def init_camera(self):
-        cam_parents = [cmds.listRelatives(x, ap=True)[-1] for x in cmds.ls(cameras=True)]
-        for cam in cam_parents:
-            if ( cmds.getAttr( cam + '.renderable') ) == True:
-                cmds.menuItem( parent='camera', label=cam )
+        if not hasattr(self, 'cameras'):
+            self.cameras = get_renderable_cameras()
+        for cam in self.cameras:
+            cmds.menuItem( parent='camera', label=cam )
 
+    @zync_trace.traced('init_layers')
     def init_layers(self):
-        self.layers = []
-        try:
-            all_layers = cmds.ls(type='renderLayer',showNamespace=True)
-            for i in range( 0, len(all_layers), 2 ):
-                if all_layers[i+1] == ':':
-                    self.layers.append( all_layers[i] )
-        except Exception:
-            self.layers = cmds.ls(type='renderLayer')
+        self.layers = get_render_layers()
 
     def get_scene_info(self, renderer):
         """
@@ -597,64 +1672,7 @@ class SubmitWindow(object):
         We use this to allow ZYNC to skip the file checks.
 
         """
-        layers = [x for x in cmds.ls(type='renderLayer')\
-                  if x != 'defaultRenderLayer' and not ':' in x]
-        references = cmds.file(q=True, r=True)
-
-        layer_prefixes = dict()
-        layer_passes = dict()
-        for layer in layers:
-            if renderer == zync.VRAY_RENDERER:
-                node = 'vraySettings'
-                attribute = 'fileNamePrefix'
-                format_attr = 'imageFormatStr'
-            elif renderer in (zync.SOFTWARE_RENDERER, zync.MENTAL_RAY_RENDERER):
-                node = 'defaultRenderGlobals'
-                attribute = 'imageFilePrefix'
-            try:
-                layer_prefix = get_layer_override(layer, node, attribute)
-                layer_prefixes[layer] = layer_prefix
-            except Exception:
-                pass
-
-            if renderer in (zync.VRAY_RENDERER, zync.MENTAL_RAY_RENDERER):
-                passes = get_pass_names(renderer, layer)
-                layer_passes[layer] = passes
-
-        if renderer == zync.VRAY_RENDERER:
-            extension = cmds.getAttr('vraySettings.imageFormatStr')
-            if extension == None:
-                extension = 'png'
-            padding = int(cmds.getAttr('vraySettings.fileNamePadding'))
-            global_prefix = get_layer_override('defaultRenderLayer', 'vraySettings', 'fileNamePrefix')
-        elif renderer in (zync.SOFTWARE_RENDERER, zync.MENTAL_RAY_RENDERER):
-            extension = get_default_extension(renderer)
-            padding = int(cmds.getAttr('defaultRenderGlobals.extensionPadding'))
-            global_prefix = get_layer_override('defaultRenderLayer', 'defaultRenderGlobals', 'imageFilePrefix')
-
-        extension = extension[:3]
-
-        file_prefix = [global_prefix]
-        file_prefix.append(layer_prefixes)
-        files = list(set(get_scene_files()))
-
-        plugins = []
-        plugin_list = cmds.pluginInfo( query=True, pluginsInUse=True )
-        for i in range( 0, len(plugin_list), 2):
-            plugins.append( str(plugin_list[i]) )
-
-        if len(cmds.ls(type='cacheFile')) > 0:
-            plugins.append( "cache" )
-
-        scene_info = {'files': files,
-                      'render_layers': self.layers,
-                      'references': references,
-                      'file_prefix': file_prefix,
-                      'padding': padding,
-                      'extension': extension,
-                      'plugins': plugins,
-                      'layer_passes': layer_passes}
-        return scene_info
+        return get_scene_info(renderer, self.layers)
 
     @staticmethod
     def get_initial_value(window, name):
@@ -674,30 +1692,20 @@ class SubmitWindow(object):
         """
         Submits to zync
         """
+        if window.lookup_error is not None:
+            raise MayaZyncException(window.lookup_error)
+        if 'lookups' in window._loading and not eval_ui('project_name', text=True):
+            raise MayaZyncException('Still looking up the ZYNC project, please try again in a moment.')
         params = window.get_render_params()
 
         scene_path = cmds.file(q=True, loc=True)
-        # Comment out the line above and uncomment this section if you want to
-        # save a unique copy of the scene file each time your submit a job.
-        '''
-        original_path = cmds.file(q=True, loc=True)
-        original_modified = cmds.file(q=True, modified=True)
-        scene_path = generate_scene_path()
-        cmds.file( rename=scene_path )
-        cmds.file( save=True, type='mayaAscii' )
-        cmds.file( rename=original_path )
-        cmds.file( modified=original_modified )
-        '''
-
-        if params["upload_only"] == 1:
-            layers = None
-        else:
+
+        if params["upload_only"] != 1:
             layers = eval_ui('layers', 'textScrollList', ai=True, si=True)
             if not layers:
                 msg = 'Please select layer(s) to render.'
                 raise MayaZyncException(msg)
             params['selected_layers'] = layers
-            layers = ','.join(layers)
 
         username = eval_ui('username', text=True)
         password = eval_ui('password', text=True)
@@ -705,37 +1713,370 @@ class SubmitWindow(object):
             msg = 'Please enter a ZYNC username and password.'
             raise MayaZyncException(msg)
 
+        # problems that would fail the job on the farm are confirmed first,
+        # checked against the files as they are now rather than when the
+        # dialog opened
+        # the scene's files are gathered once, for the checks and the job
+        refs = list(get_scene_file_refs())
+        report = window.check_references(params, refresh=True, refs=refs)
+        if report is not None and report.errors:
+            message = '%s\n\nSubmit anyway?' % report.format(max_per_check=5)
+            answer = cmds.confirmDialog(title='ZYNC Preflight', message=message,
+                                        button=['Submit Anyway', 'Cancel'], defaultButton='Cancel',
+                                        cancelButton='Cancel', dismissString='Cancel')
+            if answer != 'Submit Anyway':
+                raise MayaZyncException('Submission cancelled: the preflight checks found errors.')
+
+        # set SNAPSHOT_SCENES in config_maya.py to submit a snapshot of the
+        # scene as it is now, rather than the scene file
+        load()
+        if SNAPSHOT_SCENES:
+            scene_path = save_scene_snapshot()
+
+        # a trace per submission, the first one including the dialog's setup
+        tracer = window.tracer or zync_trace.Tracer('submit')
+        window.tracer = None
+
+        if window.background:
+            window.submission = BackgroundSubmit(scene_path, params, username, password,
+                                                 window.path_mappings, window.layers, tracer, refs).start()
+            return
+
+        tracer.activate()
         try:
-            z = zync.Zync( "maya_plugin", API_KEY, username=username, password=password )
-        except zync.ZyncAuthenticationError, e:
-            msg = 'ZYNC Username Authentication Failed'
-            raise MayaZyncException(msg)
-
-        if params["upload_only"] == 1:
-            params['scene_info'] = {}
-        else:
-            scene_info = window.get_scene_info(params['renderer'])
-            params['scene_info'] = scene_info
+            with zync_trace.phase('auth'):
+                try:
+                    z = sessions.client(username, password)
+                except zync.ZyncAuthenticationError, e:
+                    msg = 'ZYNC Username Authentication Failed'
+                    raise MayaZyncException(msg)
+
+            result = submit_render(z, scene_path, params, window.path_mappings, window.layers,
+                                   username=username, password=password, refs=refs)
+        finally:
+            finish_trace(tracer)
+        # then send anything queued earlier with these credentials
+        resume_submissions(username, password)
 
-        z.add_path_mappings(window.path_mappings)
+        cmds.confirmDialog(title='Success',
 
-        import pprint
-        pp = pprint.PrettyPrinter()
-        print pp.pprint(params)
+        message=submitted_message(result),
+        button='OK',
+        defaultButton='OK')
 
-        if params['upload_only'] == 0:
-            create_local_paths(params)
-        del params['selected_layers']
-        del params['scene_info']['layer_passes']
 
-        z.submit_job("maya", scene_path, layers, params=params)
+def _run_here(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
 
-        cmds.confirmDialog(title='Success',
+def finish_trace(tracer):
+    """
+    Stops recording to the zync_trace.Tracer, prints its per phase summary and
+    writes its Chrome trace file. Failing to write the trace doesn't fail the
+    submission.
+    """
+    tracer.deactivate()
+    print tracer.summary()
+    try:
+        print 'Submission trace written to %s' % tracer.write()
+    except (IOError, OSError), e:
+        print 'Could not write submission trace: %s' % e
 
-        message='Job submitted to ZYNC.\n\nPlease ensure your Client App is running and logged in so your job can start.',
-        button='OK',
-        defaultButton='OK')
+def submit_render(z, scene_path, params, path_mappings=(), render_layers=None, progress=None, run_in_main=None,
+                  username=None, password=None, refs=None):
+    """
+    Gathers the scene info for params and submits the scene using the
+    authenticated zync.Zync instance z, or a client from sessions. params is a dict as returned by
+    SubmitWindow.get_render_params(), with 'selected_layers' set to the list
+    of layers to render unless it is an upload only job.
+
+    progress(stage) is called before each stage. run_in_main(fn, *args) is
+    used for every call that touches Maya, so this can run on a background
+    thread with run_in_main set to maya.utils.executeInMainThreadWithResult.
+    refs are the scene's get_scene_file_refs(), if already gathered.
+
+    Returns ZYNC's response. With QUEUE_SUBMISSIONS and the username and
+    password z was created with, a submission that fails to reach ZYNC is
+    queued to be sent again in the background, and its
+    zync_queue.QueuedSubmission is returned instead.
+    """
+    if progress is None:
+        progress = lambda stage: None
+    if run_in_main is None:
+        run_in_main = _run_here
+
+    if params["upload_only"] == 1:
+        params['scene_info'] = {}
+        layers = None
+    else:
+        progress('Gathering scene info')
+        scene_info = run_in_main(zync_trace.bind(get_scene_info), params['renderer'], render_layers, refs)
+        params['scene_info'] = scene_info
+        layers = ','.join(params['selected_layers'])
+
+    z.add_path_mappings(path_mappings)
+    if path_mappings and params['scene_info'].get('files'):
+        with zync_trace.phase('path_mappings'):
+            report = check_path_mappings(path_mappings, [scene_path] + params['scene_info']['files'])
+        if report.unmapped:
+            print 'Warning: %d scene files are not covered by the path mappings' % len(report.unmapped)
+            print report.format()
+
+    # set DELTA_UPLOADS in config_maya.py to send only the files that changed
+    # since they were last uploaded for the project
+    ledger = None
+    if DELTA_UPLOADS and params['scene_info'].get('files'):
+        ledger = zync_ledger.UploadLedger()
+    try:
+        return _submit_render(z, scene_path, params, layers, path_mappings, progress, username, password, ledger)
+    finally:
+        if ledger is not None:
+            ledger.close()
+
+def _submit_render(z, scene_path, params, layers, path_mappings, progress, username, password, ledger):
+    upload_plan = None
+    if ledger is not None:
+        progress('Checking for changed files')
+        with zync_trace.phase('upload_ledger'):
+            upload_plan = plan_uploads(params['proj_name'], params['scene_info']['files'], path_mappings, ledger)
+        print upload_plan.format()
+        # missing files stay listed, for ZYNC to report
+        params['scene_info']['files'] = upload_plan.upload_paths() + [r.path for r in upload_plan.missing]
+        params['scene_info']['reused_files'] = upload_plan.reuse_list()
+
+    print 'Submitting %s with params:' % scene_path
+    print zync_trace.format_params(params)
+
+    manifest = None
+    if params['upload_only'] == 0:
+        progress('Creating local output folders')
+        create_local_paths(params, scene_path)
+        manifest = manifest_path(params['out_path'], scene_path)
+    params.pop('selected_layers', None)
+    params['scene_info'].pop('layer_passes', None)
+
+    progress('Submitting job')
+    with zync_trace.phase('submit'):
+        try:
+            response = z.submit_job("maya", scene_path, layers, params=params)
+        except Exception, e:
+            # set QUEUE_SUBMISSIONS in config_maya.py to keep submissions that
+            # fail to reach ZYNC and send them again; the ledger isn't updated
+            # for them, so their files are planned again next time
+            if not QUEUE_SUBMISSIONS or not username or not password or isinstance(e, sessions.reauth_errors):
+                raise
+            return queue_submission(scene_path, layers, params, path_mappings, username, password,
+                                    str(e) or e.__class__.__name__)
+    if upload_plan is not None:
+        # the ZYNC client uploads the files later, so they are only reused
+        # once frames of this job arrive, or they are confirmed by hand
+        ledger.record(upload_plan, manifest)
+    return response
+
+def submitted_message(result):
+    """Returns the message shown once submit_render() returns result"""
+    if isinstance(result, zync_queue.QueuedSubmission):
+        return ('ZYNC could not be reached, so the job was queued and will be sent in the background.'
+                '\n\n%s\n\nRun "python zync_queue.py status" to follow it.' % result.last_error)
+    return 'Job submitted to ZYNC.\n\nPlease ensure your Client App is running and logged in so your job can start.'
+
+# submissions that failed to reach ZYNC, with QUEUE_SUBMISSIONS; the worker
+# sends those of the users whose passwords were given in this session
+submission_queue = zync_queue.SubmissionQueue()
+_queue_passwords = {}
+_queue_worker = None
+_queue_lock = threading.Lock()
+
+def _submit_queued(job):
+    # zync is only loaded once there is a job to send
+    load()
+    password = _queue_passwords.get(job.username)
+    try:
+        z = sessions.client(job.username, password, job.path_mappings)
+    except sessions.reauth_errors:
+        # wait for the right password rather than failing the job
+        _queue_passwords.pop(job.username, None)
+        raise
+    return z.submit_job('maya', job.scene_path, job.layers, params=job.params)
+
+def _queue_result(job):
+    if job.status == zync_queue.DONE:
+        print 'Queued submission %s of %s was sent to ZYNC.' % (job.id, job.scene_path)
+    else:
+        print 'Queued submission %s of %s failed: %s' % (job.id, job.scene_path, job.last_error)
 
+def _start_queue_worker():
+    global _queue_worker
+    _queue_lock.acquire()
+    try:
+        if _queue_worker is None or not _queue_worker.wake():
+            _queue_worker = zync_queue.QueueWorker(submission_queue, _submit_queued,
+                                                   accept=lambda job: job.username in _queue_passwords,
+                                                   on_result=_queue_result).start()
+        return _queue_worker
+    finally:
+        _queue_lock.release()
+
+def queue_submission(scene_path, layers, params, path_mappings, username, password, error):
+    """
+    Queues a fully resolved submission that failed with error, and starts
+    sending the queue in the background. Returns its QueuedSubmission.
+    """
+    job = submission_queue.enqueue(scene_path, layers, params, path_mappings, username, error)
+    _queue_passwords[username] = password
+    print 'ZYNC submission failed: %s' % error
+    print 'Queued as %s, to be sent again in the background.' % job.id
+    _start_queue_worker()
+    return job
+
+def resume_submissions(username=None, password=None, background=True):
+    """
+    Sends the queued submissions of the users whose passwords are known:
+    username and password, $ZYNC_USERNAME and $ZYNC_PASSWORD, or those
+    given earlier in this session. In the background they are sent as they
+    fall due; otherwise those due now are sent before returning. Returns
+    the zync_queue.QueueWorker, or None if none of the queued submissions
+    can be sent.
+    """
+    pending = submission_queue.jobs(zync_queue.PENDING)
+    if not pending:
+        return None
+    if username and password:
+        _queue_passwords[username] = password
+    if os.environ.get('ZYNC_USERNAME') and os.environ.get('ZYNC_PASSWORD'):
+        _queue_passwords.setdefault(os.environ['ZYNC_USERNAME'], os.environ['ZYNC_PASSWORD'])
+    waiting = sorted(set([job.username for job in pending if job.username not in _queue_passwords]))
+    if waiting:
+        print '%d queued ZYNC submissions are waiting for the password of %s; they are sent with the next submission.' % (
+            len([job for job in pending if job.username in waiting]), ', '.join(waiting))
+    if len(waiting) == len(set([job.username for job in pending])):
+        return None
+    if background:
+        return _start_queue_worker()
+    worker = zync_queue.QueueWorker(submission_queue, _submit_queued,
+                                    accept=lambda job: job.username in _queue_passwords,
+                                    on_result=_queue_result)
+    # as run() does, requeue the jobs a session that died left submitting
+    submission_queue.recover()
+    worker.run_once()
+    return worker
+
+def get_default_params(scene_path=None, refs=None, renderer=None, layers=None):
+    """
+    Returns the render parameters the submit dialog starts out with for the
+    current scene, in the form returned by SubmitWindow.get_render_params(),
+    planned for renderer, by default zync.MAYA_DEFAULT_RENDERER, and the
+    layers, by default the renderable ones. refs are the scene's
+    get_scene_file_refs(), if already gathered.
+    """
+    if scene_path is None:
+        scene_path = cmds.file(q=True, loc=True)
+    if scene_path == 'unknown':
+        raise MayaZyncException('Please save your scene before launching a job.')
+
+    project_response = get_project_name( scene_path )
+    if project_response["code"] != 0:
+        raise MayaZyncException( project_response["response"] )
+    maya_output_response = get_maya_output_path( scene_path )
+    if maya_output_response["code"] != 0:
+        raise MayaZyncException( maya_output_response["response"] )
+
+    project = proj_dir()
+    if project[-1] == "/":
+        project = project[:-1]
+
+    instance_type = zync.INSTANCE_TYPES.get(zync.DEFAULT_INSTANCE_TYPE)
+    if instance_type:
+        instance_type = instance_type['csp_label']
+    else:
+        instance_type = zync.DEFAULT_INSTANCE_TYPE
+
+    cameras = get_renderable_cameras()
+    frange = frame_range()
+    frame_step = int(cmds.getAttr('defaultRenderGlobals.byFrameStep'))
+    x_res = int(cmds.getAttr('defaultResolution.width'))
+    y_res = int(cmds.getAttr('defaultResolution.height'))
+    if renderer is None:
+        renderer = zync.MAYA_DEFAULT_RENDERER
+    if not layers:
+        layers = get_renderable_layers()
+    layer_passes = get_layer_passes(renderer, layers)
+    memory = estimate_memory(layers, x_res, y_res, renderer, refs, layer_passes)
+    plan = plan_submission(frange, frame_step, layers, x_res, y_res, renderer, layer_passes=layer_passes,
+                           min_memory_gb=memory and memory.peak_gb)
+
+    params = dict()
+    params['proj_name'] = project_response["response"]
+    params['upload_only'] = 0
+    params['start_new_slots'] = 1
+    params['skip_check'] = 0
+    params['notify_complete'] = 0
+    params['project'] = project
+    params['out_path'] = maya_output_response["response"]
+    params['renderer'] = renderer
+    params['num_instances'] = 1
+    params['instance_type'] = instance_type
+    params['frange'] = frange
+    params['step'] = frame_step
+    params['chunk_size'] = 10
+    params['camera'] = cameras[0] if cameras else ''
+    params['xres'] = x_res
+    params['yres'] = y_res
+    if plan is not None:
+        params['num_instances'] = plan.num_instances
+        params['instance_type'] = plan.instance_type.label
+        params['chunk_size'] = plan.chunk_size
+    params['vray_nightly'] = 0
+    params['use_vrscene'] = 0
+    return params
+
+def submit_scene(scene_path, overrides=None, username=None, password=None, path_mappings=(), open_scene=True):
+    """
+    Submits a scene without the submit dialog, for batch submission from
+    mayapy. The params start from get_default_params() and are updated with
+    overrides; a 'selected_layers' override picks the layers to render, which
+    otherwise default to every renderable layer. Returns the params submitted,
+    with the 'selected_layers' rendered, and the id of its queued job as
+    'queued' if it was queued rather than sent.
+    """
+    tracer = zync_trace.Tracer('submit').activate()
+    try:
+        return _submit_scene(scene_path, overrides, username, password, path_mappings, open_scene)
+    finally:
+        finish_trace(tracer)
+
+def _submit_scene(scene_path, overrides, username, password, path_mappings, open_scene):
+    if open_scene:
+        cmds.file(scene_path, open=True, force=True)
+
+    # the scene's files are gathered once, for the defaults and the job
+    refs = list(get_scene_file_refs())
+    overrides = overrides or {}
+    params = get_default_params(scene_path, refs, overrides.get('renderer'), overrides.get('selected_layers'))
+    params.update(overrides)
+    params['frange'] = validate_frange(params['frange'], params['step'])
+    render_layers = get_render_layers()
+
+    if params["upload_only"] != 1:
+        if not params.get('selected_layers'):
+            params['selected_layers'] = get_renderable_layers(render_layers)
+        if not params['selected_layers']:
+            raise MayaZyncException('No renderable layers in %s.' % scene_path)
+
+    if not username or not password:
+        raise MayaZyncException('Please enter a ZYNC username and password.')
+    with zync_trace.phase('auth'):
+        try:
+            z = sessions.client(username, password)
+        except zync.ZyncAuthenticationError, e:
+            raise MayaZyncException('ZYNC Username Authentication Failed')
+
+    selected_layers = params.get('selected_layers')
+    result = submit_render(z, scene_path, params, path_mappings, render_layers,
+                           username=username, password=password, refs=refs)
+    params['selected_layers'] = selected_layers
+    if isinstance(result, zync_queue.QueuedSubmission):
+        params['queued'] = result.id
+    return params
 
 def submit_dialog():
     submit_window = SubmitWindow()
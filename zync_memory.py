@@ -0,0 +1,682 @@
+"""
+ZYNC Memory Estimator
+
+Estimates the peak memory a render needs, so the smallest instance type
+with enough of it can be picked. The estimate adds up:
+
+    * the memory of Maya and the renderer themselves
+    * the frame buffers: the resolution times the beauty and each pass
+    * the textures, from their dimensions, channels and bit depth. Tiled,
+      mip-mapped textures such as .tx files are paged through the
+      renderer's texture cache, so they count up to its size at most
+    * the geometry caches, from their size on disk
+
+Texture dimensions come from the image headers alone: EXR, TIFF (and .tx),
+PNG and JPEG headers are read up to the fields needed, never the pixels.
+Headers are read on a pool of threads and kept in a HeaderCache by path,
+size and mtime, saved to ~/.zync/image_headers.json unless
+ZYNC_HEADER_CACHE is set, so unchanged textures aren't read again. Only one
+frame of an image sequence is in memory at a time, so only its first frame
+is read; every UDIM tile is.
+
+The figures are rough, meant to rule out instance types that will run out
+of memory rather than to predict usage. This module has no dependency on
+Maya.
+
+Usage:
+    import zync_memory
+    estimate = zync_memory.estimate(zync_maya.get_scene_file_refs(), 1920, 1080, passes=4)
+    estimate.peak_gb
+    estimate.recommend(zync.INSTANCE_TYPES).name
+
+From the command line, for a Maya ASCII scene or a list of files:
+    python zync_memory.py --scene /shows/a/scenes/shot010.ma
+    python zync_memory.py -x 4096 -y 2160 -p 6 /shows/a/sourceimages/*.exr
+
+"""
+
+import json
+import optparse
+import os
+import struct
+import sys
+import threading
+import time
+import Queue
+
+import zync_planner
+import zync_scan
+import zync_sequences
+
+DEFAULT_WORKERS = 16
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+GB = 1024.0 ** 3
+
+# memory used by Maya and the renderer with an empty scene, by renderer name
+BASE_BYTES = 2.0 * GB
+RENDERER_BASE_BYTES = (('vray', 1.0 * GB),
+                       ('arnold', 1.0 * GB),
+                       ('redshift', 1.5 * GB),
+                       ('mental', 0.75 * GB),
+                       ('mr', 0.75 * GB))
+
+# frame buffers are float RGBA, held by the renderer and again for writing
+FRAMEBUFFER_BYTES_PER_PIXEL = 4 * 4
+FRAMEBUFFER_COPIES = 2
+
+# untiled textures are mip-mapped in memory when loaded, adding a third
+MIPMAP_FACTOR = 4.0 / 3.0
+TEXTURE_CACHE_BYTES = 4.0 * GB
+
+# geometry grows into acceleration structures once loaded
+GEOMETRY_EXTENSIONS = set(['.abc', '.mc', '.mcx', '.vrmesh', '.ass', '.rs', '.vdb',
+                           '.bgeo', '.fur', '.ptc', '.bin', '.obj', '.fbx'])
+GEOMETRY_FACTOR = 2.5
+
+# spare memory kept on top of the estimate
+HEADROOM = 1.25
+
+# bytes read at most while parsing an image header
+MAX_HEADER_BYTES = 1024 * 1024
+
+class ImageInfo(object):
+    """The dimensions and layout of an image, read from its header"""
+    __slots__ = ('width', 'height', 'channels', 'bytes_per_channel', 'tiled', 'mipmapped')
+
+    def __init__(self, width, height, channels, bytes_per_channel, tiled=False, mipmapped=False):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.bytes_per_channel = bytes_per_channel
+        self.tiled = tiled
+        self.mipmapped = mipmapped
+
+    @property
+    def bytes(self):
+        """Returns the size of the full resolution image in memory"""
+        return self.width * self.height * self.channels * self.bytes_per_channel
+
+    def to_dict(self):
+        return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*[data[name] for name in cls.__slots__])
+
+    def __repr__(self):
+        return 'ImageInfo(%dx%d, %d channels of %d bytes%s)' % (
+            self.width, self.height, self.channels, self.bytes_per_channel,
+            self.tiled and ', tiled' or '')
+
+class _Reader(object):
+    """Reads a header from a file, refusing to read more than MAX_HEADER_BYTES"""
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def read(self, size):
+        self.count += size
+        if self.count > MAX_HEADER_BYTES:
+            raise ValueError('Header is too long')
+        data = self.f.read(size)
+        if len(data) < size:
+            raise ValueError('Header is truncated')
+        return data
+
+    def unpack(self, fmt):
+        return struct.unpack(fmt, self.read(struct.calcsize(fmt)))
+
+    def seek(self, offset):
+        self.f.seek(offset)
+
+    def string(self, limit=256):
+        chars = []
+        while True:
+            char = self.read(1)
+            if char == '\0':
+                return ''.join(chars)
+            chars.append(char)
+            if len(chars) > limit:
+                raise ValueError('Header string is too long')
+
+# EXR channel pixel types: uint, half and float
+_EXR_PIXEL_BYTES = {0: 4, 1: 2, 2: 4}
+_EXR_TILED = 0x200
+
+def read_exr_header(f):
+    """Returns the ImageInfo of an OpenEXR file, from the attributes of its (first) header"""
+    reader = _Reader(f)
+    magic, version = reader.unpack('<ii')
+    tiled = bool(version & _EXR_TILED)
+    width = height = None
+    channel_bytes = []
+    mipmapped = False
+    while True:
+        name = reader.string()
+        if not name:
+            break
+        attribute_type = reader.string()
+        size, = reader.unpack('<i')
+        end = f.tell() + size
+        if name == 'channels' and attribute_type == 'chlist':
+            while True:
+                channel = reader.string()
+                if not channel:
+                    break
+                pixel_type, linear, x_sampling, y_sampling = reader.unpack('<iB3xii')
+                channel_bytes.append(_EXR_PIXEL_BYTES.get(pixel_type, 4))
+        elif name == 'dataWindow' and attribute_type == 'box2i':
+            x_min, y_min, x_max, y_max = reader.unpack('<iiii')
+            width, height = x_max - x_min + 1, y_max - y_min + 1
+        elif name == 'tiles' and attribute_type == 'tiledesc':
+            x_size, y_size, mode = reader.unpack('<IIB')
+            tiled = True
+            mipmapped = (mode & 0xf) != 0
+        reader.seek(end)
+    if width is None or not channel_bytes:
+        raise ValueError('EXR header has no dataWindow or channels')
+    return ImageInfo(width, height, len(channel_bytes), max(channel_bytes), tiled, mipmapped)
+
+_TIFF_TYPE_SIZES = {1: 1, 3: 2, 4: 4, 16: 8}
+_TIFF_TYPE_FORMATS = {1: 'B', 3: 'H', 4: 'I', 16: 'Q'}
+
+def read_tiff_header(f):
+    """
+    Returns the ImageInfo of a TIFF or BigTIFF file, such as a .tx, from the
+    tags of its first directory. Further directories are its mip levels.
+    """
+    reader = _Reader(f)
+    order = reader.read(2)
+    endian = order == 'II' and '<' or '>'
+    version, = reader.unpack(endian + 'H')
+    big = version == 43
+    if big:
+        offset_size, zero, offset = reader.unpack(endian + 'HHQ')
+        count_format, entry_format, next_format = 'Q', 'HHQ', 'Q'
+    else:
+        offset, = reader.unpack(endian + 'I')
+        count_format, entry_format, next_format = 'H', 'HHI', 'I'
+    value_size = big and 8 or 4
+    reader.seek(offset)
+    entries, = reader.unpack(endian + count_format)
+    tags = {}
+    for _ in range(entries):
+        tag, value_type, count = reader.unpack(endian + entry_format)
+        data = reader.read(value_size)
+        if tag not in (256, 257, 258, 277, 322) or value_type not in _TIFF_TYPE_SIZES:
+            continue
+        item_size = _TIFF_TYPE_SIZES[value_type]
+        if count * item_size > value_size:
+            # the values are stored elsewhere; the first one is all that's needed
+            position = f.tell()
+            reader.seek(struct.unpack(endian + (big and 'Q' or 'I'), data)[0])
+            data = reader.read(item_size)
+            reader.seek(position)
+        tags[tag] = struct.unpack(endian + _TIFF_TYPE_FORMATS[value_type], data[:item_size])[0]
+    next_directory, = reader.unpack(endian + next_format)
+    if 256 not in tags or 257 not in tags:
+        raise ValueError('TIFF header has no dimensions')
+    bits = tags.get(258, 8)
+    return ImageInfo(tags[256], tags[257], tags.get(277, 1), max(1, bits // 8),
+                     322 in tags, next_directory != 0)
+
+# PNG colour types to channels; palette images are expanded to RGB
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+def read_png_header(f):
+    """Returns the ImageInfo of a PNG file, from its IHDR chunk"""
+    reader = _Reader(f)
+    reader.read(8)
+    length, chunk = reader.unpack('>I4s')
+    if chunk != 'IHDR':
+        raise ValueError('PNG has no IHDR chunk')
+    width, height, depth, color_type = reader.unpack('>IIBB')
+    return ImageInfo(width, height, _PNG_CHANNELS.get(color_type, 4), max(1, depth // 8))
+
+# JPEG start of frame markers; C4, C8 and CC are other segments
+_JPEG_SOF = set(range(0xc0, 0xd0)) - set([0xc4, 0xc8, 0xcc])
+
+def read_jpeg_header(f):
+    """Returns the ImageInfo of a JPEG file, from its start of frame segment"""
+    reader = _Reader(f)
+    reader.read(2)
+    while True:
+        marker = reader.read(1)
+        if marker != '\xff':
+            raise ValueError('JPEG segment not found')
+        code = ord(reader.read(1))
+        while code == 0xff:
+            code = ord(reader.read(1))
+        if code == 0xd8 or 0xd0 <= code <= 0xd7:
+            continue
+        if code == 0xda or code == 0xd9:
+            # the compressed image data starts without a frame header
+            raise ValueError('JPEG has no frame header')
+        length, = reader.unpack('>H')
+        if code in _JPEG_SOF:
+            precision, height, width, components = reader.unpack('>BHHB')
+            return ImageInfo(width, height, components, max(1, precision // 8))
+        reader.seek(f.tell() + length - 2)
+
+_HEADER_READERS = (('\x76\x2f\x31\x01', read_exr_header),
+                   ('II*\0', read_tiff_header),
+                   ('MM\0*', read_tiff_header),
+                   ('II+\0', read_tiff_header),
+                   ('MM\0+', read_tiff_header),
+                   ('\x89PNG', read_png_header),
+                   ('\xff\xd8', read_jpeg_header))
+
+def read_header(path):
+    """
+    Returns the ImageInfo of the image at path, whichever of the supported
+    formats it is in, or None if it isn't one of them or can't be read
+    """
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        magic = f.read(4)
+        for signature, reader in _HEADER_READERS:
+            if magic.startswith(signature):
+                f.seek(0)
+                try:
+                    return reader(f)
+                except (ValueError, struct.error, IOError):
+                    return None
+        return None
+    finally:
+        f.close()
+
+def default_cache_path():
+    """Returns the location of the header cache, from ZYNC_HEADER_CACHE or the user's home"""
+    path = os.environ.get('ZYNC_HEADER_CACHE')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.zync', 'image_headers.json')
+
+class HeaderCache(object):
+    """
+    The ImageInfos of images, by normalised path, valid while the size and
+    mtime of the file are unchanged. Saved as JSON to path, unless path is
+    False; entries not used for max_age are dropped.
+    """
+    def __init__(self, path=None, max_age=DEFAULT_MAX_AGE, clock=time.time):
+        if path is None:
+            path = default_cache_path()
+        self.path = path
+        self.max_age = max_age
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            f = open(self.path)
+            try:
+                return json.load(f).get('entries', {})
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            # an unreadable cache only means reading the headers again
+            return {}
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = self._read()
+
+    def get(self, path, size, mtime):
+        """Returns (True, ImageInfo or None) if path is cached with the size and mtime, else (False, None)"""
+        self._lock.acquire()
+        try:
+            self._load()
+            entry = self._entries.get(path)
+            if entry is None or entry['size'] != size or entry['mtime'] != mtime:
+                self.misses += 1
+                return (False, None)
+            entry['seen'] = self.clock()
+            self._dirty.add(path)
+            self.hits += 1
+            info = entry['info']
+        finally:
+            self._lock.release()
+        return (True, info and ImageInfo.from_dict(info))
+
+    def set(self, path, size, mtime, info):
+        entry = {'size': size, 'mtime': mtime, 'seen': self.clock(), 'info': info and info.to_dict()}
+        self._lock.acquire()
+        try:
+            self._load()
+            self._entries[path] = entry
+            self._dirty.add(path)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries = {}
+            self._dirty.clear()
+        finally:
+            self._lock.release()
+
+    def save(self):
+        """
+        Writes the entries changed since the last save, merged with those other
+        sessions saved meanwhile, dropping entries unused for max_age
+        """
+        if not self.path:
+            return
+        self._lock.acquire()
+        try:
+            if not self._dirty:
+                return
+            entries = self._read()
+            for key in self._dirty:
+                if key in self._entries:
+                    entries[key] = self._entries[key]
+            now = self.clock()
+            entries = dict([(k, e) for k, e in entries.items() if now - e['seen'] <= self.max_age])
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            temp = '%s.%d.tmp' % (self.path, os.getpid())
+            f = open(temp, 'w')
+            try:
+                json.dump({'version': 1, 'entries': entries}, f)
+            finally:
+                f.close()
+            if os.path.exists(self.path):
+                # os.rename doesn't replace an existing file on Windows
+                try:
+                    os.rename(temp, self.path)
+                except OSError:
+                    os.remove(self.path)
+                    os.rename(temp, self.path)
+            else:
+                os.rename(temp, self.path)
+            self._entries.update(entries)
+            self._dirty.clear()
+        finally:
+            self._lock.release()
+
+def read_headers(paths, cache=None, workers=DEFAULT_WORKERS):
+    """
+    Returns a dict of each path to its ImageInfo, or None if it is missing or
+    not a supported image, reading the headers not in the cache on a pool of
+    threads. Missing files are left out.
+    """
+    paths = list(paths)
+    results = {}
+    if not paths:
+        return results
+    tasks = Queue.Queue()
+    for path in paths:
+        tasks.put(path)
+    lock = threading.Lock()
+    def work():
+        while True:
+            try:
+                path = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            found, info = False, None
+            if cache is not None:
+                found, info = cache.get(path, st.st_size, st.st_mtime)
+            if not found:
+                info = read_header(path)
+                if cache is not None:
+                    cache.set(path, st.st_size, st.st_mtime, info)
+            lock.acquire()
+            results[path] = info
+            lock.release()
+    threads = [threading.Thread(target=work) for _ in range(min(max(1, workers), len(paths)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+class MemoryEstimate(object):
+    """
+    An estimate of a render's peak memory, in bytes, by where it goes.
+    textures lists (path, ImageInfo) for the images read and geometry
+    (path, size) for the geometry caches.
+    """
+    def __init__(self, base, framebuffers, textures, geometry, texture_cache=TEXTURE_CACHE_BYTES,
+                 headroom=HEADROOM):
+        self.base = base
+        self.framebuffers = framebuffers
+        self.textures = textures
+        self.geometry = geometry
+        self.texture_cache = texture_cache
+        self.headroom = headroom
+
+    @property
+    def untiled_texture_bytes(self):
+        return sum([info.bytes for path, info in self.textures if not info.tiled]) * MIPMAP_FACTOR
+
+    @property
+    def tiled_texture_bytes(self):
+        return sum([info.bytes * (info.mipmapped and MIPMAP_FACTOR or 1)
+                    for path, info in self.textures if info.tiled])
+
+    @property
+    def texture_bytes(self):
+        return self.untiled_texture_bytes + min(self.tiled_texture_bytes, self.texture_cache)
+
+    @property
+    def geometry_bytes(self):
+        return sum([size for path, size in self.geometry]) * GEOMETRY_FACTOR
+
+    @property
+    def total(self):
+        """Returns the estimated bytes in use, without headroom"""
+        return self.base + self.framebuffers + self.texture_bytes + self.geometry_bytes
+
+    @property
+    def peak_gb(self):
+        """Returns the memory to provision, with headroom, in GB"""
+        return self.total * self.headroom / GB
+
+    def largest_textures(self, limit=5):
+        return sorted(self.textures, key=lambda item: -item[1].bytes)[:limit]
+
+    def recommend(self, instance_types):
+        """
+        Returns the cheapest of the instance types, a list of
+        zync_planner.InstanceTypes or a dict in the form of zync.INSTANCE_TYPES,
+        with at least peak_gb of memory. Without one, returns the type with
+        the most memory; returns None if no type's memory is known.
+        """
+        if isinstance(instance_types, dict):
+            instance_types = zync_planner.instance_types_from_zync(instance_types)
+        known = [t for t in instance_types if t.memory_gb is not None]
+        if not known:
+            return None
+        adequate = [t for t in known if t.memory_gb >= self.peak_gb]
+        if not adequate:
+            return max(known, key=lambda t: (t.memory_gb, -t.cost_per_hour))
+        return min(adequate, key=lambda t: (t.memory_gb, t.cost_per_hour))
+
+    def to_dict(self):
+        return {'base': self.base,
+                'framebuffers': self.framebuffers,
+                'textures': self.texture_bytes,
+                'tiled_textures': self.tiled_texture_bytes,
+                'untiled_textures': self.untiled_texture_bytes,
+                'geometry': self.geometry_bytes,
+                'total': self.total,
+                'peak_gb': self.peak_gb,
+                'texture_count': len(self.textures),
+                'geometry_count': len(self.geometry)}
+
+    def format(self, instance_types=None):
+        """Returns a report of the estimate, with the recommended instance type if instance_types are given"""
+        def gb(value):
+            return '%.1f GB' % (value / GB)
+        lines = ['Estimated peak memory: %.1f GB (%s in use, plus %d%% headroom)' % (
+                     self.peak_gb, gb(self.total), round((self.headroom - 1) * 100)),
+                 '  Maya and renderer: %s' % gb(self.base),
+                 '  frame buffers:     %s' % gb(self.framebuffers),
+                 '  textures:          %s from %d images (%s tiled, %s cache)' % (
+                     gb(self.texture_bytes), len(self.textures), gb(self.tiled_texture_bytes),
+                     gb(self.texture_cache)),
+                 '  geometry caches:   %s from %d files' % (gb(self.geometry_bytes), len(self.geometry))]
+        for path, info in self.largest_textures():
+            lines.append('    %s  %dx%d x%d, %s' % (gb(info.bytes), info.width, info.height,
+                                                    info.channels, path))
+        if instance_types is not None:
+            recommended = self.recommend(instance_types)
+            if recommended is not None:
+                lines.append('Recommended instance type: %s (%s GB)' % (recommended.name,
+                                                                     recommended.memory_gb))
+        return '\n'.join(lines)
+
+def renderer_base_bytes(renderer=None):
+    """Returns the memory Maya and the renderer use before loading the scene"""
+    for name, extra in RENDERER_BASE_BYTES:
+        if renderer and name in renderer.lower():
+            return BASE_BYTES + extra
+    return BASE_BYTES
+
+def framebuffer_bytes(x_res, y_res, passes=0):
+    """Returns the memory of the frame buffers for the beauty and passes at the resolution"""
+    return int(x_res) * int(y_res) * (1 + passes) * FRAMEBUFFER_BYTES_PER_PIXEL * FRAMEBUFFER_COPIES
+
+def _split_refs(refs):
+    """
+    Returns the image paths whose headers are read and the geometry cache
+    paths from (path, node, attribute) references. Of an image sequence only
+    the first frame is kept, as one frame is loaded at a time, and of a
+    per-frame geometry cache only the largest.
+    """
+    images = []
+    geometry = []
+    for path, node, attribute in refs:
+        if isinstance(path, zync_sequences.FileSequence):
+            paths = list(path)
+            if not paths:
+                continue
+            extension = os.path.splitext(path.pattern)[1].lower()
+            if extension in GEOMETRY_EXTENSIONS:
+                geometry.append(paths)
+            elif path.kind == 'udim':
+                images.extend(paths)
+            else:
+                images.append(paths[0])
+        else:
+            if os.path.splitext(path)[1].lower() in GEOMETRY_EXTENSIONS:
+                geometry.append([path])
+            else:
+                images.append(path)
+    images = [path for path, node, attribute in zync_scan.dedupe(images)]
+    groups = {}
+    for group in geometry:
+        groups.setdefault(zync_scan.path_key(zync_scan.normalize_path(group[0])), group)
+    return images, groups.values()
+
+def _geometry_sizes(groups, workers):
+    """Returns (path, size) of the largest existing file of each group of geometry caches"""
+    paths = [(path, None, None) for group in groups for path in group]
+    sizes = dict([(r.path, r.size) for r in zync_scan.scan(paths, workers) if r.exists])
+    largest = []
+    for group in groups:
+        found = [(sizes[zync_scan.normalize_path(path)], path) for path in group
+                 if zync_scan.normalize_path(path) in sizes]
+        if found:
+            size, path = max(found)
+            largest.append((path, size))
+    return largest
+
+def estimate(refs, x_res, y_res, passes=0, renderer=None, cache=None, workers=DEFAULT_WORKERS,
+             texture_cache=TEXTURE_CACHE_BYTES, headroom=HEADROOM):
+    """
+    Returns the MemoryEstimate of a render of the files in refs, (path, node,
+    attribute) tuples as zync_maya.get_scene_file_refs() yields, at x_res by
+    y_res with the given number of passes, the most of any layer rendered.
+    Image headers are read through cache, a HeaderCache, which is saved
+    afterwards; pass False to read every header.
+    """
+    if cache is None:
+        cache = HeaderCache()
+    images, geometry = _split_refs(refs)
+    headers = read_headers(images, cache or None, workers)
+    if cache:
+        try:
+            cache.save()
+        except (IOError, OSError), e:
+            print 'Could not save the image header cache: %s' % e
+    textures = [(path, headers[path]) for path in images if headers.get(path) is not None]
+    return MemoryEstimate(renderer_base_bytes(renderer), framebuffer_bytes(x_res, y_res, passes),
+                          textures, _geometry_sizes(geometry, workers), texture_cache, headroom)
+
+def estimate_ma(path, renderer=None, workers=DEFAULT_WORKERS, cache=None):
+    """Returns the MemoryEstimate of a Maya ASCII scene, read without Maya by zync_ma"""
+    import zync_ma
+    scene = zync_ma.parse(path)
+    if renderer is None:
+        renderer = zync_ma.get_renderer(scene)
+    x_res = scene.get_attr('defaultResolution.width', 640)
+    y_res = scene.get_attr('defaultResolution.height', 480)
+    passes = [len(zync_ma.get_pass_names(scene, renderer, layer))
+              for layer in zync_ma.get_render_layers(scene)]
+    return estimate(zync_ma.get_scene_file_refs(scene), x_res, y_res, max(passes or [0]),
+                    renderer, cache, workers)
+
+def _parse_instance_type(value):
+    """Parses NAME=GB into an instance type for the command line"""
+    name, sep, memory = value.partition('=')
+    if not sep:
+        raise ValueError('Instance types are given as NAME=GB, not %r' % value)
+    return zync_planner.InstanceType(name, memory_gb=float(memory))
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] --scene SCENE.ma | FILE [FILE...]')
+    parser.add_option('--scene', help='a Maya ASCII scene to estimate, read without Maya')
+    parser.add_option('-x', '--x-res', type='int', default=1920, help='the render width')
+    parser.add_option('-y', '--y-res', type='int', default=1080, help='the render height')
+    parser.add_option('-p', '--passes', type='int', default=0, help='the number of passes')
+    parser.add_option('-r', '--renderer', help='the renderer')
+    parser.add_option('-t', '--instance-type', action='append', default=[],
+                      help='an instance type to choose from, as NAME=GB')
+    parser.add_option('-w', '--workers', type='int', default=DEFAULT_WORKERS, help='headers read at once')
+    parser.add_option('--no-cache', action='store_true', help='read every header, ignoring the cache')
+    parser.add_option('--json', action='store_true', help='print the estimate as JSON')
+    options, args = parser.parse_args(argv)
+    if not args and not options.scene:
+        parser.error('no scene or files given')
+    try:
+        instance_types = [_parse_instance_type(t) for t in options.instance_type]
+    except ValueError, e:
+        parser.error(str(e))
+
+    cache = options.no_cache and False or None
+    if options.scene:
+        result = estimate_ma(options.scene, options.renderer, options.workers, cache)
+    else:
+        refs = [(zync_sequences.expand(path.replace('\\', '/')), None, None) for path in args]
+        result = estimate(refs, options.x_res, options.y_res, options.passes, options.renderer,
+                          cache, options.workers)
+    if options.json:
+        data = result.to_dict()
+        if instance_types:
+            recommended = result.recommend(instance_types)
+            data['recommended'] = recommended and recommended.name
+        print json.dumps(data, indent=2, sort_keys=True)
+    else:
+        print result.format(instance_types or None)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
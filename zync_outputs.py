@@ -0,0 +1,247 @@
+"""
+ZYNC Output Manifests
+
+Plans the files a render job will write: every layer, pass and frame, from
+the scene's output prefixes and the renderer's naming rules. The manifest is
+stored compactly as one OutputSequence per layer and pass, a path pattern
+plus a zync_frames.FrameSet, so a long job with many passes stays small.
+
+The manifest gives the folders to create before a job's frames are
+downloaded, the files to expect when verifying a download, and can be
+saved as JSON for other tools.
+
+Naming follows the renderers:
+    V-Ray              <prefix>.<frame>.<ext>, and each render element in a
+                       folder of its own, <dir>/<pass>/<name>.<pass>.<frame>.<ext>
+    mental ray and     <prefix>.<frame>.<ext>, with <RenderPass> in the prefix
+    Maya Software      naming the pass, or <dir>/<pass>/<name>.<frame>.<ext>
+                       without it
+
+Usage:
+    import zync_outputs
+    manifest = zync_outputs.plan_outputs('/shows/a/images', scene_info, ['bg', 'fg'],
+                                         zync_frames.parse('1001-1100'), 'vray', scene='shot010')
+    zync_outputs.create_directories(manifest.directories())
+    manifest.write('/shows/a/images/zync_manifest_shot010.json')
+
+"""
+
+import errno
+import json
+import os
+
+import zync_frames
+import zync_tokens
+
+# the renderers' naming rules; callers map the zync module's renderer names to these
+VRAY_RENDERER = 'vray'
+MENTAL_RAY_RENDERER = 'mr'
+SOFTWARE_RENDERER = 'sw'
+
+MASTER_LAYER = 'masterLayer'
+DEFAULT_PREFIX = '<Scene>'
+
+class OutputSequence(object):
+    """
+    The frames one layer and pass writes: head + padded frame number + tail,
+    for each frame in frames
+    """
+    __slots__ = ('layer', 'pass_name', 'head', 'tail', 'padding', 'frames')
+
+    def __init__(self, layer, pass_name, head, tail, padding, frames):
+        self.layer = layer
+        self.pass_name = pass_name
+        self.head = head
+        self.tail = tail
+        self.padding = padding
+        self.frames = frames
+
+    @property
+    def directory(self):
+        return os.path.dirname(self.head)
+
+    @property
+    def pattern(self):
+        """Returns the path with the frame number replaced by #s"""
+        return self.head + '#' * self.padding + self.tail
+
+    def path(self, frame):
+        if frame < 0:
+            return '%s-%0*d%s' % (self.head, self.padding, -frame, self.tail)
+        return '%s%0*d%s' % (self.head, self.padding, frame, self.tail)
+
+    def __iter__(self):
+        path = self.path
+        for frame in self.frames:
+            yield path(frame)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def to_dict(self):
+        return {'layer': self.layer, 'pass': self.pass_name, 'head': self.head, 'tail': self.tail,
+                'padding': self.padding, 'frames': self.frames.to_string()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['layer'], data['pass'], data['head'], data['tail'], data['padding'],
+                   zync_frames.parse(data['frames']))
+
+    def __repr__(self):
+        return 'OutputSequence(%r, [%s])' % (self.pattern, self.frames)
+
+class OutputManifest(object):
+    """The OutputSequences a job is expected to write"""
+    def __init__(self, sequences=()):
+        self.sequences = list(sequences)
+
+    def __iter__(self):
+        return iter(self.sequences)
+
+    def __len__(self):
+        """Returns the number of files expected"""
+        return sum([len(sequence) for sequence in self.sequences])
+
+    def paths(self):
+        """Yields every expected file path"""
+        for sequence in self.sequences:
+            for path in sequence:
+                yield path
+
+    def layers(self):
+        layers = []
+        for sequence in self.sequences:
+            if sequence.layer not in layers:
+                layers.append(sequence.layer)
+        return layers
+
+    def by_directory(self):
+        """Returns a dict of each output folder to the sequences written to it"""
+        directories = {}
+        for sequence in self.sequences:
+            directories.setdefault(sequence.directory, []).append(sequence)
+        return directories
+
+    def directories(self):
+        """
+        Returns the sorted output folders, leaving out any that are the parent
+        of another, as creating the deepest folders creates their parents
+        """
+        unique = sorted(set([os.path.normpath(s.directory) for s in self.sequences if s.directory]))
+        leaves = []
+        for i, directory in enumerate(unique):
+            # in sorted order, a folder's children directly follow it
+            if i + 1 < len(unique) and unique[i+1].startswith(directory.rstrip(os.sep) + os.sep):
+                continue
+            leaves.append(directory)
+        return leaves
+
+    def to_dict(self):
+        return {'version': 1, 'sequences': [sequence.to_dict() for sequence in self.sequences]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([OutputSequence.from_dict(s) for s in data['sequences']])
+
+    def write(self, path):
+        """Writes the manifest as JSON"""
+        f = open(path, 'w')
+        try:
+            json.dump(self.to_dict(), f, indent=1)
+        finally:
+            f.close()
+        return path
+
+    @classmethod
+    def load(cls, path):
+        f = open(path)
+        try:
+            return cls.from_dict(json.load(f))
+        finally:
+            f.close()
+
+def _short_camera(camera):
+    # Maya names outputs after the camera's transform, without its namespace
+    if not camera:
+        return None
+    return camera.split('|')[-1].split(':')[-1]
+
+def plan_outputs(out_path, scene_info, layers, frames, renderer, scene=None, camera=None):
+    """
+    Returns the OutputManifest for rendering layers over frames, a
+    zync_frames.FrameSet, to out_path. scene_info holds the 'file_prefix',
+    'layer_passes', 'padding' and 'extension' gathered from the scene; scene
+    and camera fill in the <Scene> and <Camera> tokens.
+    """
+    global_prefix = scene_info['file_prefix'][0] or DEFAULT_PREFIX
+    layer_prefixes = {}
+    for prefixes in scene_info['file_prefix'][1:]:
+        layer_prefixes.update(prefixes)
+    layer_passes = scene_info.get('layer_passes') or {}
+    padding = int(scene_info.get('padding') or 1)
+    tail = '.%s' % scene_info['extension']
+
+    tokens = {}
+    if scene:
+        tokens['Scene'] = scene
+    if camera:
+        tokens['Camera'] = _short_camera(camera)
+
+    sequences = []
+    for layer in layers:
+        prefix = layer_prefixes.get(layer) or global_prefix
+        layer_name = MASTER_LAYER if layer == 'defaultRenderLayer' else layer
+        layer_tokens = dict(tokens)
+        layer_tokens['Layer'] = layer_tokens['RenderLayer'] = layer_name
+        passes = layer_passes.get(layer) or []
+
+        if renderer == VRAY_RENDERER:
+            base = os.path.join(out_path, zync_tokens.expand_file_tokens(prefix, layer_tokens, True))
+            sequences.append(OutputSequence(layer, None, base + '.', tail, padding, frames))
+            directory, name = os.path.split(base)
+            for pass_name in passes:
+                head = os.path.join(directory, pass_name, '%s.%s.' % (name, pass_name))
+                sequences.append(OutputSequence(layer, pass_name, head, tail, padding, frames))
+        elif renderer in (MENTAL_RAY_RENDERER, SOFTWARE_RENDERER) and passes:
+            for pass_name in passes:
+                pass_tokens = dict(layer_tokens)
+                pass_tokens['RenderPass'] = pass_name
+                base = os.path.join(out_path, zync_tokens.expand_file_tokens(prefix, pass_tokens, True))
+                if '<RenderPass>' not in prefix:
+                    # without the token, each pass is written to a folder of its own
+                    directory, name = os.path.split(base)
+                    base = os.path.join(directory, pass_name, name)
+                sequences.append(OutputSequence(layer, pass_name, base + '.', tail, padding, frames))
+        else:
+            base = os.path.join(out_path, zync_tokens.expand_file_tokens(prefix, layer_tokens, True))
+            sequences.append(OutputSequence(layer, None, base + '.', tail, padding, frames))
+    return OutputManifest(sequences)
+
+def create_directories(directories):
+    """
+    Creates the folders and any missing parents in one pass, checking each
+    shared parent only once. Returns the list of folders created.
+    """
+    known = set()
+    created = []
+    for directory in directories:
+        missing = []
+        current = os.path.normpath(directory)
+        while current and current not in known:
+            if os.path.isdir(current):
+                known.add(current)
+                break
+            missing.append(current)
+            parent = os.path.dirname(current)
+            if parent == current:
+                break
+            current = parent
+        for path in reversed(missing):
+            try:
+                os.mkdir(path)
+                created.append(path)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            known.add(path)
+    return created
@@ -0,0 +1,206 @@
+"""
+ZYNC Path Mapping
+
+Applies path mappings locally, as (from, to) prefix pairs like those given
+to zync.Zync.add_path_mappings, so a scene's dependencies can be checked
+against them before a job is submitted rather than on the farm.
+
+Mappings are held in a trie of path components, so mapping a path costs one
+step per folder however many mappings there are, and the longest matching
+prefix wins: with /mnt and /mnt/projects both mapped, /mnt/projects/a.tif
+uses the second. Prefixes match whole folders only, so /mnt/proj doesn't
+match /mnt/projects. Paths and prefixes are normalised as zync_scan does,
+with Windows drive and UNC paths compared case-insensitively. The match for
+each folder is remembered, so the many files of a folder cost one lookup.
+
+Usage:
+    import zync_pathmap
+    mapper = zync_pathmap.PathMapper([('Z:/projects', '/mnt/projects')])
+    mapper.map('z:\\projects\\a\\tex.tif')    # '/mnt/projects/a/tex.tif'
+    report = mapper.map_refs(zync_maya.get_scene_file_refs())
+    report.unmapped
+
+From the command line, with one path per line on stdin or in a file:
+    python zync_pathmap.py -m Z:/projects=/mnt/projects paths.txt
+
+"""
+
+import optparse
+import sys
+
+import zync_scan
+
+# the folder matches remembered, cleared when there are more
+DEFAULT_CACHE_SIZE = 100000
+
+class _Node(object):
+    __slots__ = ('children', 'mapping')
+
+    def __init__(self):
+        self.children = {}
+        self.mapping = None
+
+class PathMapReport(object):
+    """The mapped and unmapped paths of a bulk mapping"""
+    def __init__(self):
+        # (path, mapped path, (from, to)) for each mapped path
+        self.mapped = []
+        # (path, node, attribute) for each path no mapping matched
+        self.unmapped = []
+
+    def counts(self):
+        """Returns a dict of each (from, to) mapping to the number of paths it mapped"""
+        counts = {}
+        for path, mapped, mapping in self.mapped:
+            counts[mapping] = counts.get(mapping, 0) + 1
+        return counts
+
+    def format(self, max_unmapped=20):
+        lines = ['%d paths mapped, %d unmapped' % (len(self.mapped), len(self.unmapped))]
+        for (source, dest), count in sorted(self.counts().items()):
+            lines.append('  %s -> %s: %d' % (source, dest, count))
+        for path, node, attribute in self.unmapped[:max_unmapped]:
+            if node:
+                lines.append('  unmapped: %s (%s.%s)' % (path, node, attribute))
+            else:
+                lines.append('  unmapped: %s' % path)
+        if len(self.unmapped) > max_unmapped:
+            lines.append('  ... and %d more unmapped' % (len(self.unmapped) - max_unmapped))
+        return '\n'.join(lines)
+
+class PathMapper(object):
+    """
+    Maps paths by the longest matching prefix of a list of (from, to)
+    mappings. A prefix given twice keeps its first mapping, as zync does.
+    case_insensitive forces how paths are compared, see zync_scan.path_key.
+    """
+    def __init__(self, mappings=(), case_insensitive=None, cache_size=DEFAULT_CACHE_SIZE):
+        self.case_insensitive = case_insensitive
+        self.cache_size = cache_size
+        self.mappings = []
+        self._root = _Node()
+        self._cache = {}
+        for source, dest in mappings:
+            self.add(source, dest)
+
+    def _components(self, path):
+        components = zync_scan.path_key(path, self.case_insensitive).split('/')
+        if len(components) > 1 and not components[-1]:
+            # the root folder, /
+            components.pop()
+        return components
+
+    def add(self, source, dest):
+        """Adds a mapping of the source prefix to dest"""
+        source = zync_scan.normalize_path(source)
+        components = self._components(source)
+        node = self._root
+        for component in components:
+            node = node.children.setdefault(component, _Node())
+        if node.mapping is None:
+            node.mapping = (source, dest, len(components))
+            self.mappings.append((source, dest))
+            self._cache.clear()
+
+    def _match_folder(self, key):
+        """
+        Returns the longest mapping matching the folder key, and the trie node
+        at the folder itself, or None if the folder is off the trie
+        """
+        result = self._cache.get(key)
+        if result is not None:
+            return result
+        node = self._root
+        best = node.mapping
+        for component in key.split('/'):
+            node = node.children.get(component)
+            if node is None:
+                break
+            if node.mapping is not None:
+                best = node.mapping
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        result = self._cache[key] = (best, node)
+        return result
+
+    def match(self, path):
+        """
+        Returns the (from, to, depth) of the longest mapping matching the
+        normalised path, depth being the number of components in from, or None
+        """
+        key = zync_scan.path_key(path, self.case_insensitive)
+        if '/' in key:
+            folder, name = key.rsplit('/', 1)
+            best, node = self._match_folder(folder)
+        else:
+            name = key
+            best, node = self._root.mapping, self._root
+        if node is not None:
+            # a mapping of the file itself
+            child = node.children.get(name)
+            if child is not None and child.mapping is not None:
+                return child.mapping
+        return best
+
+    def map(self, path):
+        """Returns the mapped path, or None if no mapping matches"""
+        path = zync_scan.normalize_path(path)
+        return self._apply(path, self.match(path))
+
+    def _apply(self, path, mapping):
+        if mapping is None:
+            return None
+        source, dest, depth = mapping
+        rest = path.split('/')[depth:]
+        if not rest:
+            return dest
+        separator = '\\' if '\\' in dest and '/' not in dest else '/'
+        return dest.rstrip('/\\') + separator + separator.join(rest)
+
+    def map_refs(self, refs):
+        """
+        Maps every unique path of (path, node, attribute) references, plain
+        paths or zync_sequences.FileSequences, as get_scene_file_refs() and
+        get_scene_files() yield, returning a PathMapReport
+        """
+        report = PathMapReport()
+        for path, node, attribute in zync_scan.dedupe(refs, self.case_insensitive):
+            mapping = self.match(path)
+            if mapping is None:
+                report.unmapped.append((path, node, attribute))
+                continue
+            report.mapped.append((path, self._apply(path, mapping), mapping[:2]))
+        return report
+
+def parse_mapping(text):
+    """Returns the (from, to) of a 'from=to' mapping"""
+    source, _, dest = text.partition('=')
+    if not source or not dest:
+        raise ValueError('Path mappings are given as from=to, not %r' % text)
+    return (source, dest)
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog -m FROM=TO [-m FROM=TO...] [PATHS_FILE]\n\n'
+                                   'Maps the paths in PATHS_FILE, or on stdin, one per line.')
+    parser.add_option('-m', '--map', action='append', default=[], help='a path mapping, as FROM=TO')
+    parser.add_option('-v', '--verbose', action='store_true', help='print every mapped path')
+    options, args = parser.parse_args(argv)
+    try:
+        mapper = PathMapper([parse_mapping(m) for m in options.map])
+    except ValueError, e:
+        parser.error(str(e))
+
+    f = open(args[0]) if args else sys.stdin
+    try:
+        report = mapper.map_refs([line.rstrip('\r\n') for line in f if line.strip()])
+    finally:
+        if args:
+            f.close()
+    if options.verbose:
+        for path, mapped, mapping in report.mapped:
+            print '%s -> %s' % (path, mapped)
+    print report.format()
+    return 1 if report.unmapped else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""
+ZYNC Job Planner
+
+Proposes a chunk size, instance count and instance type for a render job.
+Each candidate plan is evaluated by splitting every layer's frames into
+chunks and scheduling the chunks, longest first, onto the instances; the
+resulting wall-clock time and billed instance time are then compared:
+
+    * with max_cost, the fastest plan costing no more than max_cost
+    * with deadline, the cheapest plan finishing within deadline seconds
+    * otherwise, the fastest plan costing at most DEFAULT_COST_SLACK more
+      than the cheapest one
+
+Frame times default to a rough estimate from the resolution, renderer and
+pass count. Pass measured times per frame, for all layers or per layer, for
+anything better than a first guess.
+
+This module has no dependency on Maya.
+
+Usage:
+    import zync_planner
+    plan = zync_planner.plan_job('1001-1100', ['bg', 'fg'], 1920, 1080,
+                                 zync.INSTANCE_TYPES, renderer='vray')
+    plan.chunk_size, plan.num_instances, plan.instance_type.name
+
+"""
+
+import heapq
+import math
+import re
+
+import zync_frames
+
+# seconds to render one 1920x1080 frame of a single layer on an 8 core instance
+DEFAULT_FRAME_SECONDS = 300.0
+REFERENCE_PIXELS = 1920 * 1080
+REFERENCE_CORES = 8
+
+# relative time per frame, matched against the renderer name
+RENDERER_FACTORS = (('vray', 1.0),
+                    ('mental', 1.2),
+                    ('mr', 1.2),
+                    ('soft', 0.6),
+                    ('sw', 0.6))
+
+# each extra pass adds this fraction to the frame time
+PASS_FACTOR = 0.1
+
+# time to boot an instance, and to open the scene for each chunk
+INSTANCE_STARTUP = 300.0
+CHUNK_STARTUP = 60.0
+
+# instances are billed in increments of this many seconds
+BILLING_INCREMENT = 60.0
+
+DEFAULT_COST_SLACK = 0.2
+DEFAULT_MAX_INSTANCES = 100
+
+_CORES_REGEX = re.compile(r'(\d+)\s*(?:-\s*)?core', re.I)
+_MEMORY_REGEX = re.compile(r'(\d+(?:\.\d+)?)\s*GB', re.I)
+
+class InstanceType(object):
+    """An instance type, with the figures the planner needs"""
+    __slots__ = ('name', 'label', 'cores', 'memory_gb', 'cost_per_hour')
+
+    def __init__(self, name, label=None, cores=REFERENCE_CORES, memory_gb=None, cost_per_hour=None):
+        self.name = name
+        self.label = label or name
+        self.cores = cores
+        self.memory_gb = memory_gb
+        if cost_per_hour is None:
+            # without real prices, cost is proportional to the number of cores
+            cost_per_hour = float(cores)
+        self.cost_per_hour = cost_per_hour
+
+    @property
+    def speed(self):
+        """Returns frame throughput relative to the reference instance"""
+        return (float(self.cores) / REFERENCE_CORES) ** 0.9
+
+    def __repr__(self):
+        return 'InstanceType(%r, cores=%r, cost_per_hour=%r)' % (self.name, self.cores, self.cost_per_hour)
+
+def instance_types_from_zync(instance_types):
+    """
+    Returns InstanceTypes for a dict in the form of zync.INSTANCE_TYPES.
+    Cores and memory come from 'cores'/'memory' keys if present, otherwise
+    from the description, e.g. '16 core, 60GB'. Cost comes from a 'cost' or
+    'cost_per_hour' key if present.
+    """
+    types = []
+    for name in sorted(instance_types):
+        info = instance_types[name]
+        description = info.get('description', '') or ''
+        cores = info.get('cores')
+        if cores is None:
+            match = _CORES_REGEX.search(description) or _CORES_REGEX.search(name)
+            cores = int(match.group(1)) if match else REFERENCE_CORES
+        memory = info.get('memory')
+        if memory is None:
+            match = _MEMORY_REGEX.search(description)
+            memory = float(match.group(1)) if match else None
+        cost = info.get('cost_per_hour', info.get('cost'))
+        types.append(InstanceType(name, info.get('csp_label', name), int(cores), memory,
+                                  cost is not None and float(cost) or None))
+    return types
+
+class Plan(object):
+    """A proposed chunk size, instance count and instance type, with its estimated time and cost"""
+    __slots__ = ('instance_type', 'num_instances', 'chunk_size', 'tasks', 'wall_seconds', 'cost')
+
+    def __init__(self, instance_type, num_instances, chunk_size, tasks, wall_seconds, cost):
+        self.instance_type = instance_type
+        self.num_instances = num_instances
+        self.chunk_size = chunk_size
+        self.tasks = tasks
+        self.wall_seconds = wall_seconds
+        self.cost = cost
+
+    def __repr__(self):
+        return 'Plan(%s x%d, chunk_size=%d, %d tasks, %.0fs, cost %.2f)' % (
+            self.instance_type.name, self.num_instances, self.chunk_size,
+            self.tasks, self.wall_seconds, self.cost)
+
+def count_frames(frange, step=1):
+    """
+    Returns the number of frames in a zync_frames.FrameSet or a frame spec
+    like 1001-1100, 1,5,10-20 or 1001-1100x2
+    """
+    if isinstance(frange, zync_frames.FrameSet):
+        return len(frange)
+    return len(zync_frames.FrameSet.parse(frange, step))
+
+def estimate_frame_seconds(x_res, y_res, renderer=None, passes=0):
+    """Returns a rough render time for one frame of one layer on the reference instance"""
+    pixels = max(1, int(x_res) * int(y_res))
+    factor = 1.0
+    for name, renderer_factor in RENDERER_FACTORS:
+        if renderer and name in renderer.lower():
+            factor = renderer_factor
+            break
+    return DEFAULT_FRAME_SECONDS * factor * (float(pixels) / REFERENCE_PIXELS) * (1.0 + PASS_FACTOR * passes)
+
+def _chunk_candidates(frames):
+    candidates = set([frames])
+    for size in (1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20, 25, 30, 40, 50, 75, 100, 150, 200, 300, 500):
+        if size < frames:
+            candidates.add(size)
+    return sorted(candidates)
+
+def _instance_candidates(tasks, max_instances):
+    limit = max(1, min(tasks, max_instances))
+    candidates = set([limit])
+    n = 1
+    while n < limit:
+        candidates.add(n)
+        n = max(n + 1, int(n * 1.25))
+    return sorted(candidates)
+
+def _billed(seconds):
+    return math.ceil(seconds / BILLING_INCREMENT) * BILLING_INCREMENT
+
+def _schedule(durations, num_instances):
+    """
+    Returns (makespan, billed_seconds) for task durations, a dict of
+    duration to task count, scheduled longest first onto num_instances
+    instances. Instances that run out of tasks shut down, so they are only
+    billed for their own busy time.
+
+    Chunks mostly share a handful of lengths, so instead of placing tasks
+    one at a time this keeps the instances grouped by load and hands out
+    whole rounds of equal tasks to the least loaded group, as long as it
+    stays the least loaded.
+    """
+    loads = [(0.0, num_instances)]
+    for duration in sorted(durations, reverse=True):
+        tasks = durations[duration]
+        while tasks:
+            load, count = heapq.heappop(loads)
+            while loads and loads[0][0] == load:
+                count += heapq.heappop(loads)[1]
+            if tasks < count:
+                heapq.heappush(loads, (load + duration, tasks))
+                heapq.heappush(loads, (load, count - tasks))
+                break
+            rounds = tasks // count
+            if loads:
+                rounds = min(rounds, int((loads[0][0] - load) // duration) + 1)
+            heapq.heappush(loads, (load + rounds * duration, count))
+            tasks -= rounds * count
+    makespan = max([load for load, count in loads])
+    billed = 0.0
+    for load, count in loads:
+        if load:
+            billed += count * _billed(INSTANCE_STARTUP + load)
+    return INSTANCE_STARTUP + makespan, billed
+
+def _chunk_durations(layer_frames, layer_seconds, instance_type, chunk_size):
+    """Returns a dict of task duration to task count for the layers split into chunks"""
+    durations = {}
+    for layer, frames in layer_frames.items():
+        frame_seconds = layer_seconds[layer] / instance_type.speed
+        full, rest = divmod(frames, chunk_size)
+        for chunk_frames, count in ((chunk_size, full), (rest, 1)):
+            if chunk_frames and count:
+                duration = CHUNK_STARTUP + chunk_frames * frame_seconds
+                durations[duration] = durations.get(duration, 0) + count
+    return durations
+
+def _plan(instance_type, chunk_size, durations, num_instances):
+    wall, billed = _schedule(durations, num_instances)
+    cost = billed / 3600.0 * instance_type.cost_per_hour
+    return Plan(instance_type, num_instances, chunk_size, sum(durations.values()), wall, cost)
+
+def evaluate(layer_frames, layer_seconds, instance_type, chunk_size, num_instances):
+    """
+    Returns the Plan for rendering layer_frames (a dict of layer to frame
+    count) in chunks of chunk_size on num_instances of instance_type, with
+    layer_seconds giving the reference time per frame for each layer.
+    """
+    durations = _chunk_durations(layer_frames, layer_seconds, instance_type, chunk_size)
+    return _plan(instance_type, chunk_size, durations, num_instances)
+
+def candidate_plans(layer_frames, layer_seconds, instance_types, max_instances=DEFAULT_MAX_INSTANCES):
+    """
+    Yields a Plan for every combination the planner considers. Instance
+    counts for a chunk size stop once the job takes no longer than its
+    longest chunk, since more instances can't finish it any sooner.
+    """
+    most_frames = max(layer_frames.values())
+    for instance_type in instance_types:
+        for chunk_size in _chunk_candidates(most_frames):
+            durations = _chunk_durations(layer_frames, layer_seconds, instance_type, chunk_size)
+            fastest = INSTANCE_STARTUP + max(durations)
+            for num_instances in _instance_candidates(sum(durations.values()), max_instances):
+                plan = _plan(instance_type, chunk_size, durations, num_instances)
+                yield plan
+                if plan.wall_seconds <= fastest:
+                    break
+
+def choose(plans, max_cost=None, deadline=None, cost_slack=DEFAULT_COST_SLACK):
+    """Returns the best of the plans for the given limits, or None if none meet them"""
+    plans = list(plans)
+    if not plans:
+        return None
+    if deadline is not None:
+        in_time = [p for p in plans if p.wall_seconds <= deadline]
+        if not in_time:
+            return None
+        return min(in_time, key=lambda p: (p.cost, p.wall_seconds))
+    if max_cost is None:
+        max_cost = min([p.cost for p in plans]) * (1.0 + cost_slack)
+    affordable = [p for p in plans if p.cost <= max_cost]
+    if not affordable:
+        return None
+    return min(affordable, key=lambda p: (p.wall_seconds, p.cost))
+
+def with_memory(instance_types, min_memory_gb):
+    """
+    Returns the instance types with at least min_memory_gb of memory, or
+    whose memory isn't known. If none has enough, returns those with the
+    most memory.
+    """
+    adequate = [t for t in instance_types if t.memory_gb is None or t.memory_gb >= min_memory_gb]
+    if adequate:
+        return adequate
+    most = max([t.memory_gb for t in instance_types])
+    return [t for t in instance_types if t.memory_gb == most]
+
+def plan_job(frange, layers, x_res, y_res, instance_types, step=1, renderer=None, layer_passes=None,
+             frame_seconds=None, max_cost=None, deadline=None, max_instances=DEFAULT_MAX_INSTANCES,
+             min_memory_gb=None):
+    """
+    Returns the best Plan for the job, or None if no plan meets max_cost or
+    deadline. frange is a zync_frames.FrameSet or a frame spec.
+
+    instance_types is either a list of InstanceTypes or a dict in the form of
+    zync.INSTANCE_TYPES. layer_passes optionally maps layers to their passes.
+    frame_seconds is the measured time per frame on an 8 core instance,
+    either a single number or a dict of layer to seconds; layers without a
+    measurement are estimated. min_memory_gb, as from zync_memory, rules out
+    instance types with less memory.
+    """
+    if isinstance(instance_types, dict):
+        instance_types = instance_types_from_zync(instance_types)
+    if not instance_types:
+        raise ValueError('No instance types to plan for')
+    if min_memory_gb is not None:
+        instance_types = with_memory(instance_types, min_memory_gb)
+    layers = list(layers) or ['defaultRenderLayer']
+    frames = count_frames(frange, step)
+    if frames < 1:
+        raise ValueError('No frames to render in %r' % (frange,))
+
+    layer_passes = layer_passes or {}
+    layer_frames = {}
+    layer_seconds = {}
+    for layer in layers:
+        layer_frames[layer] = frames
+        if isinstance(frame_seconds, dict) and layer in frame_seconds:
+            layer_seconds[layer] = float(frame_seconds[layer])
+        elif frame_seconds is not None and not isinstance(frame_seconds, dict):
+            layer_seconds[layer] = float(frame_seconds)
+        else:
+            layer_seconds[layer] = estimate_frame_seconds(x_res, y_res, renderer,
+                                                          len(layer_passes.get(layer, [])))
+
+    plans = candidate_plans(layer_frames, layer_seconds, instance_types, max_instances)
+    return choose(plans, max_cost, deadline)
@@ -0,0 +1,491 @@
+"""
+ZYNC Preflight Checks
+
+Checks a scene for problems that would otherwise only show up after its
+files are uploaded and machines are started: missing, empty or unreadable
+dependencies, an unsaved scene, a bad frame range, cameras that won't
+render, layers with no passes, output padding too short for the frames or
+an unknown extension, and files outside the path mappings.
+
+Checks are functions of a PreflightContext, yielding CheckResults with a
+severity. Those that wait on storage, like the dependency checks, run on
+their own threads, and stat files concurrently; the others run on the
+calling thread. A PreflightReport is kept in a cache for a few minutes, by
+a fingerprint of everything the checks look at, so opening the submit
+dialog again doesn't repeat them.
+
+Nothing in this module touches Maya. zync_maya.run_preflight() checks the
+open scene; from the command line, .ma files are checked without Maya,
+read by zync_ma:
+    python zync_preflight.py -m Z:/projects=/mnt/projects shot010.ma
+
+Other checks can be registered:
+    import zync_preflight
+    def check_names(context):
+        if ' ' in context.scene_path:
+            yield zync_preflight.CheckResult('names', zync_preflight.WARNING, 'The scene path has spaces')
+    zync_preflight.register(zync_preflight.Check('names', check_names))
+
+"""
+
+import hashlib
+import json
+import optparse
+import os
+import re
+import sys
+import threading
+import time
+import Queue
+
+import zync_frames
+import zync_ma
+import zync_outputs
+import zync_pathmap
+import zync_scan
+import zync_session
+
+ERROR = 'error'
+WARNING = 'warning'
+INFO = 'info'
+SEVERITIES = (ERROR, WARNING, INFO)
+
+DEFAULT_CACHE_TTL = 5 * 60
+
+# the image extensions renderers write, as get_scene_info() cuts them to 3 letters
+IMAGE_EXTENSIONS = set(['exr', 'png', 'tif', 'iff', 'jpg', 'tga', 'bmp', 'psd', 'dpx', 'cin',
+                        'hdr', 'sgi', 'gif', 'pic', 'rla', 'als', 'eps', 'yuv', 'dds', 'vri'])
+
+# the render params the checks look at
+CHECKED_PARAMS = ('frange', 'step', 'camera', 'selected_layers', 'upload_only', 'renderer')
+
+_COPY_NUMBER_REGEX = re.compile(r'\{\d+\}$')
+
+def _digest(data):
+    return hashlib.md5(json.dumps(data, sort_keys=True, default=str)).hexdigest()
+
+class CheckResult(object):
+    """A problem a check found, or a note about the scene"""
+    __slots__ = ('check', 'severity', 'message', 'path', 'node', 'attribute')
+
+    def __init__(self, check, severity, message, path=None, node=None, attribute=None):
+        self.check = check
+        self.severity = severity
+        self.message = message
+        self.path = path
+        self.node = node
+        self.attribute = attribute
+
+    def to_dict(self):
+        return {'check': self.check, 'severity': self.severity, 'message': self.message,
+                'path': self.path, 'node': self.node, 'attribute': self.attribute}
+
+    def format(self):
+        text = '%s: %s' % (self.severity.upper(), self.message)
+        if self.path:
+            text += ': %s' % self.path
+        if self.node:
+            text += ' (%s.%s)' % (self.node, self.attribute) if self.attribute else ' (%s)' % self.node
+        return text
+
+    def __repr__(self):
+        return 'CheckResult(%r, %r, %r)' % (self.check, self.severity, self.message)
+
+class PreflightContext(object):
+    """
+    What the checks look at. refs are the (path, node, attribute) references
+    of the scene's files and references the paths of its reference files.
+    params are render params as SubmitWindow.get_render_params() returns
+    them; renderer is their renderer as a zync_outputs renderer name.
+    scene_frames is the (start, end) of the scene's render range. snapshot
+    is whether the scene is submitted as a snapshot of its unsaved state.
+    """
+    def __init__(self, scene_path, refs=(), references=(), scene_info=None, params=None,
+                 renderer=None, cameras=(), scene_frames=None, path_mappings=(),
+                 modified=False, snapshot=False, workers=zync_scan.DEFAULT_WORKERS):
+        self.scene_path = scene_path
+        self.refs = list(refs)
+        self.references = [_COPY_NUMBER_REGEX.sub('', r) for r in references]
+        self.scene_info = scene_info or {}
+        self.params = params or {}
+        self.renderer = renderer
+        self.cameras = list(cameras)
+        self.scene_frames = scene_frames
+        self.path_mappings = list(path_mappings)
+        self.modified = modified
+        self.snapshot = snapshot
+        self.workers = workers
+        self.use_cache = True
+        self._records = None
+        self._lock = threading.Lock()
+
+    def dependencies(self):
+        """Returns the (path, node, attribute) references of the scene's files and reference files"""
+        return self.refs + [(path, None, None) for path in self.references]
+
+    def records(self):
+        """
+        Returns the zync_scan.FileRecords of the scene's dependencies, stat'ed
+        concurrently, or from the cache if the same dependencies were stat'ed
+        in the last few minutes
+        """
+        self._lock.acquire()
+        try:
+            if self._records is None:
+                dependencies = self.dependencies()
+                key = ('records', _digest([[str(p), n, a] for p, n, a in dependencies]))
+                self._records = cache.get(key) if self.use_cache else None
+                if self._records is None:
+                    self._records = zync_scan.scan(dependencies, self.workers)
+                    cache.set(key, self._records)
+            return self._records
+        finally:
+            self._lock.release()
+
+    def layers(self):
+        """Returns the layers to render: the selected layers, or all of the scene's"""
+        return self.params.get('selected_layers') or list(self.scene_info.get('render_layers') or [])
+
+    def fingerprint(self):
+        """Returns a digest of everything the checks look at"""
+        try:
+            st = os.stat(self.scene_path)
+            scene_file = [st.st_size, st.st_mtime]
+        except (OSError, TypeError):
+            scene_file = None
+        params = [(k, self.params.get(k)) for k in CHECKED_PARAMS]
+        return _digest([self.scene_path, scene_file, self.modified, self.snapshot, self.renderer,
+                        params, self.scene_info, self.cameras, self.scene_frames, self.path_mappings,
+                        [[str(p), n, a] for p, n, a in self.refs], self.references])
+
+class Check(object):
+    """
+    A named check: fn(context) yields CheckResults. io_bound checks run on
+    threads of their own.
+    """
+    def __init__(self, name, fn, io_bound=False, description=''):
+        self.name = name
+        self.fn = fn
+        self.io_bound = io_bound
+        self.description = description
+
+    def run(self, context):
+        """Returns the check's results, with an error result if it fails"""
+        try:
+            return list(self.fn(context) or [])
+        except Exception, e:
+            return [CheckResult(self.name, ERROR, 'The check failed: %s: %s' % (e.__class__.__name__, e))]
+
+class PreflightReport(object):
+    """The results of a run of checks, ordered by severity, and the time each check took"""
+    def __init__(self, results=(), timings=None, fingerprint=None, created=None):
+        order = dict([(s, i) for i, s in enumerate(SEVERITIES)])
+        self.results = sorted(results, key=lambda r: order.get(r.severity, len(order)))
+        self.timings = dict(timings or {})
+        self.fingerprint = fingerprint
+        self.created = created or time.time()
+        self.cached = False
+
+    def by_severity(self, severity):
+        return [r for r in self.results if r.severity == severity]
+
+    @property
+    def errors(self):
+        return self.by_severity(ERROR)
+
+    @property
+    def warnings(self):
+        return self.by_severity(WARNING)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def counts(self):
+        counts = dict.fromkeys(SEVERITIES, 0)
+        for result in self.results:
+            counts[result.severity] = counts.get(result.severity, 0) + 1
+        return counts
+
+    def to_dict(self):
+        return {'results': [r.to_dict() for r in self.results],
+                'counts': self.counts(),
+                'timings': self.timings,
+                'cached': self.cached}
+
+    def format(self, max_per_check=10):
+        """Returns a report of the results, at most max_per_check of each check and severity"""
+        counts = self.counts()
+        lines = ['Preflight: %d errors, %d warnings, %d notes%s' % (
+            counts[ERROR], counts[WARNING], counts[INFO], ' (cached)' if self.cached else '')]
+        shown = {}
+        hidden = {}
+        for result in self.results:
+            key = (result.check, result.severity)
+            shown[key] = shown.get(key, 0) + 1
+            if shown[key] > max_per_check:
+                hidden[key] = hidden.get(key, 0) + 1
+                continue
+            lines.append('  ' + result.format())
+        for (check, severity), count in sorted(hidden.items()):
+            lines.append('  ... and %d more %ss from %s' % (count, severity, check))
+        return '\n'.join(lines)
+
+def check_scene(context):
+    """The scene is saved and on disk, and what is uploaded is what is open"""
+    path = context.scene_path
+    if not path or path == 'unknown':
+        yield CheckResult('scene', ERROR, 'The scene has never been saved')
+        return
+    if not os.path.isfile(path):
+        yield CheckResult('scene', ERROR, 'The scene file is missing', path)
+    elif context.modified and not context.snapshot:
+        yield CheckResult('scene', WARNING, 'The scene has unsaved changes, which will not be rendered', path)
+
+def check_dependencies(context):
+    """Every dependency exists, isn't empty and can be read"""
+    existing = []
+    for record in context.records():
+        if not record.exists:
+            yield CheckResult('dependencies', ERROR, 'Missing file', record.path, record.node, record.attribute)
+        elif record.size == 0:
+            yield CheckResult('dependencies', WARNING, 'Empty file', record.path, record.node, record.attribute)
+        else:
+            existing.append(record)
+    for record in _concurrent_filter(lambda r: not os.access(r.path, os.R_OK), existing, context.workers):
+        yield CheckResult('dependencies', ERROR, 'Unreadable file', record.path, record.node, record.attribute)
+
+def check_frame_range(context):
+    """The frame range parses, isn't empty, and is within the scene's range"""
+    frange = context.params.get('frange')
+    if frange is None:
+        return
+    try:
+        frames = zync_frames.FrameSet.parse(str(frange), int(context.params.get('step') or 1))
+    except (zync_frames.FrameSetError, ValueError), e:
+        yield CheckResult('frame_range', ERROR, 'Invalid frame range %s: %s' % (frange, e))
+        return
+    numbers = list(frames)
+    if not numbers:
+        yield CheckResult('frame_range', ERROR, 'The frame range %s has no frames' % frange)
+    elif context.scene_frames:
+        start, end = context.scene_frames
+        outside = len([n for n in numbers if n < start or n > end])
+        if outside:
+            yield CheckResult('frame_range', WARNING, '%d frames are outside the scene\'s frame range %d-%d' % (
+                outside, start, end))
+
+def check_cameras(context):
+    """There is a renderable camera, and the chosen one is renderable"""
+    if context.params.get('upload_only'):
+        return
+    camera = context.params.get('camera')
+    if not context.cameras:
+        yield CheckResult('cameras', ERROR, 'No camera is renderable')
+    elif camera and camera not in context.cameras:
+        yield CheckResult('cameras', WARNING, 'The camera %s isn\'t renderable' % camera, node=camera)
+
+def check_layers(context):
+    """The layers to render exist, and have passes where the renderer writes them"""
+    if context.params.get('upload_only'):
+        return
+    render_layers = context.scene_info.get('render_layers')
+    layers = context.layers()
+    if not layers:
+        yield CheckResult('layers', ERROR, 'No render layers are selected')
+    layer_passes = context.scene_info.get('layer_passes') or {}
+    for layer in layers:
+        if render_layers is not None and layer not in render_layers:
+            yield CheckResult('layers', ERROR, 'The render layer %s isn\'t in the scene' % layer, node=layer)
+        elif layer in layer_passes and not layer_passes[layer]:
+            yield CheckResult('layers', INFO, 'The render layer %s renders no passes' % layer, node=layer)
+
+def check_output_naming(context):
+    """The padding fits the frame numbers, and the extension is an image format"""
+    if context.params.get('upload_only') or not context.scene_info:
+        return
+    padding = context.scene_info.get('padding')
+    frange = context.params.get('frange')
+    if padding and frange:
+        try:
+            frames = zync_frames.FrameSet.parse(str(frange), int(context.params.get('step') or 1))
+            longest = max([len(str(abs(n))) for n in frames] or [0])
+        except (zync_frames.FrameSetError, ValueError):
+            longest = 0
+        if longest > padding:
+            yield CheckResult('output_naming', WARNING,
+                              'Frame numbers have up to %d digits but are padded to %d' % (longest, padding))
+    extension = context.scene_info.get('extension')
+    if extension is not None and extension.lower() not in IMAGE_EXTENSIONS:
+        yield CheckResult('output_naming', WARNING, 'The output extension %r isn\'t a known image format' % extension)
+
+def check_path_mappings(context):
+    """Every dependency is under a mapped folder, when there are path mappings"""
+    if not context.path_mappings:
+        return
+    mapper = zync_pathmap.PathMapper(context.path_mappings)
+    report = mapper.map_refs([(context.scene_path, None, None)] + context.dependencies())
+    for path, node, attribute in report.unmapped:
+        yield CheckResult('path_mappings', WARNING, 'Not under a mapped folder', path, node, attribute)
+
+def _concurrent_filter(predicate, items, workers):
+    """Returns the items predicate is true of, calling it on a pool of threads"""
+    items = list(items)
+    if not items:
+        return []
+    tasks = Queue.Queue()
+    for i, item in enumerate(items):
+        tasks.put((i, item))
+    matches = []
+    lock = threading.Lock()
+    def work():
+        while True:
+            try:
+                i, item = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                matched = predicate(item)
+            except Exception:
+                matched = True
+            if matched:
+                lock.acquire()
+                matches.append((i, item))
+                lock.release()
+    threads = [threading.Thread(target=work) for _ in range(min(max(1, workers), len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [item for i, item in sorted(matches)]
+
+DEFAULT_CHECKS = [Check('scene', check_scene, io_bound=True),
+                  Check('dependencies', check_dependencies, io_bound=True),
+                  Check('frame_range', check_frame_range),
+                  Check('cameras', check_cameras),
+                  Check('layers', check_layers),
+                  Check('output_naming', check_output_naming),
+                  Check('path_mappings', check_path_mappings)]
+
+checks = list(DEFAULT_CHECKS)
+
+# recent reports, by the fingerprint of their context, and file records
+cache = zync_session.TTLCache(DEFAULT_CACHE_TTL)
+
+def register(check):
+    """Adds a check to those run by default, replacing any of the same name"""
+    for i, existing in enumerate(checks):
+        if existing.name == check.name:
+            checks[i] = check
+            return check
+    checks.append(check)
+    return check
+
+def run(context, selected=None, use_cache=True):
+    """
+    Runs the checks, by default every registered one, and returns a
+    PreflightReport. A report of the same checks on an identical context
+    from the last few minutes is returned from the cache, with cached set;
+    without use_cache, the checks run and files are stat'ed again.
+    """
+    if selected is None:
+        selected = list(checks)
+    fingerprint = ('report', context.fingerprint(), tuple([c.name for c in selected]))
+    context.use_cache = use_cache
+    if use_cache:
+        report = cache.get(fingerprint)
+        if report is not None:
+            report.cached = True
+            return report
+
+    results = {}
+    timings = {}
+    def run_check(check):
+        start = time.time()
+        results[check.name] = check.run(context)
+        timings[check.name] = time.time() - start
+
+    threads = []
+    for check in selected:
+        if check.io_bound:
+            thread = threading.Thread(target=run_check, args=(check,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+    for check in selected:
+        if not check.io_bound:
+            run_check(check)
+    for thread in threads:
+        thread.join()
+
+    report = PreflightReport(sum([results[c.name] for c in selected], []), timings, fingerprint)
+    cache.set(fingerprint, report)
+    return report
+
+def context_for_ma(path, renderer=None, params=None, path_mappings=(), workers=zync_scan.DEFAULT_WORKERS):
+    """Returns a PreflightContext for a Maya ASCII file, read without Maya by zync_ma"""
+    scene = zync_ma.parse(path)
+    if renderer is None:
+        renderer = zync_ma.get_renderer(scene) or zync_outputs.SOFTWARE_RENDERER
+    start = scene.get_attr('defaultRenderGlobals.startFrame', 1)
+    end = scene.get_attr('defaultRenderGlobals.endFrame', 10)
+    cameras = zync_ma.get_renderable_cameras(scene)
+    params = dict(params or {})
+    params.setdefault('frange', '%d-%d' % (int(start), int(end)))
+    params.setdefault('step', int(scene.get_attr('defaultRenderGlobals.byFrameStep', 1)))
+    params.setdefault('camera', cameras[0] if cameras else '')
+    refs = zync_ma.get_scene_file_refs(scene)
+    scene_info = zync_ma.get_scene_info(scene, renderer, refs=refs)
+    return PreflightContext(path, refs, scene_info['references'],
+                            scene_info, params, renderer, cameras, (int(start), int(end)),
+                            path_mappings, workers=workers)
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] SCENE.ma [SCENE.ma...]')
+    parser.add_option('-r', '--renderer', choices=[zync_outputs.VRAY_RENDERER, zync_outputs.MENTAL_RAY_RENDERER,
+                                                   zync_outputs.SOFTWARE_RENDERER],
+                      help="the renderer, by default the scene's")
+    parser.add_option('-f', '--frames', help="the frame range, by default the scene's")
+    parser.add_option('-c', '--camera', help='the camera to render')
+    parser.add_option('-l', '--layer', action='append', dest='layers', help='a layer to render, by default all')
+    parser.add_option('-m', '--map', action='append', default=[], help='a path mapping, as FROM=TO')
+    parser.add_option('-w', '--workers', type='int', default=zync_scan.DEFAULT_WORKERS, help='concurrent file checks')
+    parser.add_option('--max-results', type='int', default=10, help='results shown per check')
+    parser.add_option('--json', action='store_true', help='print each report as JSON')
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error('no scenes given')
+    try:
+        mappings = [zync_pathmap.parse_mapping(m) for m in options.map]
+    except ValueError, e:
+        parser.error(str(e))
+
+    params = {}
+    if options.frames:
+        params['frange'] = options.frames
+    if options.camera:
+        params['camera'] = options.camera
+    if options.layers:
+        params['selected_layers'] = options.layers
+
+    failed = 0
+    for path in args:
+        try:
+            context = context_for_ma(path, options.renderer, params, mappings, options.workers)
+        except (IOError, OSError), e:
+            failed += 1
+            print '%s: %s' % (path, e)
+            continue
+        report = run(context, use_cache=False)
+        if not report.ok:
+            failed += 1
+        if options.json:
+            print json.dumps(dict(report.to_dict(), scene=path))
+        else:
+            print '%s:' % path
+            print report.format(options.max_results)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,529 @@
+"""
+ZYNC Submission Queue
+
+A durable local queue of submissions that could not reach ZYNC, sent again
+in the background until they go through. Each QueuedSubmission is a JSON
+file in the queue folder, ~/.zync/queue unless ZYNC_QUEUE_DIR is set,
+written to a temporary file and renamed into place, so a crash never
+leaves half a job. A job holds everything needed to submit it again without
+the scene open: the scene path, layers, params with their scene_info, path
+mappings and username. The password is never written; it is given again
+when the queue is resumed.
+
+Identical submissions share a key, and a job's file is named after it, so
+queueing the same submission twice keeps one job.
+
+A QueueWorker drains the queue, submitting the jobs that are due at most
+max_concurrent at a time. A job that fails again is retried after a delay
+that doubles with each attempt, up to max_delay; one rejected by ZYNC,
+failing with one of permanent_errors or out of attempts is marked failed.
+Several sessions can drain one queue: each job is claimed with a lock file
+before it is sent. Nothing in this module touches Maya or the zync module.
+
+Usage:
+    import zync_queue
+    queue = zync_queue.SubmissionQueue()
+    job = queue.enqueue(scene_path, layers, params, path_mappings, username)
+    worker = zync_queue.QueueWorker(queue, submit).start()
+    print queue.format()
+
+From the command line:
+    python zync_queue.py status
+    python zync_queue.py retry JOB
+    python zync_queue.py cancel JOB
+    python zync_queue.py purge
+
+"""
+
+import hashlib
+import json
+import optparse
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import Queue
+
+QUEUED = 'queued'
+RETRYING = 'retrying'
+SUBMITTING = 'submitting'
+DONE = 'done'
+FAILED = 'failed'
+PENDING = (QUEUED, RETRYING, SUBMITTING)
+
+DEFAULT_MAX_CONCURRENT = 2
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_BASE_DELAY = 30.0
+DEFAULT_MAX_DELAY = 30 * 60.0
+
+# a claim older than this is left over from a session that died mid-submit;
+# a live session renews its claims while it submits
+CLAIM_TIMEOUT = 10 * 60.0
+CLAIM_RENEWAL = CLAIM_TIMEOUT / 4
+
+def default_queue_dir():
+    """Returns the queue folder, from ZYNC_QUEUE_DIR or the user's home"""
+    path = os.environ.get('ZYNC_QUEUE_DIR')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.zync', 'queue')
+
+def submission_key(scene_path, layers, params):
+    """Returns the key identical submissions share"""
+    data = json.dumps([scene_path, layers, params], sort_keys=True)
+    return hashlib.sha1(data).hexdigest()[:16]
+
+def backoff_delay(attempts, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, jitter=random.random):
+    """
+    Returns the seconds to wait after the given number of failed attempts:
+    base_delay doubled for each attempt after the first, up to max_delay,
+    less up to a fifth so sessions that failed together don't retry together
+    """
+    delay = min(max_delay, base_delay * 2 ** max(0, attempts - 1))
+    return delay * (1.0 - 0.2 * jitter())
+
+def _write_json(path, data):
+    """Writes data to path as JSON through a temporary file, so readers never see half of it"""
+    temp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident or 0)
+    f = open(temp, 'w')
+    try:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    try:
+        os.rename(temp, path)
+    except OSError:
+        # os.rename doesn't replace an existing file on Windows
+        os.remove(path)
+        os.rename(temp, path)
+
+class QueuedSubmission(object):
+    """A fully resolved submission waiting in the queue, and the state of its attempts"""
+    fields = ('id', 'scene_path', 'layers', 'params', 'path_mappings', 'username', 'status',
+              'attempts', 'created', 'updated', 'next_attempt', 'last_error', 'response')
+
+    def __init__(self, id, scene_path, layers, params, path_mappings=(), username=None, status=QUEUED,
+                 attempts=0, created=None, updated=None, next_attempt=0.0, last_error=None, response=None):
+        self.id = id
+        self.scene_path = scene_path
+        self.layers = layers
+        self.params = params
+        self.path_mappings = [tuple(m) for m in path_mappings]
+        self.username = username
+        self.status = status
+        self.attempts = attempts
+        self.created = created if created is not None else time.time()
+        self.updated = updated if updated is not None else self.created
+        self.next_attempt = next_attempt
+        self.last_error = last_error
+        self.response = response
+
+    @property
+    def pending(self):
+        return self.status in PENDING
+
+    def due(self, now):
+        return self.status in (QUEUED, RETRYING) and self.next_attempt <= now
+
+    def to_dict(self):
+        data = dict([(name, getattr(self, name)) for name in self.fields])
+        data['path_mappings'] = [list(m) for m in self.path_mappings]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**dict([(name, data.get(name)) for name in cls.fields if name in data]))
+
+    def format(self, now=None):
+        if now is None:
+            now = time.time()
+        line = '%s  %-10s %d attempts  %s' % (self.id, self.status, self.attempts, self.scene_path)
+        if self.status == RETRYING:
+            line += '  (next in %ds)' % max(0, self.next_attempt - now)
+        if self.last_error and self.status != DONE:
+            line += '\n    %s' % self.last_error
+        return line
+
+    def __repr__(self):
+        return 'QueuedSubmission(%r, %r, %r)' % (self.id, self.scene_path, self.status)
+
+class SubmissionQueue(object):
+    """The queue folder, a JSON file per job"""
+    def __init__(self, directory=None, clock=time.time):
+        self.directory = directory or default_queue_dir()
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, '%s.json' % job_id)
+
+    def _claim_path(self, job_id):
+        return os.path.join(self.directory, '%s.claim' % job_id)
+
+    def save(self, job):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # another session created it first
+                if not os.path.isdir(self.directory):
+                    raise
+        job.updated = self.clock()
+        _write_json(self._path(job.id), job.to_dict())
+
+    def get(self, job_id):
+        """Returns the job, or None if it isn't queued or its file can't be read"""
+        try:
+            f = open(self._path(job_id))
+            try:
+                return QueuedSubmission.from_dict(json.load(f))
+            finally:
+                f.close()
+        except (IOError, ValueError, TypeError):
+            return None
+
+    def ids(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [name[:-5] for name in os.listdir(self.directory) if name.endswith('.json')]
+
+    def jobs(self, statuses=None):
+        """Returns the jobs, oldest first, optionally only those with one of the statuses"""
+        jobs = [job for job in [self.get(job_id) for job_id in self.ids()] if job is not None]
+        if statuses is not None:
+            jobs = [job for job in jobs if job.status in statuses]
+        jobs.sort(key=lambda job: job.created)
+        return jobs
+
+    def pending_count(self):
+        """Returns the number of jobs waiting to be sent"""
+        return len(self.jobs(PENDING))
+
+    def enqueue(self, scene_path, layers, params, path_mappings=(), username=None, error=None):
+        """
+        Queues a submission, returning its QueuedSubmission. An identical
+        submission already waiting is returned as it is instead. error, the
+        reason the submission is queued, counts as its first attempt.
+        """
+        job_id = submission_key(scene_path, layers, params)
+        self._lock.acquire()
+        try:
+            existing = self.get(job_id)
+            if existing is not None and existing.pending:
+                return existing
+            job = QueuedSubmission(job_id, scene_path, layers, params, path_mappings, username,
+                                   created=self.clock())
+            if error is not None:
+                job.attempts = 1
+                job.status = RETRYING
+                job.last_error = error
+                job.next_attempt = self.clock() + backoff_delay(1)
+            self.save(job)
+            return job
+        finally:
+            self._lock.release()
+
+    def claim(self, job):
+        """
+        Takes the job for this session, returning False if another session
+        holds it. Claims left by sessions that died are taken over after
+        CLAIM_TIMEOUT.
+        """
+        path = self._claim_path(job.id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            try:
+                if self.clock() - os.path.getmtime(path) < CLAIM_TIMEOUT:
+                    return False
+                os.remove(path)
+            except OSError:
+                return False
+            return self.claim(job)
+        try:
+            os.write(fd, '%s %d' % (socket.gethostname(), os.getpid()))
+        finally:
+            os.close(fd)
+        return True
+
+    def renew(self, job):
+        """Marks this session's claim on the job as still held"""
+        now = self.clock()
+        try:
+            os.utime(self._claim_path(job.id), (now, now))
+        except OSError:
+            pass
+
+    def release(self, job):
+        try:
+            os.remove(self._claim_path(job.id))
+        except OSError:
+            pass
+
+    def remove(self, job_id):
+        """Takes the job out of the queue, returning whether it was there"""
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            return False
+        return True
+
+    def recover(self):
+        """
+        Requeues the jobs left submitting by a session that died, which hold
+        no claim or a stale one. ZYNC may or may not have received them.
+        Returns their number.
+        """
+        recovered = 0
+        for job in self.jobs((SUBMITTING,)):
+            if not self.claim(job):
+                continue
+            try:
+                job.status = RETRYING
+                job.last_error = 'Interrupted while submitting'
+                job.next_attempt = 0.0
+                self.save(job)
+                recovered += 1
+            finally:
+                self.release(job)
+        return recovered
+
+    def retry(self, job_id):
+        """Queues a failed job to be sent again with a fresh set of attempts, returning it"""
+        job = self.get(job_id)
+        if job is None or job.status == DONE:
+            return None
+        job.status = QUEUED
+        job.attempts = 0
+        job.next_attempt = 0.0
+        self.save(job)
+        return job
+
+    def purge(self, statuses=(DONE,)):
+        """Removes the jobs with the statuses, returning their number"""
+        removed = 0
+        for job in self.jobs(statuses):
+            if self.remove(job.id):
+                removed += 1
+        return removed
+
+    def status(self):
+        """Returns a dict of each status to its number of jobs"""
+        counts = dict([(status, 0) for status in PENDING + (DONE, FAILED)])
+        for job in self.jobs():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def format(self):
+        """Returns a report of the queue's jobs"""
+        jobs = self.jobs()
+        counts = self.status()
+        lines = ['%d queued submissions: %s' % (len(jobs), ', '.join(
+            ['%d %s' % (counts[s], s) for s in PENDING + (DONE, FAILED) if counts.get(s)]) or 'none')]
+        now = self.clock()
+        for job in jobs:
+            lines.append('  ' + job.format(now).replace('\n', '\n  '))
+        return '\n'.join(lines)
+
+class QueueWorker(object):
+    """
+    Sends the queue's due jobs with submit(job), which returns ZYNC's
+    response or raises. A response whose 'code' isn't 0 is a rejection, and
+    fails the job; so does an error in permanent_errors. Other errors are
+    retried with backoff until max_attempts. accept(job), if given, picks
+    the jobs this worker may send, such as those of users it has passwords
+    for.
+    """
+    def __init__(self, queue, submit, max_concurrent=DEFAULT_MAX_CONCURRENT, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, permanent_errors=(),
+                 accept=None, poll_interval=5.0, on_result=None, claim_renewal=CLAIM_RENEWAL):
+        self.queue = queue
+        self.submit = submit
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.permanent_errors = tuple(permanent_errors)
+        self.accept = accept or (lambda job: True)
+        self.poll_interval = poll_interval
+        # on_result(job) is called once a job is done or failed
+        self.on_result = on_result
+        self.claim_renewal = claim_renewal
+        self.sent = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._woken = False
+        self._finished = False
+
+    def _attempt(self, listed):
+        if not self.queue.claim(listed):
+            return
+        try:
+            # the file may have changed since it was listed
+            job = self.queue.get(listed.id)
+            if job is None or not job.due(self.queue.clock()):
+                return
+            job.status = SUBMITTING
+            job.attempts += 1
+            self.queue.save(job)
+            # a slow submit mustn't look like a session that died to recover()
+            submitted = threading.Event()
+            def renew():
+                while not submitted.wait(self.claim_renewal):
+                    self.queue.renew(listed)
+            renewer = threading.Thread(target=renew, name='ZyncQueueClaim')
+            renewer.daemon = True
+            renewer.start()
+            try:
+                response = self.submit(job)
+            except self.permanent_errors, e:
+                job.status = FAILED
+                job.last_error = str(e) or e.__class__.__name__
+            except Exception, e:
+                job.last_error = str(e) or e.__class__.__name__
+                if job.attempts >= self.max_attempts:
+                    job.status = FAILED
+                else:
+                    job.status = RETRYING
+                    job.next_attempt = self.queue.clock() + backoff_delay(job.attempts, self.base_delay,
+                                                                          self.max_delay)
+            else:
+                job.response = response
+                if isinstance(response, dict) and response.get('code', 0) != 0:
+                    job.status = FAILED
+                    job.last_error = 'Rejected by ZYNC: %s' % response.get('response')
+                else:
+                    job.status = DONE
+                    job.last_error = None
+            finally:
+                submitted.set()
+                renewer.join()
+            self.queue.save(job)
+            if job.status == DONE:
+                self.sent += 1
+            elif job.status == FAILED:
+                self.failed += 1
+            if job.status in (DONE, FAILED) and self.on_result is not None:
+                self.on_result(job)
+        finally:
+            self.queue.release(listed)
+
+    def run_once(self):
+        """Sends the jobs due now, max_concurrent at a time, returning how many were attempted"""
+        now = self.queue.clock()
+        due = [job for job in self.queue.jobs() if job.due(now) and self.accept(job)]
+        if not due:
+            return 0
+        tasks = Queue.Queue()
+        for job in due:
+            tasks.put(job)
+        def work():
+            while not self._stop.is_set():
+                try:
+                    job = tasks.get_nowait()
+                except Queue.Empty:
+                    return
+                self._attempt(job)
+        threads = [threading.Thread(target=work) for _ in range(min(self.max_concurrent, len(due)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(due)
+
+    def run(self):
+        """Sends jobs as they fall due until none this worker accepts are waiting, or stop() is called"""
+        self.queue.recover()
+        try:
+            while not self._stop.is_set():
+                self.run_once()
+                waiting = [job for job in self.queue.jobs((QUEUED, RETRYING)) if self.accept(job)]
+                self._lock.acquire()
+                try:
+                    if not waiting and not self._woken:
+                        self._finished = True
+                        return
+                    self._woken = False
+                finally:
+                    self._lock.release()
+                if waiting:
+                    delay = min([job.next_attempt for job in waiting]) - self.queue.clock()
+                    self._stop.wait(max(0.0, min(delay, self.poll_interval)))
+        finally:
+            self._finished = True
+
+    def wake(self):
+        """
+        Tells the worker jobs were added, so it looks again before stopping.
+        Returns False if it has already stopped, and a new one is needed.
+        """
+        self._lock.acquire()
+        try:
+            if self._finished:
+                return False
+            self._woken = True
+            return True
+        finally:
+            self._lock.release()
+
+    def start(self):
+        """Runs the worker on a background thread, returning it"""
+        self._thread = threading.Thread(target=self.run, name='ZyncQueue')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] status | retry JOB... | cancel JOB... | purge')
+    parser.add_option('--queue', help='queue folder, defaults to %s' % default_queue_dir())
+    parser.add_option('--all', action='store_true', help='purge failed jobs as well as sent ones')
+    parser.add_option('--json', action='store_true', help='print the status as JSON')
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error('a command is required')
+
+    queue = SubmissionQueue(options.queue)
+    command = args[0]
+    if command == 'status':
+        if options.json:
+            print json.dumps({'counts': queue.status(), 'jobs': [job.to_dict() for job in queue.jobs()]},
+                             indent=2, sort_keys=True)
+        else:
+            print queue.format()
+    elif command in ('retry', 'cancel'):
+        if len(args) < 2:
+            parser.error('%s needs at least one job' % command)
+        for job_id in args[1:]:
+            if command == 'retry' and queue.retry(job_id) is not None:
+                print 'Requeued %s' % job_id
+            elif command == 'cancel' and queue.remove(job_id):
+                print 'Cancelled %s' % job_id
+            else:
+                print 'No such job: %s' % job_id
+    elif command == 'purge':
+        statuses = options.all and (DONE, FAILED) or (DONE,)
+        print 'Removed %d jobs' % queue.purge(statuses)
+    else:
+        parser.error('unknown command: %s' % command)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
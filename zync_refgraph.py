@@ -0,0 +1,361 @@
+"""
+ZYNC Reference Graph
+
+The graph of a scene's references, nested references included, with the
+files each reference file depends on. Each unique reference file appears
+once however many times it is referenced, so an asset referenced 50 times
+is walked and scanned once, and its files are listed once.
+
+The dependencies of a reference file are kept in a DependencyCache keyed by
+the path, size and mtime of the file and of the files it is nested in, and
+by the project and scene folder relative paths are found in, so an
+unchanged asset isn't scanned again in this session or, as the cache is
+saved to disk, in the next ones for max_age. The cache holds the paths as
+the asset's nodes give them, with sequences, tiles and caches as patterns,
+so the files on disk are still listed on each scan. The graph is built from Maya
+by zync_maya.get_reference_graph(); nothing in this module touches Maya.
+
+Usage:
+    graph = zync_maya.get_reference_graph()
+    graph.files()                   # every file, deduplicated, for uploads
+    graph.pulled_in('/assets/rig.ma')   # the files the rig brings in
+    graph.owners()                  # which references use each file
+    print graph.format()
+
+"""
+
+import json
+import os
+import threading
+import time
+
+import zync_scan
+import zync_sequences
+
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+# caches saved with another version are ignored
+CACHE_VERSION = 2
+
+def default_cache_path():
+    """Returns the location of the cache, from ZYNC_REFERENCE_CACHE or the user's home"""
+    path = os.environ.get('ZYNC_REFERENCE_CACHE')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.zync', 'reference_deps.json')
+
+def file_key(path):
+    """Returns the (path, size, mtime) a reference file's dependencies are cached by, or None if it is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (zync_scan.normalize_path(path), st.st_size, st.st_mtime)
+
+def _dump_ref(ref):
+    path, node, attribute = ref
+    if isinstance(path, zync_sequences.FileSequence):
+        path = {'head': path.head, 'tail': path.tail, 'padding': path.padding,
+                'kind': path.kind, 'runs': path.runs}
+    return [path, node, attribute]
+
+def _load_ref(data):
+    path, node, attribute = data
+    if isinstance(path, dict):
+        sequence = zync_sequences.FileSequence(path['head'], path['tail'], path['padding'], path['kind'])
+        sequence.runs = tuple([tuple(run) for run in path['runs']])
+        path = sequence
+    return (path, node, attribute)
+
+class DependencyCache(object):
+    """
+    The unexpanded (path, node, attribute) references of reference files,
+    keyed by a chain of file_key()s from the outermost reference file in and
+    the zync_deps.DependencyContext they were scanned with. Saved as JSON to
+    path, unless path is False; entries not used for max_age are dropped.
+    """
+    def __init__(self, path=None, max_age=DEFAULT_MAX_AGE, clock=time.time):
+        if path is None:
+            path = default_cache_path()
+        self.path = path
+        self.max_age = max_age
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _key(self, chain, context=None):
+        folders = [context.workspace, context.scene_dir] if context is not None else None
+        return json.dumps([folders, [list(key) for key in chain]])
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            f = open(self.path)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            # an unreadable cache is only a slower scan
+            return {}
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+            return {}
+        return data.get('entries', {})
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = self._read()
+
+    def get(self, chain, context=None):
+        """Returns the cached references for the chain of file keys and the context, or None"""
+        key = self._key(chain, context)
+        self._lock.acquire()
+        try:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None or self.clock() - entry['seen'] > self.max_age:
+                self.misses += 1
+                return None
+            entry['seen'] = self.clock()
+            self._dirty.add(key)
+            self.hits += 1
+            refs = entry['refs']
+        finally:
+            self._lock.release()
+        return [_load_ref(ref) for ref in refs]
+
+    def set(self, chain, refs, context=None):
+        key = self._key(chain, context)
+        entry = {'seen': self.clock(), 'refs': [_dump_ref(ref) for ref in refs]}
+        self._lock.acquire()
+        try:
+            self._load()
+            self._entries[key] = entry
+            self._dirty.add(key)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries = {}
+            self._dirty.clear()
+        finally:
+            self._lock.release()
+
+    def save(self):
+        """
+        Writes the entries changed since the last save, merged with those other
+        sessions saved meanwhile, dropping entries unused for max_age
+        """
+        if not self.path:
+            return
+        self._lock.acquire()
+        try:
+            if not self._dirty:
+                return
+            entries = self._read()
+            for key in self._dirty:
+                if key in self._entries:
+                    entries[key] = self._entries[key]
+            now = self.clock()
+            entries = dict([(k, e) for k, e in entries.items() if now - e['seen'] <= self.max_age])
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            temp = '%s.%d.tmp' % (self.path, os.getpid())
+            f = open(temp, 'w')
+            try:
+                json.dump({'version': CACHE_VERSION, 'entries': entries}, f)
+            finally:
+                f.close()
+            if os.path.exists(self.path):
+                # os.rename doesn't replace an existing file on Windows
+                try:
+                    os.rename(temp, self.path)
+                except OSError:
+                    os.remove(self.path)
+                    os.rename(temp, self.path)
+            else:
+                os.rename(temp, self.path)
+            self._entries.update(entries)
+            self._dirty.clear()
+        finally:
+            self._lock.release()
+
+class ReferenceFile(object):
+    """
+    A file referenced one or more times. files are the references of its own
+    nodes, not those of its nested references; instance_files holds the
+    references of instances whose reference edits change their files.
+    """
+    __slots__ = ('path', 'instances', 'unloaded', 'parents', 'children', 'files',
+                 'instance_files', 'cached')
+
+    def __init__(self, path):
+        self.path = path
+        self.instances = []
+        self.unloaded = set()
+        self.parents = []
+        self.children = []
+        self.files = []
+        self.instance_files = {}
+        self.cached = False
+
+    @property
+    def loaded(self):
+        return len(self.unloaded) < len(self.instances)
+
+    def own_files(self):
+        """Returns the references of the file and of each of its edited instances"""
+        refs = list(self.files)
+        for instance in sorted(self.instance_files):
+            refs.extend(self.instance_files[instance])
+        return refs
+
+    def __repr__(self):
+        return 'ReferenceFile(%r, %d instances)' % (self.path, len(self.instances))
+
+class ReferenceGraph(object):
+    """A scene's files and its reference files, each walked once"""
+    def __init__(self, scene_path):
+        self.scene_path = scene_path
+        # the references of the scene's own nodes
+        self.scene_files = []
+        self.top = []
+        self._references = {}
+        self._order = []
+
+    def __iter__(self):
+        for key in self._order:
+            yield self._references[key]
+
+    def __len__(self):
+        return len(self._order)
+
+    def _key(self, path):
+        return zync_scan.path_key(zync_scan.normalize_path(path))
+
+    def get(self, path):
+        return self._references.get(self._key(path))
+
+    def add(self, path, instance, parent=None, loaded=True):
+        """
+        Adds a reference to the file at path, nested in the reference file
+        parent or in the scene, and returns its ReferenceFile
+        """
+        key = self._key(path)
+        reference = self._references.get(key)
+        if reference is None:
+            reference = self._references[key] = ReferenceFile(zync_scan.normalize_path(path))
+            self._order.append(key)
+        if instance not in reference.instances:
+            reference.instances.append(instance)
+            if not loaded:
+                reference.unloaded.add(instance)
+        if parent is None:
+            if reference.path not in self.top:
+                self.top.append(reference.path)
+        else:
+            parent = self.get(parent)
+            if parent.path not in reference.parents:
+                reference.parents.append(parent.path)
+            if reference.path not in parent.children:
+                parent.children.append(reference.path)
+        return reference
+
+    def chain(self, path):
+        """Returns the paths from the outermost reference file to path, following first parents"""
+        chain = []
+        reference = self.get(path)
+        while reference is not None and reference.path not in chain:
+            chain.insert(0, reference.path)
+            reference = self.get(reference.parents[0]) if reference.parents else None
+        return chain
+
+    def nested(self, path):
+        """Returns the ReferenceFiles path nests, at any depth, not including itself"""
+        result = []
+        pending = list(self.get(path).children)
+        while pending:
+            reference = self.get(pending.pop(0))
+            if reference in result:
+                continue
+            result.append(reference)
+            pending.extend(reference.children)
+        return result
+
+    def pulled_in(self, path):
+        """
+        Returns the deduplicated (path, node, attribute) references the file at
+        path brings into the scene: its own files, its nested reference files
+        and theirs
+        """
+        refs = list(self.get(path).own_files())
+        for reference in self.nested(path):
+            refs.append((reference.path, None, None))
+            refs.extend(reference.own_files())
+        return list(zync_scan.dedupe(refs))
+
+    def files(self):
+        """
+        Returns every file the scene depends on, deduplicated: the loaded
+        reference files, then the files of the scene and of each of them
+        """
+        refs = [(reference.path, None, None) for reference in self if reference.loaded]
+        refs.extend(self.scene_files)
+        for reference in self:
+            refs.extend(reference.own_files())
+        return list(zync_scan.dedupe(refs))
+
+    def owners(self):
+        """
+        Returns a dict of each normalised file path to the reference files
+        whose own nodes use it, with None standing for the scene itself
+        """
+        owners = {}
+        sources = [(None, self.scene_files)] + [(r.path, r.own_files()) for r in self]
+        for owner, refs in sources:
+            for path, node, attribute in zync_scan.dedupe(refs):
+                users = owners.setdefault(path, [])
+                if owner not in users:
+                    users.append(owner)
+        return owners
+
+    def to_dict(self):
+        def paths(refs):
+            return [path for path, node, attribute in zync_scan.dedupe(refs)]
+        return {'scene': self.scene_path,
+                'scene_files': paths(self.scene_files),
+                'top': list(self.top),
+                'references': [{'path': r.path,
+                                'instances': list(r.instances),
+                                'unloaded': sorted(r.unloaded),
+                                'parents': list(r.parents),
+                                'children': list(r.children),
+                                'cached': r.cached,
+                                'files': paths(r.own_files())} for r in self]}
+
+    def format(self):
+        """Returns a report of the files each top-level reference pulls in"""
+        lines = ['%d files, %d from the scene itself, %d reference files' % (
+            len(self.files()), len(list(zync_scan.dedupe(self.scene_files))), len(self))]
+        def add(path, depth):
+            reference = self.get(path)
+            state = 'unloaded' if not reference.loaded else ('cached' if reference.cached else 'scanned')
+            lines.append('%s%s: %d instances, %d own files, %d pulled in (%s)' % (
+                '  ' * depth, reference.path, len(reference.instances),
+                len(list(zync_scan.dedupe(reference.own_files()))), len(self.pulled_in(path)), state))
+        def walk(path, depth, seen):
+            add(path, depth)
+            for child in self.get(path).children:
+                if child not in seen:
+                    seen.add(child)
+                    walk(child, depth + 1, seen)
+        for path in self.top:
+            walk(path, 1, set([path]))
+        return '\n'.join(lines)
@@ -0,0 +1,189 @@
+"""
+ZYNC Dependency Scanner
+
+Normalises, dedupes and stats the file references gathered from a scene.
+References come in as (path, node, attribute) tuples, as yielded by
+zync_maya.get_scene_file_refs(), and go out as compact FileRecords. The stat
+calls run concurrently in a bounded pool of threads, which hides the latency
+of network storage; nothing in this module touches Maya, so the references
+can be gathered on the main thread and stat'ed in the background.
+
+Usage:
+    import zync_scan
+    records = zync_scan.scan(refs)
+    for record in zync_scan.iter_scan(refs):
+        ...
+
+"""
+
+from collections import namedtuple
+import os
+import re
+import sys
+import threading
+import Queue
+
+import zync_sequences
+
+DEFAULT_WORKERS = 16
+
+class FileRecord(namedtuple('FileRecord', 'path size mtime exists node attribute')):
+    """
+    A scanned scene dependency. size and mtime are None if the file does not exist.
+    """
+    __slots__ = ()
+
+_WINDOWS_PATH = re.compile(r'^(?:[a-zA-Z]:/|//)')
+
+def normalize_path(path):
+    """Returns the path with forward slashes and redundant separators removed"""
+    path = path.strip().replace('\\', '/')
+    unc = path.startswith('//')
+    while '//' in path:
+        path = path.replace('//', '/')
+    if unc:
+        path = '/' + path
+    if len(path) > 1 and path.endswith('/'):
+        path = path[:-1]
+    return path
+
+def path_key(path, case_insensitive=None):
+    """
+    Returns the key used to dedupe a normalised path. Paths on Windows drives
+    and UNC shares are compared case-insensitively; pass case_insensitive to
+    force either behaviour.
+    """
+    if case_insensitive is None:
+        case_insensitive = sys.platform == 'win32' or bool(_WINDOWS_PATH.match(path))
+    if case_insensitive:
+        return path.lower()
+    return path
+
+def _expand_refs(refs):
+    """Yields (path, node, attribute) references with any FileSequences expanded"""
+    for ref in refs:
+        if isinstance(ref, basestring) or isinstance(ref, zync_sequences.FileSequence):
+            ref = (ref, None, None)
+        path, node, attribute = ref
+        if isinstance(path, zync_sequences.FileSequence):
+            for member in path:
+                yield (member, node, attribute)
+        else:
+            yield (path, node, attribute)
+
+def dedupe(refs, case_insensitive=None):
+    """
+    Normalises and dedupes (path, node, attribute) references, yielding the
+    first reference seen for each file. Plain path strings are accepted too,
+    and zync_sequences.FileSequences are expanded into their members.
+    """
+    seen = set()
+    for path, node, attribute in _expand_refs(refs):
+        if not path:
+            continue
+        path = normalize_path(path)
+        if not path:
+            continue
+        key = path_key(path, case_insensitive)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield (path, node, attribute)
+
+def stat_ref(ref):
+    """Returns the FileRecord for a single normalised reference"""
+    path, node, attribute = ref
+    try:
+        st = os.stat(path)
+    except OSError:
+        return FileRecord(path, None, None, False, node, attribute)
+    return FileRecord(path, st.st_size, st.st_mtime, True, node, attribute)
+
+class _StatPool(object):
+    """
+    A fixed pool of threads that stat references from a bounded queue and
+    put the resulting FileRecords on a results queue.
+    """
+    _stop = object()
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = max(1, int(workers))
+        self.tasks = Queue.Queue(self.workers * 4)
+        self.results = Queue.Queue()
+        self.threads = []
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            ref = self.tasks.get()
+            if ref is self._stop:
+                return
+            try:
+                record = stat_ref(ref)
+            except Exception:
+                path, node, attribute = ref
+                record = FileRecord(path, None, None, False, node, attribute)
+            self.results.put(record)
+
+    def close(self):
+        for _ in self.threads:
+            self.tasks.put(self._stop)
+        for thread in self.threads:
+            thread.join()
+
+def _iter_records(refs, workers):
+    pool = _StatPool(workers)
+    pending = 0
+    try:
+        for ref in refs:
+            pool.tasks.put(ref)
+            pending += 1
+            while True:
+                try:
+                    record = pool.results.get_nowait()
+                except Queue.Empty:
+                    break
+                pending -= 1
+                yield record
+        while pending:
+            yield pool.results.get()
+            pending -= 1
+    finally:
+        pool.close()
+
+def iter_scan(refs, workers=DEFAULT_WORKERS, case_insensitive=None):
+    """
+    Streams FileRecords for the given references. refs is consumed lazily on
+    the calling thread, so it may be a generator that queries Maya; records
+    are yielded in completion order as soon as they are available, while the
+    rest of the scan is still running.
+    """
+    return _iter_records(dedupe(refs, case_insensitive), workers)
+
+def scan(refs, workers=DEFAULT_WORKERS, case_insensitive=None):
+    """
+    Collects all of the references first, then stats them concurrently.
+    Returns a list of FileRecords sorted by path.
+    """
+    refs = list(dedupe(refs, case_insensitive))
+    if not refs:
+        return []
+    workers = min(max(1, int(workers)), len(refs))
+    records = list(_iter_records(refs, workers))
+    records.sort(key=lambda r: r.path)
+    return records
+
+def summarize(records):
+    """Returns a dict with file counts and the total size of the existing files"""
+    summary = {'files': 0, 'missing': 0, 'bytes': 0}
+    for record in records:
+        summary['files'] += 1
+        if record.exists:
+            summary['bytes'] += record.size
+        else:
+            summary['missing'] += 1
+    return summary
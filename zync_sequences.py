@@ -0,0 +1,273 @@
+"""
+ZYNC File Sequences
+
+Compact representation of numbered file sets: image sequences, UDIM tiles and
+one-file-per-frame caches. A FileSequence stores the path pattern and the
+numbers present as merged runs, so a 10,000 frame cache costs a handful of
+integers rather than 10,000 strings. Individual paths are only generated when
+a consumer iterates over the sequence.
+
+Members are discovered from a single directory listing per folder, which is
+cached in a DirectoryCache for the duration of a scan, rather than by checking
+each candidate path.
+
+Supported tokens in the file name:
+    <UDIM>, <udim>   Mari style UDIM tile, e.g. 1001
+    ####             frame number, padded to the number of #s
+    %04d             frame number, printf style
+    <f>              unpadded frame number
+
+Usage:
+    import zync_sequences
+    item = zync_sequences.expand('/tex/color.<UDIM>.tif')
+    for path in zync_sequences.iter_paths([item]):
+        ...
+
+"""
+
+import os
+import re
+
+_TOKEN_REGEX = re.compile(r'(<UDIM>|<udim>|#+|%0?(\d*)d|<f>)')
+_FRAME_REGEX = re.compile(r'^(.*?)(\d+)(\D*)$')
+_UDIM_REGEX = re.compile(r'(?<!\d)(1\d\d\d)(?!\d)')
+_CACHE_FRAME_REGEX = re.compile(r'^Frame(-?\d+)(Tick-?\d+)?\.(mcx?)$')
+
+class DirectoryCache(object):
+    """
+    Caches directory listings, so each folder is listed at most once per scan.
+    Missing or unreadable folders list as empty.
+    """
+    def __init__(self):
+        self._listings = {}
+
+    def listdir(self, directory):
+        """Returns a frozenset of the names in directory"""
+        directory = directory or '.'
+        try:
+            return self._listings[directory]
+        except KeyError:
+            pass
+        try:
+            names = frozenset(os.listdir(directory))
+        except OSError:
+            names = frozenset()
+        self._listings[directory] = names
+        return names
+
+    def exists(self, path):
+        """Returns True if path is in the listing of its folder"""
+        directory, name = os.path.split(path)
+        return name in self.listdir(directory)
+
+    def clear(self):
+        self._listings.clear()
+
+# shared by the scene dependency handlers, cleared at the start of each scan
+listings = DirectoryCache()
+
+def _to_runs(numbers):
+    """Returns the sorted, unique numbers merged into a tuple of inclusive (start, end) runs"""
+    runs = []
+    for number in sorted(set(numbers)):
+        if runs and runs[-1][1] == number - 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return tuple([tuple(run) for run in runs])
+
+class FileSequence(object):
+    """
+    A set of numbered files sharing a pattern: head + number + tail, with the
+    number zero-padded to padding digits. kind is 'frame' or 'udim'.
+    """
+    __slots__ = ('head', 'tail', 'padding', 'kind', 'runs')
+
+    def __init__(self, head, tail, padding, kind='frame', numbers=()):
+        self.head = head
+        self.tail = tail
+        self.padding = padding
+        self.kind = kind
+        self.runs = _to_runs(numbers)
+
+    @property
+    def pattern(self):
+        """Returns the sequence path with its number replaced by a token"""
+        if self.kind == 'udim':
+            token = '<UDIM>'
+        elif self.padding > 1:
+            token = '#' * self.padding
+        else:
+            token = '<f>'
+        return self.head + token + self.tail
+
+    def path(self, number):
+        """Returns the path of the given member"""
+        if number < 0:
+            return '%s-%0*d%s' % (self.head, self.padding, -number, self.tail)
+        return '%s%0*d%s' % (self.head, self.padding, number, self.tail)
+
+    def numbers(self):
+        """Yields the frame or tile numbers in the sequence"""
+        for start, end in self.runs:
+            for number in xrange(start, end + 1):
+                yield number
+
+    def __iter__(self):
+        path = self.path
+        for number in self.numbers():
+            yield path(number)
+
+    def __len__(self):
+        return sum([end - start + 1 for start, end in self.runs])
+
+    def __nonzero__(self):
+        return bool(self.runs)
+
+    def __eq__(self, other):
+        return isinstance(other, FileSequence) and \
+            (self.head, self.tail, self.padding, self.kind, self.runs) == \
+            (other.head, other.tail, other.padding, other.kind, other.runs)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.head, self.tail, self.padding, self.kind, self.runs))
+
+    def range_string(self):
+        """Returns the members as a compact string, like 1001-1004,1011"""
+        parts = []
+        for start, end in self.runs:
+            if start == end:
+                parts.append(str(start))
+            else:
+                parts.append('%d-%d' % (start, end))
+        return ','.join(parts)
+
+    def __repr__(self):
+        return 'FileSequence(%r, [%s])' % (self.pattern, self.range_string())
+
+def parse_pattern(path):
+    """
+    Returns (head, tail, padding, kind) for a path whose file name contains a
+    sequence token, or None if it doesn't.
+    """
+    directory, name = os.path.split(path)
+    match = None
+    for match in _TOKEN_REGEX.finditer(name):
+        pass
+    if match is None:
+        return None
+    token = match.group(1)
+    if token in ('<UDIM>', '<udim>'):
+        padding, kind = 4, 'udim'
+    elif token.startswith('#'):
+        padding, kind = len(token), 'frame'
+    elif token.startswith('%'):
+        padding, kind = int(match.group(2) or 1), 'frame'
+    else:
+        padding, kind = 1, 'frame'
+    if directory:
+        directory = directory.rstrip('/') + '/'
+    return (directory + name[:match.start()], name[match.end():], padding, kind)
+
+def frame_pattern(path):
+    """
+    Returns the path with the last number in its file name replaced by #s, for
+    file nodes using a frame extension. Paths already holding a token, or with
+    no number, are returned as is.
+    """
+    directory, name = os.path.split(path)
+    if _TOKEN_REGEX.search(name):
+        return path
+    match = _FRAME_REGEX.match(name)
+    if not match:
+        return path
+    name = match.group(1) + '#' * len(match.group(2)) + match.group(3)
+    return '/'.join([directory, name]) if directory else name
+
+def udim_pattern(path):
+    """
+    Returns the path with the UDIM tile number in its file name replaced by
+    <UDIM>, for file nodes using Mari style UV tiling.
+    """
+    directory, name = os.path.split(path)
+    if _TOKEN_REGEX.search(name):
+        return path
+    matches = list(_UDIM_REGEX.finditer(name))
+    if not matches:
+        return path
+    match = matches[-1]
+    name = name[:match.start()] + '<UDIM>' + name[match.end():]
+    return '/'.join([directory, name]) if directory else name
+
+def find_sequence(head, tail, padding, kind='frame', dirs=None):
+    """
+    Returns the FileSequence of files on disk matching head + number + tail,
+    found with a single listing of the folder.
+    """
+    if dirs is None:
+        dirs = listings
+    directory, prefix = os.path.split(head)
+    regex = re.compile('^%s(-?\d+)%s$' % (re.escape(prefix), re.escape(tail)))
+    numbers = []
+    for name in dirs.listdir(directory):
+        match = regex.match(name)
+        if match is None:
+            continue
+        digits = match.group(1)
+        number = int(digits)
+        # only accept numbers that format back to the same name
+        if ('%0*d' % (padding, abs(number))) != digits.lstrip('-'):
+            continue
+        numbers.append(number)
+    return FileSequence(head, tail, padding, kind, numbers)
+
+def expand(path, dirs=None):
+    """
+    Returns a FileSequence for a path holding a sequence token, or the path
+    itself if it has no token or no files on disk match it.
+    """
+    if not path:
+        return path
+    parsed = parse_pattern(path)
+    if parsed is None:
+        return path
+    head, tail, padding, kind = parsed
+    sequence = find_sequence(head, tail, padding, kind, dirs)
+    if not sequence:
+        return path
+    return sequence
+
+def find_cache_frames(cache_dir, cache_name, dirs=None):
+    """
+    Returns the FileSequences making up a one-file-per-frame Maya cache, one
+    per extension and sub-frame tick, e.g. nameFrame<f>.mc and
+    nameFrame<f>Tick120.mc.
+    """
+    if dirs is None:
+        dirs = listings
+    groups = {}
+    for name in dirs.listdir(cache_dir):
+        if not name.startswith(cache_name):
+            continue
+        match = _CACHE_FRAME_REGEX.match(name[len(cache_name):])
+        if match is None:
+            continue
+        frame, tick, ext = match.groups()
+        groups.setdefault((tick or '', ext), []).append(int(frame))
+    sequences = []
+    head = '%s/%sFrame' % (cache_dir.rstrip('/'), cache_name)
+    for (tick, ext), frames in sorted(groups.items()):
+        sequences.append(FileSequence(head, '%s.%s' % (tick, ext), 1, 'frame', frames))
+    return sequences
+
+def iter_paths(items):
+    """Yields individual paths from a mix of path strings and FileSequences"""
+    for item in items:
+        if isinstance(item, FileSequence):
+            for path in item:
+                yield path
+        else:
+            yield item
@@ -0,0 +1,251 @@
+"""
+ZYNC Sessions
+
+Keeps authenticated ZYNC clients for reuse across submissions, so a session
+of many submits authenticates once rather than once per job. A session
+expires max_age seconds after it authenticated; a call that fails with one
+of reauth_errors is retried once on a freshly authenticated client. Path
+mappings are added to each session's client once.
+
+Idempotent server lookups, like a scene's project name or output path, are
+kept in a TTLCache for a few minutes.
+
+Everything here is safe to use from several threads. The client itself is
+created by a factory, so this module doesn't depend on the zync module.
+
+Usage:
+    import zync_session
+    sessions = zync_session.SessionManager(
+        lambda username, password: zync.Zync('maya_plugin', API_KEY, username=username, password=password),
+        reauth_errors=(zync.ZyncAuthenticationError,))
+    z = sessions.client(username, password, path_mappings)
+    z.submit_job('maya', scene_path, layers, params=params)
+    sessions.lookup(('project_name', scene_path), zync.get_project_name, scene_path)
+
+"""
+
+import hashlib
+import threading
+import time
+
+DEFAULT_MAX_AGE = 30 * 60
+DEFAULT_LOOKUP_TTL = 5 * 60
+
+class TTLCache(object):
+    """A thread-safe dict whose entries expire ttl seconds after they are set"""
+    def __init__(self, ttl=DEFAULT_LOOKUP_TTL, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= self.clock():
+                del self._entries[key]
+                return default
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        self._lock.acquire()
+        try:
+            self._entries[key] = (self.clock() + ttl, value)
+        finally:
+            self._lock.release()
+
+    def invalidate(self, key=None):
+        """Removes the entry for key, or every entry"""
+        self._lock.acquire()
+        try:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+class Session(object):
+    """An authenticated client, with the path mappings added to it"""
+    __slots__ = ('client', 'created', 'path_mappings')
+
+    def __init__(self, client, created):
+        self.client = client
+        self.created = created
+        self.path_mappings = []
+
+class SessionClient(object):
+    """
+    Stands in for the client of a session. Method calls go to the session's
+    current client, re-authenticating if it expired, and are retried once on
+    a new client if they fail with one of the manager's reauth_errors.
+    add_path_mappings only adds mappings the session doesn't have yet.
+    """
+    def __init__(self, manager, username, password):
+        self._manager = manager
+        self._username = username
+        self._password = password
+
+    def add_path_mappings(self, path_mappings):
+        self._manager.add_path_mappings(self._username, self._password, path_mappings)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self._manager.session(self._username, self._password).client, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            return self._manager.call(self._username, self._password,
+                                      lambda client: getattr(client, name)(*args, **kwargs))
+        call.__name__ = name
+        return call
+
+class SessionManager(object):
+    """
+    Holds one session per username and password. factory(username,
+    password) returns a newly authenticated client, raising if
+    authentication fails.
+    """
+    def __init__(self, factory, reauth_errors=(), max_age=DEFAULT_MAX_AGE,
+                 lookup_ttl=DEFAULT_LOOKUP_TTL, clock=time.time):
+        self.factory = factory
+        self.reauth_errors = tuple(reauth_errors)
+        self.max_age = max_age
+        self.clock = clock
+        self.lookups = TTLCache(lookup_ttl, clock)
+        self._sessions = {}
+        self._path_mappings = {}
+        self._auth_locks = {}
+        self._lock = threading.Lock()
+
+    def _key(self, username, password):
+        # the password is only kept by the callers, not in the session keys
+        return (username, hashlib.sha1(password or '').hexdigest())
+
+    def _auth_lock(self, key):
+        self._lock.acquire()
+        try:
+            return self._auth_locks.setdefault(key, threading.Lock())
+        finally:
+            self._lock.release()
+
+    def _current(self, key):
+        session = self._sessions.get(key)
+        if session is not None and self.clock() - session.created >= self.max_age:
+            return None
+        return session
+
+    def session(self, username, password):
+        """
+        Returns the Session for the username and password, authenticating if
+        there is none or it expired. Other threads asking for the same session
+        meanwhile wait for the one authentication.
+        """
+        key = self._key(username, password)
+        session = self._current(key)
+        if session is not None:
+            return session
+        auth_lock = self._auth_lock(key)
+        auth_lock.acquire()
+        try:
+            session = self._current(key)
+            if session is not None:
+                return session
+            session = Session(self.factory(username, password), self.clock())
+            self._lock.acquire()
+            try:
+                path_mappings = list(self._path_mappings.get(key, ()))
+            finally:
+                self._lock.release()
+            if path_mappings:
+                session.client.add_path_mappings(path_mappings)
+                session.path_mappings.extend(path_mappings)
+            self._sessions[key] = session
+            return session
+        finally:
+            auth_lock.release()
+
+    def client(self, username, password, path_mappings=()):
+        """
+        Returns a SessionClient for the username and password, authenticating
+        now if needed, so authentication errors are raised here
+        """
+        self.session(username, password)
+        client = SessionClient(self, username, password)
+        if path_mappings:
+            client.add_path_mappings(path_mappings)
+        return client
+
+    def add_path_mappings(self, username, password, path_mappings):
+        """Adds the path mappings the session's client doesn't have yet"""
+        key = self._key(username, password)
+        session = self.session(username, password)
+        self._lock.acquire()
+        try:
+            known = self._path_mappings.setdefault(key, [])
+            for mapping in path_mappings:
+                mapping = tuple(mapping)
+                if mapping not in known:
+                    known.append(mapping)
+            new = [m for m in known if m not in session.path_mappings]
+            session.path_mappings.extend(new)
+        finally:
+            self._lock.release()
+        if new:
+            session.client.add_path_mappings(new)
+
+    def call(self, username, password, fn):
+        """
+        Returns fn(client) for the session's client. If fn fails with one of
+        reauth_errors, the session is dropped and fn retried once on a newly
+        authenticated client.
+        """
+        session = self.session(username, password)
+        try:
+            return fn(session.client)
+        except self.reauth_errors:
+            self.invalidate(username, password, session)
+        return fn(self.session(username, password).client)
+
+    def invalidate(self, username=None, password=None, session=None):
+        """
+        Drops the session for the username and password, or every session.
+        With session, only drops it if it is still the current one.
+        """
+        self._lock.acquire()
+        try:
+            if username is None:
+                self._sessions.clear()
+                return
+            key = self._key(username, password)
+            if session is None or self._sessions.get(key) is session:
+                self._sessions.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def lookup(self, key, fn, *args, **kwargs):
+        """
+        Returns fn(*args, **kwargs) from the lookup cache, calling and caching
+        it if it isn't there. With a valid keyword argument, only results for which
+        valid(result) is true are cached.
+        """
+        valid = kwargs.pop('valid', None)
+        missing = self.lookups
+        result = self.lookups.get(key, missing)
+        if result is not missing:
+            return result
+        result = fn(*args, **kwargs)
+        if valid is None or valid(result):
+            self.lookups.set(key, result)
+        return result
@@ -0,0 +1,379 @@
+"""
+ZYNC Scene Snapshots
+
+A content-addressed store of the scene snapshots submitted to ZYNC, kept in
+the cloud_submit folder next to the scene. Each snapshot is named after its
+shot and the hash of its contents, <shot>_<hash>.ma, so submitting an
+unchanged scene again reuses the snapshot, and its upload, rather than
+writing a new copy. A snapshot identical to one of another shot is hard
+linked to it where the filesystem allows.
+
+Scenes are hashed in chunks, leaving out the Maya ASCII header and last
+lines that name the file and the time it was saved, as those change with
+every save.
+
+Each shot keeps a manifest of its snapshots, <shot>.snapshots.json, with
+when each was created and last used, and the stat of the scene it was taken
+from, so an unchanged scene file isn't hashed twice. gc() removes the
+snapshots of a shot beyond the newest keep that weren't used for max_age.
+
+Usage:
+    import zync_snapshots
+    store = zync_snapshots.SnapshotStore.for_scene(scene_path)
+    snapshot = store.add(scene_path)
+    snapshot.path, snapshot.reused
+    store.gc()
+
+From the command line:
+    python zync_snapshots.py list /shows/a/scenes/cloud_submit
+    python zync_snapshots.py gc /shows/a/scenes/cloud_submit --keep 5 --max-age 7
+
+"""
+
+import errno
+import glob
+import hashlib
+import json
+import optparse
+import os
+import re
+import shutil
+import sys
+import time
+
+HASH_CHUNK_SIZE = 1024 * 1024
+STORE_FOLDER = 'cloud_submit'
+MANIFEST_SUFFIX = '.snapshots.json'
+
+# the header and last lines Maya rewrites on every save
+VOLATILE_HEADER = ('//Name:', '//Last modified:')
+VOLATILE_FOOTER = '// End of '
+MAX_FOOTER = 4096
+
+DEFAULT_KEEP = 10
+DEFAULT_MAX_AGE = 14 * 24 * 60 * 60
+
+# partly written snapshots of a crashed save are removed after this long
+TEMP_MAX_AGE = 24 * 60 * 60
+
+_SNAPSHOT_REGEX = re.compile(r'^(.+)_([0-9a-f]{8})\.ma$')
+_TEMP_PREFIX = '.zync_snapshot_'
+
+def hash_scene(path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Returns the md5 hex digest of the scene file, read in chunks, without
+    the header lines and last line that name the file and when it was saved
+    """
+    digest = hashlib.md5()
+    f = open(path, 'rb')
+    try:
+        while True:
+            line = f.readline()
+            if not line.startswith('//'):
+                digest.update(line)
+                break
+            if not line.startswith(VOLATILE_HEADER):
+                digest.update(line)
+        # the last line is held back, as it names the file too
+        pending = ''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = pending + chunk
+            cut = data.rfind('\n', 0, len(data) - 1) + 1
+            digest.update(data[:cut])
+            pending = data[cut:]
+            if len(pending) > MAX_FOOTER:
+                digest.update(pending)
+                pending = ''
+        if not pending.startswith(VOLATILE_FOOTER):
+            digest.update(pending)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+def shot_name(scene_path):
+    """Returns the name snapshots of the scene are stored under"""
+    return os.path.splitext(os.path.basename(scene_path))[0]
+
+def snapshot_name(shot, digest):
+    return '%s_%s.ma' % (shot, digest[:8])
+
+def _replace(source, destination):
+    # os.rename doesn't replace an existing file on Windows
+    try:
+        os.rename(source, destination)
+    except OSError:
+        if not os.path.exists(destination):
+            raise
+        os.remove(destination)
+        os.rename(source, destination)
+
+def _link_or_copy(source, destination):
+    """Hard links destination to source, copying it where links aren't supported"""
+    temp = '%s.%d.tmp' % (destination, os.getpid())
+    try:
+        os.link(source, temp)
+    except (AttributeError, OSError):
+        shutil.copyfile(source, temp)
+    _replace(temp, destination)
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+
+class Snapshot(object):
+    """A stored snapshot of a shot's scene"""
+    __slots__ = ('shot', 'digest', 'path', 'created', 'used', 'source',
+                 'source_size', 'source_mtime', 'reused')
+
+    def __init__(self, shot, digest, path, created, used, source=None,
+                 source_size=None, source_mtime=None, reused=False):
+        self.shot = shot
+        self.digest = digest
+        self.path = path
+        self.created = created
+        self.used = used
+        self.source = source
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+        self.reused = reused
+
+    def to_dict(self):
+        return {'digest': self.digest, 'file': os.path.basename(self.path),
+                'created': self.created, 'used': self.used, 'source': self.source,
+                'source_size': self.source_size, 'source_mtime': self.source_mtime}
+
+    @classmethod
+    def from_dict(cls, shot, root, data):
+        return cls(shot, data['digest'], os.path.join(root, data['file']), data['created'],
+                   data['used'], data.get('source'), data.get('source_size'),
+                   data.get('source_mtime'))
+
+    def __repr__(self):
+        return 'Snapshot(%r)' % self.path
+
+class SnapshotStore(object):
+    """The snapshots in one folder, with a manifest per shot"""
+    def __init__(self, root, clock=time.time):
+        self.root = root
+        self.clock = clock
+
+    @classmethod
+    def for_scene(cls, scene_path, **kwargs):
+        """Returns the store in the cloud_submit folder next to the scene"""
+        return cls(os.path.join(os.path.dirname(scene_path), STORE_FOLDER), **kwargs)
+
+    def _manifest_path(self, shot):
+        return os.path.join(self.root, shot + MANIFEST_SUFFIX)
+
+    def shots(self):
+        paths = glob.glob(os.path.join(self.root, '*' + MANIFEST_SUFFIX))
+        return sorted([os.path.basename(p)[:-len(MANIFEST_SUFFIX)] for p in paths])
+
+    def snapshots(self, shot):
+        """Returns the shot's snapshots, most recently used first"""
+        try:
+            f = open(self._manifest_path(shot))
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+        try:
+            try:
+                data = json.load(f)
+            except ValueError:
+                # a damaged manifest only loses the reuse of its snapshots
+                return []
+        finally:
+            f.close()
+        snapshots = [Snapshot.from_dict(shot, self.root, s) for s in data.get('snapshots', [])]
+        snapshots.sort(key=lambda s: s.used, reverse=True)
+        return snapshots
+
+    def _write_manifest(self, shot, snapshots):
+        path = self._manifest_path(shot)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        f = open(temp, 'w')
+        try:
+            json.dump({'version': 1, 'shot': shot,
+                       'snapshots': [s.to_dict() for s in snapshots]}, f, indent=1)
+        finally:
+            f.close()
+        _replace(temp, path)
+
+    def find(self, digest, shot=None):
+        """
+        Returns a stored Snapshot with the digest, preferring one of shot, or
+        None if there is none
+        """
+        shots = self.shots()
+        if shot in shots:
+            shots.remove(shot)
+            shots.insert(0, shot)
+        for name in shots:
+            for snapshot in self.snapshots(name):
+                if snapshot.digest == digest and os.path.isfile(snapshot.path):
+                    return snapshot
+        return None
+
+    def temp_path(self, shot):
+        """Returns a path in the store for saving a new snapshot of shot to, before add()"""
+        self._make_root()
+        return os.path.join(self.root, '%s%s_%d_%d.ma' % (_TEMP_PREFIX, shot, os.getpid(),
+                                                          int(self.clock() * 1000)))
+
+    def _make_root(self):
+        try:
+            os.makedirs(self.root)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def add(self, path, shot=None, source=None, move=False):
+        """
+        Stores the scene file at path as a snapshot of shot, by default named
+        after the file, and returns its Snapshot. If an identical snapshot is
+        stored already it is reused, with reused set. With move, path is a
+        file saved for the snapshot, like one at temp_path(), and is moved
+        into the store or removed; otherwise it is the scene itself and is
+        copied, not linked, as saving the scene may change the file in place.
+        """
+        if source is None:
+            source = path
+        if shot is None:
+            shot = shot_name(source)
+        self._make_root()
+        snapshots = self.snapshots(shot)
+        now = self.clock()
+
+        digest = None
+        source_size = source_mtime = None
+        if not move:
+            st = os.stat(path)
+            source_size, source_mtime = st.st_size, st.st_mtime
+            for snapshot in snapshots:
+                if (snapshot.source == source and snapshot.source_size == source_size and
+                        snapshot.source_mtime == source_mtime and os.path.isfile(snapshot.path)):
+                    digest = snapshot.digest
+                    break
+        if digest is None:
+            digest = hash_scene(path)
+
+        target = os.path.join(self.root, snapshot_name(shot, digest))
+        existing = self.find(digest, shot)
+        reused = existing is not None
+        if existing is not None and existing.path != target:
+            _link_or_copy(existing.path, target)
+        if move:
+            if reused:
+                _remove(path)
+            else:
+                _replace(path, target)
+        elif not reused:
+            temp = '%s.%d.tmp' % (target, os.getpid())
+            shutil.copyfile(path, temp)
+            _replace(temp, target)
+
+        snapshot = None
+        for s in snapshots:
+            if s.digest == digest:
+                snapshot = s
+                break
+        if snapshot is None:
+            snapshot = Snapshot(shot, digest, target, now, now)
+            snapshots.insert(0, snapshot)
+        snapshot.path = target
+        snapshot.used = now
+        snapshot.source = source
+        if not move:
+            snapshot.source_size, snapshot.source_mtime = source_size, source_mtime
+        snapshot.reused = reused
+        self._write_manifest(shot, snapshots)
+        return snapshot
+
+    def gc(self, shot=None, keep=DEFAULT_KEEP, max_age=DEFAULT_MAX_AGE, dry_run=False):
+        """
+        Removes the snapshots of shot, or every shot, beyond the newest keep
+        that weren't used for max_age seconds, together with snapshot files
+        no manifest lists that are as old, and stale temp files. Returns the
+        paths removed, or that would be with dry_run.
+        """
+        now = self.clock()
+        removed = []
+        shots = self.shots() if shot is None else [shot]
+        listed = set()
+        for name in shots:
+            snapshots = self.snapshots(name)
+            kept = []
+            for i, snapshot in enumerate(snapshots):
+                if not os.path.isfile(snapshot.path):
+                    continue
+                listed.add(os.path.basename(snapshot.path))
+                if i >= keep and now - snapshot.used > max_age:
+                    removed.append(snapshot.path)
+                    continue
+                kept.append(snapshot)
+            if len(kept) != len(snapshots) and not dry_run:
+                self._write_manifest(name, kept)
+
+        if shot is None:
+            # other shots' manifests may list snapshots of a shot's name
+            for name in os.listdir(self.root) if os.path.isdir(self.root) else []:
+                path = os.path.join(self.root, name)
+                match = _SNAPSHOT_REGEX.match(name)
+                if name.startswith(_TEMP_PREFIX) or name.endswith('.tmp'):
+                    age = TEMP_MAX_AGE
+                elif match is not None and name not in listed:
+                    age = max_age
+                else:
+                    continue
+                try:
+                    if now - os.stat(path).st_mtime > age:
+                        removed.append(path)
+                except OSError:
+                    pass
+
+        if not dry_run:
+            removed = [path for path in removed if _remove(path)]
+        return removed
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog list|gc STORE [options]\n\n'
+                                   'STORE is a cloud_submit folder.')
+    parser.add_option('--keep', type='int', default=DEFAULT_KEEP,
+                      help='snapshots of each shot always kept')
+    parser.add_option('--max-age', type='float', default=DEFAULT_MAX_AGE / 86400.0,
+                      help='days an unused snapshot beyond --keep is kept')
+    parser.add_option('--shot', help='only this shot')
+    parser.add_option('-n', '--dry-run', action='store_true', help='only list what gc would remove')
+    options, args = parser.parse_args(argv)
+    if len(args) != 2 or args[0] not in ('list', 'gc'):
+        parser.error('give list or gc, and a store folder')
+    store = SnapshotStore(args[1])
+
+    if args[0] == 'list':
+        for shot in [options.shot] if options.shot else store.shots():
+            print shot
+            for snapshot in store.snapshots(shot):
+                try:
+                    size = '%.1f MB' % (os.path.getsize(snapshot.path) / 1048576.0)
+                except OSError:
+                    size = 'missing'
+                print '  %s  %s  last used %s' % (os.path.basename(snapshot.path), size,
+                                                  time.strftime('%Y-%m-%d %H:%M', time.localtime(snapshot.used)))
+    else:
+        removed = store.gc(options.shot, options.keep, options.max_age * 86400, options.dry_run)
+        for path in removed:
+            print path
+        print '%s %d files' % ('Would remove' if options.dry_run else 'Removed', len(removed))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
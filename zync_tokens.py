@@ -0,0 +1,306 @@
+"""
+ZYNC Token Templates
+
+Compiled, cached implementation of the Maya-style token expansion used for
+output prefixes. A prefix such as:
+
+    <Scene>/<RenderLayer>[_<RenderPass>]/<Camera>
+
+is parsed once into a TokenTemplate, which can then be expanded against any
+number of token dicts without re-parsing. Compiled templates are kept in a
+bounded LRU cache, so repeated calls to expand_file_tokens() with the same
+prefix only pay for the substitution.
+
+This module has no dependency on Maya and can be used from mayapy or a plain
+Python interpreter.
+
+Usage:
+    import zync_tokens
+    template = zync_tokens.compile_template('<RenderLayer>[_<RenderPass>]')
+    template.expand({'RenderLayer': 'bg', 'RenderPass': 'diffuse'})
+    template.expand_many([{'RenderLayer': 'bg'}, {'RenderLayer': 'fg'}])
+
+Run this module directly to benchmark it against the reference implementation:
+    python zync_tokens.py
+
+"""
+
+import re
+import shlex
+import threading
+import time
+
+GROUP_REGEX = re.compile(r'\[([^\]]+)\]')
+TOKEN_REGEX = re.compile(r'<([a-zA-Z]+)>')
+
+DEFAULT_CACHE_SIZE = 256
+
+def even(num):
+    return bool(num % 2)
+
+def odd(num):
+    return not bool(num % 2)
+
+def parse_tokens(tokens):
+    """
+    Returns a token dict. Strings of the form 'MyToken=value OtherToken=value'
+    are split into a dict, anything else is returned untouched.
+    """
+    if isinstance(tokens, basestring):
+        return dict([pair.split('=') for pair in shlex.split(tokens)])
+    return tokens
+
+def _substitute(parts, tokens, allOrNothing=False, leaveUnmatchedTokens=False):
+    result = []
+    for i, tok in enumerate(parts):
+        if even(i):
+            try:
+                tokn = tokens[tok]
+                if tokn is None:
+                    result.append('<%s>' % tok)
+                else:
+                    result.append(tokn.replace(':', '_'))
+            except KeyError:
+                if allOrNothing:
+                    if leaveUnmatchedTokens:
+                        return '<%s>' % tok
+                    else:
+                        return ''
+                elif leaveUnmatchedTokens:
+                    result.append('<%s>' % tok)
+                else:
+                    result.append('')
+        else:
+            result.append(tok)
+    return ''.join(result)
+
+def expand_file_tokens_uncompiled(path, tokens, leaveUnmatchedTokens=False):
+    """
+    Reference implementation of token expansion, which re-parses the path on
+    every call. Kept to verify and benchmark TokenTemplate against.
+    """
+    tokens = parse_tokens(tokens)
+
+    result = []
+    for i, grp in enumerate(GROUP_REGEX.split(path)):
+        parts = TOKEN_REGEX.split(grp)
+        if even(i):
+            result.append(_substitute(parts, tokens, allOrNothing=True, leaveUnmatchedTokens=leaveUnmatchedTokens))
+        else:
+            result.append(_substitute(parts, tokens, allOrNothing=False, leaveUnmatchedTokens=leaveUnmatchedTokens))
+    return ''.join(result)
+
+class TokenTemplate(object):
+    """
+    A pre-parsed token template.
+
+    The template is stored as a list of segments, one per bracket group or run
+    of text between groups. Each segment is a tuple of (all_or_nothing, parts),
+    where parts is a tuple of (is_token, text) pairs. Expansion follows the
+    same rules as expand_file_tokens_uncompiled():
+
+        * a token whose value is None is written back as <Token>
+        * ':' in token values is replaced with '_'
+        * a bracket group is dropped entirely if any of its tokens is missing,
+          or collapsed to the first missing <Token> if leaveUnmatchedTokens
+        * outside a group, a missing token is dropped, or left as <Token> if
+          leaveUnmatchedTokens
+    """
+    __slots__ = ('path', 'segments', 'tokens')
+
+    def __init__(self, path):
+        self.path = path
+        segments = []
+        names = set()
+        for i, grp in enumerate(GROUP_REGEX.split(path)):
+            parts = []
+            for j, part in enumerate(TOKEN_REGEX.split(grp)):
+                is_token = even(j)
+                if is_token:
+                    names.add(part)
+                elif not part:
+                    continue
+                parts.append((is_token, part))
+            if parts:
+                segments.append((even(i), tuple(parts)))
+        self.segments = tuple(segments)
+        self.tokens = frozenset(names)
+
+    def __repr__(self):
+        return 'TokenTemplate(%r)' % (self.path,)
+
+    def expand(self, tokens, leaveUnmatchedTokens=False):
+        """
+        Returns the template expanded with the given tokens, which may be a
+        dict or a space separated string of the form 'MyToken=value'.
+        """
+        tokens = parse_tokens(tokens)
+        result = []
+        append = result.append
+        for all_or_nothing, parts in self.segments:
+            if all_or_nothing:
+                group = []
+                for is_token, text in parts:
+                    if not is_token:
+                        group.append(text)
+                        continue
+                    try:
+                        value = tokens[text]
+                    except KeyError:
+                        if leaveUnmatchedTokens:
+                            group = ['<%s>' % text]
+                        else:
+                            group = []
+                        break
+                    if value is None:
+                        group.append('<%s>' % text)
+                    else:
+                        group.append(value.replace(':', '_'))
+                result.extend(group)
+            else:
+                for is_token, text in parts:
+                    if not is_token:
+                        append(text)
+                        continue
+                    try:
+                        value = tokens[text]
+                    except KeyError:
+                        if leaveUnmatchedTokens:
+                            append('<%s>' % text)
+                        continue
+                    if value is None:
+                        append('<%s>' % text)
+                    else:
+                        append(value.replace(':', '_'))
+        return ''.join(result)
+
+    def expand_many(self, token_dicts, leaveUnmatchedTokens=False):
+        """
+        Returns a list with the template expanded once for each of the given
+        token dicts, in order.
+        """
+        expand = self.expand
+        return [expand(tokens, leaveUnmatchedTokens) for tokens in token_dicts]
+
+class _TemplateCache(object):
+    """
+    A bounded, thread-safe LRU cache of compiled templates, keyed by path.
+    """
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._tick = 0
+
+    def get(self, path):
+        self._lock.acquire()
+        try:
+            self._tick += 1
+            entry = self._entries.get(path)
+            if entry is not None:
+                self.hits += 1
+                entry[0] = self._tick
+                return entry[1]
+            self.misses += 1
+            template = TokenTemplate(path)
+            if len(self._entries) >= self.maxsize:
+                oldest = min(self._entries, key=lambda k: self._entries[k][0])
+                del self._entries[oldest]
+            self._entries[path] = [self._tick, template]
+            return template
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self._lock.release()
+
+    def info(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize}
+
+_cache = _TemplateCache()
+
+def compile_template(path):
+    """
+    Returns the compiled TokenTemplate for the given path, from the cache if
+    it has been compiled before.
+    """
+    return _cache.get(path)
+
+def expand_file_tokens(path, tokens, leaveUnmatchedTokens=False):
+    """
+    Expands the tokens in path using a cached compiled template. See
+    zync_maya.expandFileTokens for the token syntax.
+    """
+    return _cache.get(path).expand(tokens, leaveUnmatchedTokens)
+
+def expand_many(path, token_dicts, leaveUnmatchedTokens=False):
+    """
+    Expands a single path against many token dicts, returning a list of
+    results in the same order.
+    """
+    return _cache.get(path).expand_many(token_dicts, leaveUnmatchedTokens)
+
+def clear_cache():
+    """Empties the compiled template cache."""
+    _cache.clear()
+
+def cache_info():
+    """Returns a dict of hit, miss and size counts for the template cache."""
+    return _cache.info()
+
+def set_cache_size(maxsize):
+    """Changes the maximum number of templates kept in the cache."""
+    _cache.maxsize = max(1, int(maxsize))
+
+def benchmark(layers=200, passes=10, repeat=3):
+    """
+    Times expansion of a typical prefix for every layer/pass combination with
+    both the uncompiled reference implementation and the compiled templates.
+    Returns a dict of best-of-repeat timings, in seconds.
+    """
+    path = '<Scene>/<RenderLayer>[_<RenderPass>]/<Camera>[.<Version>]'
+    token_dicts = []
+    for layer in range(layers):
+        for pass_ in range(passes):
+            token_dicts.append({'Scene': 'shot_010:lighting_v001',
+                                'RenderLayer': 'layer%03d' % layer,
+                                'RenderPass': 'pass%02d' % pass_,
+                                'Camera': 'renderCam'})
+
+    def best(fn):
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            fn()
+            timings.append(time.time() - start)
+        return min(timings)
+
+    expected = [expand_file_tokens_uncompiled(path, t, True) for t in token_dicts]
+    if expand_many(path, token_dicts, True) != expected:
+        raise AssertionError('compiled templates do not match the reference implementation')
+
+    results = {}
+    results['uncompiled'] = best(lambda: [expand_file_tokens_uncompiled(path, t, True) for t in token_dicts])
+    results['cached'] = best(lambda: [expand_file_tokens(path, t, True) for t in token_dicts])
+    results['batch'] = best(lambda: expand_many(path, token_dicts, True))
+    results['expansions'] = len(token_dicts)
+    return results
+
+if __name__ == '__main__':
+    timings = benchmark()
+    count = timings.pop('expansions')
+    print 'Expanded %d paths:' % count
+    for name in ('uncompiled', 'cached', 'batch'):
+        print '  %-10s %8.2f ms  (%.2fx)' % (name, timings[name] * 1000.0,
+                                             timings['uncompiled'] / max(timings[name], 1e-9))
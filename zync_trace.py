@@ -0,0 +1,285 @@
+"""
+ZYNC Submission Tracing
+
+Lightweight timing of the phases of a submission. Functions decorated with
+traced() record their wall and CPU time while a Tracer is active, and do
+nothing but a single check otherwise. Each thread has its own active Tracer,
+so work on background threads records to the trace of the thread that
+activated it; bind() carries the trace along with work handed to another
+thread. A finished trace is written as a
+Chrome trace JSON file, which can be opened in chrome://tracing or Perfetto,
+and summarised per phase with call counts and totals.
+
+Traces are written to ZYNC_TRACE_DIR, or a zync_traces folder in the
+system's temporary folder.
+
+Usage:
+    import zync_trace
+
+    @zync_trace.traced('scan')
+    def scan():
+        ...
+
+    tracer = zync_trace.Tracer('submit').activate()
+    with zync_trace.phase('auth'):
+        ...
+    tracer.deactivate()
+    print tracer.summary()
+    tracer.write()
+
+"""
+
+import inspect
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+_local = threading.local()
+_trace_numbers = itertools.count(1)
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+def trace_dir():
+    """Returns the folder traces are written to"""
+    return os.environ.get('ZYNC_TRACE_DIR') or os.path.join(tempfile.gettempdir(), 'zync_traces')
+
+def active():
+    """Returns the Tracer active on this thread, or None"""
+    return getattr(_local, 'tracer', None)
+
+def bind(fn):
+    """
+    Returns fn wrapped to run with this thread's active Tracer, for work
+    handed to another thread, such as Maya's main thread
+    """
+    tracer = active()
+    if tracer is None:
+        return fn
+    def run(*args, **kwargs):
+        previous = active()
+        _local.tracer = tracer
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.tracer = previous
+    run.__name__ = fn.__name__
+    return run
+
+class _Phase(object):
+    """Context manager recording one phase on a Tracer"""
+    __slots__ = ('tracer', 'name', 'args', 'start', 'cpu')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        self.cpu = _cpu_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.time() - self.start,
+                           _cpu_time() - self.cpu, self.args)
+        return False
+
+class _NullPhase(object):
+    """Context manager used when no tracer is active"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_phase = _NullPhase()
+
+def phase(name, **args):
+    """
+    Returns a context manager timing the enclosed block as a phase of the
+    active tracer, or doing nothing if there isn't one
+    """
+    tracer = active()
+    if tracer is None:
+        return _null_phase
+    return tracer.phase(name, **args)
+
+class Tracer(object):
+    """
+    Collects timed events. Events may be recorded from any thread. CPU time
+    is for the whole process, so phases running at the same time on several
+    threads each see the CPU time of all of them.
+    """
+    def __init__(self, name='submit'):
+        self.name = name
+        self.created = time.time()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def activate(self):
+        """Makes this the tracer that traced() functions on this thread record to"""
+        _local.tracer = self
+        return self
+
+    def deactivate(self):
+        if active() is self:
+            _local.tracer = None
+        return self
+
+    def phase(self, name, **args):
+        """Returns a context manager timing the enclosed block as a phase"""
+        return _Phase(self, name, args)
+
+    def record(self, name, start, wall, cpu, args=None):
+        event = (name, start, wall, cpu, threading.current_thread().name, args or None)
+        self._lock.acquire()
+        try:
+            self.events.append(event)
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """Returns a dict of phase name to {'calls', 'wall', 'cpu'} totals"""
+        stats = {}
+        for name, start, wall, cpu, thread, args in list(self.events):
+            entry = stats.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            entry['calls'] += 1
+            entry['wall'] += wall
+            entry['cpu'] += cpu
+        return stats
+
+    def summary(self):
+        """Returns a table of the phases, slowest first"""
+        stats = self.stats()
+        lines = ['%-28s %8s %10s %10s' % ('phase', 'calls', 'wall (s)', 'cpu (s)')]
+        for name in sorted(stats, key=lambda n: -stats[n]['wall']):
+            entry = stats[name]
+            lines.append('%-28s %8d %10.3f %10.3f' % (name, entry['calls'], entry['wall'], entry['cpu']))
+        return '\n'.join(lines)
+
+    def to_chrome_trace(self):
+        """Returns the trace as a dict in the Chrome trace event format"""
+        pid = os.getpid()
+        threads = {}
+        trace_events = []
+        for name, start, wall, cpu, thread, args in list(self.events):
+            tid = threads.setdefault(thread, len(threads) + 1)
+            event_args = {'cpu_ms': round(cpu * 1000.0, 3)}
+            if args:
+                event_args.update(args)
+            trace_events.append({'name': name,
+                                 'ph': 'X',
+                                 'ts': int((start - self.created) * 1e6),
+                                 'dur': int(wall * 1e6),
+                                 'pid': pid,
+                                 'tid': tid,
+                                 'args': event_args})
+        for thread, tid in threads.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                 'args': {'name': thread}})
+        return {'traceEvents': trace_events,
+                'displayTimeUnit': 'ms',
+                'otherData': {'name': self.name, 'created': self.created, 'stats': self.stats()}}
+
+    def write(self, path=None):
+        """Writes the Chrome trace JSON file, returning its path"""
+        if path is None:
+            directory = trace_dir()
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.created))
+            path = os.path.join(directory, '%s_%s_%d_%d.json' % (self.name, stamp, os.getpid(),
+                                                                 _trace_numbers.next()))
+        f = open(path, 'w')
+        try:
+            json.dump(self.to_chrome_trace(), f, default=str)
+        finally:
+            f.close()
+        return path
+
+def _traced_generator(tracer, name, gen):
+    """Times a generator across all of the time spent producing its items"""
+    wall = cpu = 0.0
+    first = time.time()
+    try:
+        while True:
+            start, start_cpu = time.time(), _cpu_time()
+            try:
+                item = gen.next()
+            finally:
+                wall += time.time() - start
+                cpu += _cpu_time() - start_cpu
+            yield item
+    except StopIteration:
+        pass
+    finally:
+        tracer.record(name, first, wall, cpu)
+
+def traced(name):
+    """
+    Decorator recording each call of the function as a phase of the active
+    tracer. For generator functions, the time spent producing items is
+    recorded once the generator is exhausted or closed.
+    """
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            tracer = active()
+            if tracer is None:
+                return fn(*args, **kwargs)
+            start, start_cpu = time.time(), _cpu_time()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                wall, cpu = time.time() - start, _cpu_time() - start_cpu
+            if inspect.isgenerator(result):
+                return _traced_generator(tracer, name, result)
+            tracer.record(name, start, wall, cpu)
+            return result
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__module__ = fn.__module__
+        return wrapper
+    return decorator
+
+def _format_value(value, max_items, max_chars):
+    if isinstance(value, dict):
+        items = sorted(value.items())
+        parts = ['%r: %s' % (k, _format_value(v, max_items, max_chars)) for k, v in items[:max_items]]
+        if len(items) > max_items:
+            parts.append('... %d more' % (len(items) - max_items))
+        text = '{%s}' % ', '.join(parts)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value)
+        parts = [_format_value(v, max_items, max_chars) for v in items[:max_items]]
+        if len(items) > max_items:
+            parts.append('... %d more' % (len(items) - max_items))
+        text = '[%s]' % ', '.join(parts)
+    else:
+        text = repr(value)
+    if len(text) > max_chars:
+        text = text[:max_chars] + '...'
+    return text
+
+def format_params(params, max_items=5, max_chars=400):
+    """
+    Returns a size-bounded, one line per key description of the params,
+    with long lists and dicts cut down to their first max_items entries.
+    """
+    lines = []
+    for key in sorted(params):
+        value = params[key]
+        if isinstance(value, dict) and key == 'scene_info':
+            for info_key in sorted(value):
+                info = value[info_key]
+                size = ''
+                if isinstance(info, (list, tuple, dict)):
+                    size = ' (%d)' % len(info)
+                lines.append('  scene_info.%s%s: %s' % (info_key, size, _format_value(info, max_items, max_chars)))
+        else:
+            lines.append('  %s: %s' % (key, _format_value(value, max_items, max_chars)))
+    return '\n'.join(lines)
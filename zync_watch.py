@@ -0,0 +1,343 @@
+"""
+ZYNC Output Watcher
+
+Tracks which frames of a submitted job have arrived in its output folders,
+from the job's zync_outputs.OutputManifest. Each poll stats every output
+folder once; only folders whose modification time changed are listed again,
+and only new files, plus those that were empty or truncated last time, are
+stat'ed. So a poll of an unchanged 100,000 frame job costs one stat per
+folder.
+
+For each layer and pass, a poll reports the arrived, missing, zero-byte and
+truncated frames as zync_frames.FrameSets. A frame is truncated when it is
+smaller than truncated_fraction of the median size of its sequence.
+
+Files rewritten in place with a different size aren't noticed, as that
+doesn't change their folder's modification time.
+
+Usage:
+    python zync_watch.py /shows/a/images/zync_manifest_shot010.json
+    python zync_watch.py --pattern /shows/a/images/bg/bg.####.exr --frames 1001-1100 --once
+
+From Python:
+    import zync_watch
+    watcher = zync_watch.OutputWatcher(zync_outputs.OutputManifest.load(path))
+    report = watcher.poll()
+    report.missing(), report.complete
+
+"""
+
+import json
+import optparse
+import os
+import re
+import sys
+import time
+
+import zync_frames
+import zync_outputs
+
+DEFAULT_INTERVAL = 30.0
+DEFAULT_TRUNCATED_FRACTION = 0.5
+
+# a frame needs this many sizes in its sequence to be judged truncated
+MIN_SIZES_FOR_MEDIAN = 3
+
+# folders modified this recently are listed again on the next poll, as a
+# file may have been added within the same modification time
+MTIME_GRANULARITY = 2.0
+
+class SequenceStatus(object):
+    """The arrival status of one OutputSequence, as FrameSets"""
+    __slots__ = ('sequence', 'arrived', 'missing', 'zero_byte', 'truncated')
+
+    def __init__(self, sequence, arrived, missing, zero_byte, truncated):
+        self.sequence = sequence
+        self.arrived = arrived
+        self.missing = missing
+        self.zero_byte = zero_byte
+        self.truncated = truncated
+
+    @property
+    def complete(self):
+        return not self.missing and not self.zero_byte and not self.truncated
+
+    def to_dict(self):
+        return {'layer': self.sequence.layer,
+                'pass': self.sequence.pass_name,
+                'pattern': self.sequence.pattern,
+                'expected': len(self.sequence),
+                'arrived': self.arrived.to_string(),
+                'missing': self.missing.to_string(),
+                'zero_byte': self.zero_byte.to_string(),
+                'truncated': self.truncated.to_string()}
+
+class WatchReport(object):
+    """The SequenceStatus of every sequence after a poll, with the poll's costs"""
+    def __init__(self, statuses, listed=0, skipped=0, statted=0):
+        self.statuses = statuses
+        self.listed = listed
+        self.skipped = skipped
+        self.statted = statted
+
+    @property
+    def complete(self):
+        return all([status.complete for status in self.statuses])
+
+    def _count(self, name):
+        return sum([len(getattr(status, name)) for status in self.statuses])
+
+    def expected(self):
+        return sum([len(status.sequence) for status in self.statuses])
+
+    def arrived(self):
+        return self._count('arrived')
+
+    def missing(self):
+        return self._count('missing')
+
+    def zero_byte(self):
+        return self._count('zero_byte')
+
+    def truncated(self):
+        return self._count('truncated')
+
+    def to_dict(self):
+        return {'complete': self.complete,
+                'expected': self.expected(),
+                'arrived': self.arrived(),
+                'missing': self.missing(),
+                'zero_byte': self.zero_byte(),
+                'truncated': self.truncated(),
+                'sequences': [status.to_dict() for status in self.statuses]}
+
+    def format(self, verbose=False):
+        """Returns the report as text, listing only incomplete sequences unless verbose"""
+        lines = ['%d of %d frames arrived, %d missing, %d zero-byte, %d truncated' % (
+            self.arrived(), self.expected(), self.missing(), self.zero_byte(), self.truncated())]
+        for status in self.statuses:
+            if status.complete and not verbose:
+                continue
+            lines.append('  %s' % status.sequence.pattern)
+            for name in ('missing', 'zero_byte', 'truncated'):
+                frames = getattr(status, name)
+                if frames:
+                    lines.append('    %-10s %s' % (name.replace('_', '-'), frames))
+            if status.complete:
+                lines.append('    complete')
+        return '\n'.join(lines)
+
+class _SequenceState(object):
+    """The sizes seen so far for the frames of one sequence"""
+    def __init__(self, sequence):
+        self.sequence = sequence
+        directory, self.prefix = os.path.split(sequence.head)
+        self.regex = re.compile('^%s(-?\d+)%s$' % (re.escape(self.prefix), re.escape(sequence.tail)))
+        self.sizes = {}
+        self.status = None
+
+    def match(self, name):
+        """Returns the expected frame a file name is for, or None"""
+        match = self.regex.match(name)
+        if match is None:
+            return None
+        digits = match.group(1)
+        if len(digits.lstrip('-')) < self.sequence.padding:
+            return None
+        frame = int(digits)
+        if frame not in self.sequence.frames:
+            return None
+        return frame
+
+    def update(self, frame, size):
+        if self.sizes.get(frame) != size:
+            self.sizes[frame] = size
+            self.status = None
+
+    def remove(self, frame):
+        if frame in self.sizes:
+            del self.sizes[frame]
+            self.status = None
+
+    def suspects(self, truncated_fraction):
+        """Returns the frames whose size may still change: empty or truncated ones"""
+        status = self.get_status(truncated_fraction)
+        return list(status.zero_byte) + list(status.truncated)
+
+    def get_status(self, truncated_fraction):
+        if self.status is not None:
+            return self.status
+        arrived = zync_frames.FrameSet.from_frames(self.sizes)
+        zero_byte = zync_frames.FrameSet.from_frames([f for f, size in self.sizes.items() if not size])
+        sizes = sorted([size for size in self.sizes.values() if size])
+        truncated = zync_frames.FrameSet()
+        if len(sizes) >= MIN_SIZES_FOR_MEDIAN:
+            limit = sizes[len(sizes) // 2] * truncated_fraction
+            truncated = zync_frames.FrameSet.from_frames([f for f, size in self.sizes.items()
+                                                          if size and size < limit])
+        missing = self.sequence.frames - arrived
+        self.status = SequenceStatus(self.sequence, arrived, missing, zero_byte, truncated)
+        return self.status
+
+class _DirectoryState(object):
+    """What was last seen in one output folder"""
+    def __init__(self, path, sequences):
+        self.path = path
+        self.sequences = sequences
+        self.mtime = None
+        self.relist = True
+        self.names = {}
+
+class OutputWatcher(object):
+    """
+    Polls the output folders of an OutputManifest, keeping what it saw so
+    each poll only looks at what changed.
+    """
+    def __init__(self, manifest, truncated_fraction=DEFAULT_TRUNCATED_FRACTION, clock=time.time):
+        self.manifest = manifest
+        self.truncated_fraction = truncated_fraction
+        self.clock = clock
+        self._directories = []
+        for directory, sequences in sorted(manifest.by_directory().items()):
+            states = [_SequenceState(sequence) for sequence in sequences]
+            self._directories.append(_DirectoryState(directory or '.', states))
+
+    def _stat_file(self, path):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return None
+
+    def _poll_directory(self, state, counts):
+        try:
+            mtime = os.stat(state.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime is None:
+            # the folder doesn't exist (yet), so nothing arrived
+            for name, (sequence, frame) in state.names.items():
+                sequence.remove(frame)
+            state.names.clear()
+            state.mtime = None
+            counts['skipped'] += 1
+            return
+
+        if mtime == state.mtime and not state.relist:
+            counts['skipped'] += 1
+        else:
+            counts['listed'] += 1
+            try:
+                names = set(os.listdir(state.path))
+            except OSError:
+                names = set()
+            for name in list(state.names):
+                if name not in names:
+                    sequence, frame = state.names.pop(name)
+                    sequence.remove(frame)
+            for name in names:
+                if name in state.names:
+                    continue
+                for sequence in state.sequences:
+                    frame = sequence.match(name)
+                    if frame is not None:
+                        size = self._stat_file(os.path.join(state.path, name))
+                        counts['statted'] += 1
+                        if size is not None:
+                            state.names[name] = (sequence, frame)
+                            sequence.update(frame, size)
+                        break
+            state.mtime = mtime
+            state.relist = self.clock() - mtime < MTIME_GRANULARITY
+
+        # files still being written grow without changing their folder's mtime
+        for sequence in state.sequences:
+            for frame in sequence.suspects(self.truncated_fraction):
+                size = self._stat_file(sequence.sequence.path(frame))
+                counts['statted'] += 1
+                if size is None:
+                    sequence.remove(frame)
+                else:
+                    sequence.update(frame, size)
+
+    def poll(self):
+        """Looks for new arrivals and returns a WatchReport"""
+        counts = {'listed': 0, 'skipped': 0, 'statted': 0}
+        for state in self._directories:
+            self._poll_directory(state, counts)
+        statuses = []
+        for state in self._directories:
+            for sequence in state.sequences:
+                statuses.append(sequence.get_status(self.truncated_fraction))
+        return WatchReport(statuses, counts['listed'], counts['skipped'], counts['statted'])
+
+    def watch(self, interval=DEFAULT_INTERVAL, timeout=None, callback=None):
+        """
+        Polls every interval seconds until every frame has arrived complete,
+        or timeout seconds passed. callback(report) is called after each
+        poll. Returns the last report.
+        """
+        start = self.clock()
+        while True:
+            report = self.poll()
+            if callback is not None:
+                callback(report)
+            if report.complete:
+                return report
+            if timeout is not None and self.clock() - start + interval > timeout:
+                return report
+            time.sleep(interval)
+
+def manifest_for_pattern(pattern, frames):
+    """
+    Returns an OutputManifest for a single sequence, from a path with a run
+    of #s for the frame number, like /images/bg/bg.####.exr
+    """
+    directory, name = os.path.split(pattern)
+    match = re.search(r'#+', name)
+    if match is None:
+        raise ValueError('No #s for the frame number in %r' % pattern)
+    head = os.path.join(directory, name[:match.start()])
+    sequence = zync_outputs.OutputSequence(None, None, head, name[match.end():],
+                                           len(match.group(0)), zync_frames.parse(frames))
+    return zync_outputs.OutputManifest([sequence])
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] [MANIFEST]')
+    parser.add_option('--pattern', help='watch a single sequence, like /images/bg/bg.####.exr')
+    parser.add_option('--frames', help='the frames of --pattern, like 1001-1100')
+    parser.add_option('--interval', type='float', default=DEFAULT_INTERVAL, help='seconds between polls')
+    parser.add_option('--timeout', type='float', default=None, help='give up after this many seconds')
+    parser.add_option('--once', action='store_true', help='poll once and exit')
+    parser.add_option('--truncated-fraction', type='float', default=DEFAULT_TRUNCATED_FRACTION,
+                      help='frames smaller than this fraction of the median size are truncated')
+    parser.add_option('--json', action='store_true', help='print the final report as JSON')
+    parser.add_option('-v', '--verbose', action='store_true', help='list complete sequences too')
+    options, args = parser.parse_args(argv)
+
+    if options.pattern:
+        if not options.frames:
+            parser.error('--pattern needs --frames')
+        manifest = manifest_for_pattern(options.pattern, options.frames)
+    elif len(args) == 1:
+        manifest = zync_outputs.OutputManifest.load(args[0])
+    else:
+        parser.error('give a manifest, or --pattern and --frames')
+
+    watcher = OutputWatcher(manifest, options.truncated_fraction)
+
+    def show(report):
+        if not options.json:
+            print time.strftime('[%H:%M:%S]'), report.format(options.verbose)
+            sys.stdout.flush()
+
+    if options.once:
+        report = watcher.poll()
+        show(report)
+    else:
+        report = watcher.watch(options.interval, options.timeout, show)
+    if options.json:
+        print json.dumps(report.to_dict(), indent=1)
+    return 0 if report.complete else 1
+
+if __name__ == '__main__':
+    sys.exit(main())